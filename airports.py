@@ -0,0 +1,180 @@
+import array
+import csv
+import os
+import pickle
+
+from registry import ISO_COUNTRIES
+
+# Column names accepted for each field (our own format and the OurAirports dump)
+COLUMN_ALIASES = {
+    "iata": ("iata", "iata_code"),
+    "icao": ("icao", "icao_code", "gps_code", "ident"),
+    "name": ("name", "airport"),
+    "city": ("city", "municipality"),
+    "country": ("country", "iso_country"),
+    "lat": ("lat", "latitude", "latitude_deg"),
+    "lon": ("lon", "longitude", "longitude_deg"),
+}
+
+CACHE_VERSION = 2
+
+
+class AirportTable:
+    # Every field is stored as a column, a row is just an index into them
+    __slots__ = ("iata", "icao", "names", "cities", "country_ids", "country_names",
+                 "lat", "lon", "search_text", "_index")
+
+    def __init__(self):
+        self.iata = []
+        self.icao = []
+        self.names = []
+        self.cities = []
+        self.country_ids = array.array("H")
+        self.country_names = []
+        self.lat = array.array("d")
+        self.lon = array.array("d")
+        self.search_text = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self.lat)
+
+    def append(self, iata, icao, name, city, country, lat, lon, country_ids=None):
+        if country_ids is None:
+            country_ids = {}
+        cid = country_ids.get(country)
+        if cid is None:
+            cid = len(self.country_names)
+            country_ids[country] = cid
+            self.country_names.append(country)
+
+        row = len(self.lat)
+        self.iata.append(iata)
+        self.icao.append(icao)
+        self.names.append(name)
+        self.cities.append(city)
+        self.country_ids.append(cid)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.search_text.append(f"{iata} {icao} {name} {city}".lower())
+
+        if iata:
+            self._index.setdefault(iata, row)
+        if icao:
+            self._index.setdefault(icao, row)
+
+    def find(self, code):
+        if not code:
+            return None
+        return self._index.get(code.upper())
+
+    def coordinates(self, row):
+        return self.lat[row], self.lon[row]
+
+    def country(self, row):
+        return self.country_names[self.country_ids[row]]
+
+    def code(self, row):
+        return self.iata[row] or self.icao[row]
+
+    def label(self, row):
+        city = f" ({self.cities[row]})" if self.cities[row] else ""
+        return f"{self.code(row)} - {self.names[row]}{city}"
+
+    # Exact codes first, then prefix matches on codes, then anything containing the text
+    def search(self, query, limit=20):
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        results = []
+        exact = self.find(query)
+        if exact is not None:
+            results.append(exact)
+
+        contains = []
+        for row, text in enumerate(self.search_text):
+            if row == exact:
+                continue
+            if text.startswith(query):
+                results.append(row)
+                if len(results) >= limit:
+                    return results
+            elif len(contains) < limit and query in text:
+                contains.append(row)
+
+        return (results + contains)[:limit]
+
+
+def _read_csv(csv_path):
+    table = AirportTable()
+    country_ids = {}
+
+    with open(csv_path, encoding="utf-8-sig") as csvfile:
+        reader = csv.reader(csvfile)
+        headers = [h.replace('"', '').strip().lower() for h in next(reader)]
+
+        columns = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias in headers:
+                    columns[field] = headers.index(alias)
+                    break
+
+        if "lat" not in columns or "lon" not in columns:
+            return table
+
+        def cell(row, field):
+            i = columns.get(field)
+            return row[i].strip() if i is not None and i < len(row) else ""
+
+        for row in reader:
+            iata = cell(row, "iata").upper()
+            icao = cell(row, "icao").upper()
+            if not iata and not icao:
+                continue
+            try:
+                lat = float(cell(row, "lat"))
+                lon = float(cell(row, "lon"))
+            except ValueError:
+                continue
+
+            # iso_country holds codes like "ES", stored as the country of the coordinates sheet
+            country = cell(row, "country")
+            table.append(iata, icao, cell(row, "name"), cell(row, "city"),
+                         ISO_COUNTRIES.get(country, country), lat, lon, country_ids)
+
+    return table
+
+
+# Loads the airport csv, reusing a pickled copy of the columns while the csv is unchanged
+def load_airports(csv_path, cache_path=None):
+    table = AirportTable()
+    if not os.path.exists(csv_path):
+        return table
+
+    stat = os.stat(csv_path)
+    stamp = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached_stamp, columns = pickle.load(f)
+            if cached_stamp == stamp:
+                for name, value in zip(AirportTable.__slots__, columns):
+                    setattr(table, name, value)
+                return table
+        except Exception:
+            pass
+
+    table = _read_csv(csv_path)
+
+    if cache_path:
+        try:
+            columns = [getattr(table, name) for name in AirportTable.__slots__]
+            with open(cache_path, "wb") as f:
+                pickle.dump((stamp, columns), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
+
+    return table
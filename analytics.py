@@ -0,0 +1,348 @@
+import argparse
+import atexit
+import glob
+import heapq
+import json
+import math
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+ANALYTICS_DIR = os.environ.get("WORLDAIR_ANALYTICS_DIR", os.path.join(base_path, "analytics"))
+MAX_FILE_BYTES = int(os.environ.get("WORLDAIR_ANALYTICS_MAX_BYTES", 16 * 2 ** 20))
+MAX_FILES = int(os.environ.get("WORLDAIR_ANALYTICS_MAX_FILES", 20))
+
+# The writer waits this long or for this many records, whichever comes first
+FLUSH_SECONDS = 1.0
+BATCH_SIZE = 500
+# Past this many pending records new ones are dropped, the handler never waits
+QUEUE_SIZE = 10000
+
+# Record on disk: length and crc32 of the payload, then the payload.
+# Payload: time, distance (km), price (double, yen and won prices are large), latency (s),
+# then six length-prefixed UTF-8 strings
+HEADER = struct.Struct("<HI")
+NUMBERS = struct.Struct("<dfdf")
+FIELDS = ("origin", "destiny", "class", "season", "airline", "currency")
+
+
+def encode(record):
+    payload = NUMBERS.pack(record["time"], record["distance"], record["price"], record["latency"])
+    for name in FIELDS:
+        # Cut to 255 bytes without splitting a character
+        text = str(record[name] or "").encode("utf-8")[:255].decode("utf-8", "ignore").encode("utf-8")
+        payload += bytes((len(text),)) + text
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode(payload):
+    timestamp, distance, price, latency = NUMBERS.unpack_from(payload)
+    record = {"time": timestamp, "distance": distance, "price": price, "latency": latency}
+    offset = NUMBERS.size
+    for name in FIELDS:
+        size = payload[offset]
+        record[name] = payload[offset + 1:offset + 1 + size].decode("utf-8")
+        offset += 1 + size
+    return record
+
+
+class AnalyticsLog:
+    # One file per process, so workers behind serve.py never write to the same file
+    def __init__(self, directory=ANALYTICS_DIR, max_bytes=MAX_FILE_BYTES, max_files=MAX_FILES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.prefix = f"calculations-{os.getpid()}"
+        self.counters = {"queued": 0, "written": 0, "dropped": 0, "flushes": 0, "rotations": 0}
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._file = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{self.prefix}.log")
+
+    # Called from the UI handler: only a put_nowait, the writer thread does the rest
+    def record(self, origin, destiny, travel_class, season, airline, distance, price, currency, latency):
+        self._start()
+        try:
+            self._queue.put_nowait({
+                "time": time.time(),
+                "origin": origin,
+                "destiny": destiny,
+                "class": travel_class,
+                "season": season,
+                "airline": airline,
+                "distance": distance,
+                "price": price,
+                "currency": currency,
+                "latency": latency,
+            })
+            self._count("queued")
+        except queue.Full:
+            self._count("dropped")
+
+    # Handlers, the writer and stats readers all touch the counters
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="analytics-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is None:
+                return
+            deadline = time.monotonic() + FLUSH_SECONDS
+            while len(batch) < BATCH_SIZE:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._write(batch)
+                    return
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            data = b"".join(encode(record) for record in batch)
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = open(self.path, "ab")
+            if self._file.tell() + len(data) > self.max_bytes and self._file.tell() > 0:
+                self._rotate()
+            # One write per batch, appended
+            self._file.write(data)
+            self._file.flush()
+            self._count("written", len(batch))
+            self._count("flushes")
+        except (OSError, struct.error) as ex:
+            self._count("dropped", len(batch))
+            print(f"Analytics write failed: {ex}")
+
+    def _rotate(self):
+        self._file.close()
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.counters['rotations']}"
+        os.replace(self.path, os.path.join(self.directory, f"{self.prefix}-{stamp}.log"))
+        self._file = open(self.path, "ab")
+        self._count("rotations")
+        # Rotated files and the live files of workers that are gone, never the file of a running worker
+        old = sorted((path for path in log_files(self.directory) if not is_live(path)), key=os.path.getmtime)
+        for path in old[:max(0, len(old) - self.max_files)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # Writes what is still queued, then stops the writer
+    def close(self, timeout=5):
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+ANALYTICS = AnalyticsLog()
+
+
+# True for calculations-<pid>.log while that process runs, rotated files never are
+def is_live(path):
+    pid = os.path.basename(path)[len("calculations-"):-len(".log")]
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OverflowError):
+        return True
+    return True
+
+
+def log_files(directory=ANALYTICS_DIR):
+    return glob.glob(os.path.join(directory, "calculations-*.log"))
+
+
+# Streams every record, oldest file first. A torn record at the end of a file
+# (the process died mid-write) ends that file instead of failing the whole read
+def read_records(directory=ANALYTICS_DIR):
+    for path in sorted(log_files(directory), key=os.path.getmtime):
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                size, crc = HEADER.unpack(header)
+                payload = f.read(size)
+                if len(payload) < size or zlib.crc32(payload) != crc:
+                    print(f"Analytics: {os.path.basename(path)} ends with a damaged record, skipped")
+                    break
+                yield decode(payload)
+
+
+class TopK:
+    # Space-Saving: at most capacity counters however many distinct keys the log has.
+    # Counts of the top keys are exact unless they were evicted, then off by at most "error"
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # One (count, key) per key. Counts only grow, so an entry may be behind its key but never ahead
+        self._heap = []
+
+    def add(self, key):
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (1, key))
+        else:
+            floor, smallest = self._heap[0]
+            # Catch stale entries up until the top one is the real minimum
+            while floor != self.counts[smallest]:
+                heapq.heapreplace(self._heap, (self.counts[smallest], smallest))
+                floor, smallest = self._heap[0]
+            del self.counts[smallest]
+            del self.errors[smallest]
+            heapq.heapreplace(self._heap, (floor + 1, key))
+            self.counts[key] = floor + 1
+            self.errors[key] = floor
+
+    def top(self, n):
+        ranked = sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+        return [(key, count, self.errors[key]) for key, count in ranked]
+
+
+class LogHistogram:
+    # Fixed buckets at powers of 2 ** (1 / steps), so memory does not grow with the log
+    def __init__(self, steps=4):
+        self.steps = steps
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.low = math.inf
+        self.high = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.low = min(self.low, value)
+        self.high = max(self.high, value)
+        index = math.floor(math.log2(value) * self.steps) if value > 0 else -10 ** 6
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q):
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= q * self.count:
+                return min(self.high, 2 ** ((index + 1) / self.steps))
+        return self.high
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "min": self.low,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.high,
+        }
+
+
+# One pass over the log, memory bounded by the counters and buckets
+def build_report(records, top=20, since=None):
+    routes = TopK()
+    destinations = TopK()
+    mix = {"class": {}, "season": {}, "airline": {}}
+    prices = {}
+    distance = LogHistogram()
+    latency = LogHistogram()
+    total = 0
+    for record in records:
+        if since and record["time"] < since:
+            continue
+        total += 1
+        routes.add(f"{record['origin']} -> {record['destiny']}")
+        destinations.add(record["destiny"])
+        for name, counts in mix.items():
+            counts[record[name]] = counts.get(record[name], 0) + 1
+        prices.setdefault(record["currency"], LogHistogram()).add(record["price"])
+        distance.add(record["distance"])
+        latency.add(record["latency"])
+    return {
+        "calculations": total,
+        "top_routes": routes.top(top),
+        "top_destinations": destinations.top(top),
+        "mix": mix,
+        "price": {currency: h.summary() for currency, h in sorted(prices.items())},
+        "distance_km": distance.summary(),
+        "latency_s": latency.summary(),
+    }
+
+
+def print_report(report):
+    print(f"{report['calculations']} calculations")
+    print("\nTop routes")
+    for route, count, error in report["top_routes"]:
+        print(f"  {count:8}{f' (±{error})' if error else ''}  {route}")
+    print("\nTop destinations (candidates for pre-warming)")
+    for destiny, count, error in report["top_destinations"]:
+        print(f"  {count:8}{f' (±{error})' if error else ''}  {destiny}")
+    for name, counts in report["mix"].items():
+        print(f"\n{name.capitalize()}: " + ", ".join(f"{k} {v}" for k, v in sorted(counts.items(), key=lambda i: -i[1])))
+    print("\nPrice")
+    for currency, s in report["price"].items():
+        print(f"  {currency}: {s['count']} quotes, mean {s['mean']:,.2f}, p50 {s['p50']:,.2f}, "
+              f"p90 {s['p90']:,.2f}, min {s['min']:,.2f}, max {s['max']:,.2f}")
+    for name in ("distance_km", "latency_s"):
+        s = report[name]
+        if s["count"]:
+            print(f"\n{name}: mean {s['mean']:,.3f}, p50 {s['p50']:,.3f}, p90 {s['p90']:,.3f}, p99 {s['p99']:,.3f}, max {s['max']:,.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports over the calculations log")
+    parser.add_argument("--dir", default=ANALYTICS_DIR)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--days", type=float, help="only the last N days")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    since = time.time() - args.days * 24 * 60 * 60 if args.days else None
+    report = build_report(read_records(args.dir), args.top, since)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
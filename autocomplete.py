@@ -0,0 +1,106 @@
+import heapq
+from collections import defaultdict
+
+from registry import normalize
+
+# Ranking of the different kinds of match, higher is better
+EXACT = 4
+PREFIX = 3
+WORD_PREFIX = 2
+
+
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self.values = []
+        self.texts = []
+        self._trigrams = defaultdict(list)
+        self._short = defaultdict(list)
+        self._exact = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value, text):
+        text = normalize(text)
+        if not text:
+            return
+        entry = len(self.values)
+        self.values.append(value)
+        self.texts.append(text)
+        self._exact.setdefault(text, value)
+
+        for gram in trigrams(text):
+            self._trigrams[gram].append(entry)
+
+        # One and two character queries (and most CJK names) go through substrings
+        short = set()
+        for i in range(len(text)):
+            short.add(text[i])
+            short.add(text[i:i + 2])
+        for piece in short:
+            self._short[piece].append(entry)
+
+    def _score(self, entry, query, overlap=0.0):
+        text = self.texts[entry]
+        if text == query:
+            return EXACT
+        if text.startswith(query):
+            return PREFIX
+        if f" {query}" in text:
+            return WORD_PREFIX
+        if query in text:
+            return 1 + overlap / 2
+        return overlap
+
+    # Value of a name written exactly (accents and case aside), None otherwise
+    def exact(self, query):
+        return self._exact.get(normalize(query))
+
+    def search(self, query, limit=10):
+        query = normalize(query)
+        if not query:
+            return []
+
+        best = {}
+        if len(query) <= 2:
+            for entry in self._short.get(query, ()):
+                score = self._score(entry, query)
+                value = self.values[entry]
+                if score > best.get(value, (0, ""))[0]:
+                    best[value] = (score, self.texts[entry])
+        else:
+            grams = trigrams(query)
+            hits = defaultdict(int)
+            for gram in grams:
+                for entry in self._trigrams.get(gram, ()):
+                    hits[entry] += 1
+
+            # Ignore entries sharing too few trigrams to be a plausible typo
+            needed = max(1, len(grams) // 3)
+            for entry, count in hits.items():
+                if count < needed:
+                    continue
+                score = self._score(entry, query, count / len(grams))
+                value = self.values[entry]
+                if score > best.get(value, (0, ""))[0]:
+                    best[value] = (score, self.texts[entry])
+
+        ranked = heapq.nsmallest(
+            limit, best.items(), key=lambda item: (-item[1][0], len(item[1][1]), item[1][1])
+        )
+        return [value for value, _ in ranked]
+
+
+# Every translated name plus the english key points to the country key
+def build_country_index(registry):
+    index = AutocompleteIndex()
+    for record in registry:
+        names = {record.key, *record.names.values()}
+        for name in names:
+            index.add(record.key, name)
+    return index
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from geodesy import DistanceTable, calculate_bearing, haversine, interpolate_great_circle, np, vincenty, vincenty_batch
+from pricing import AIRLINES, quote
+from registry import CountryRegistry, _read_coordinates, build_registry
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+BASELINE_PATH = os.path.join(base_path, "bench_baseline.json")
+DEFAULT_THRESHOLD = 10.0
+# Full runs behind a saved baseline, each case keeps its median
+SAVE_RUNS = 5
+# A shared machine can slow one case for a whole run. Flagged cases are run again,
+# only the ones slower in every run fail the gate
+CONFIRM_RUNS = 2
+
+# numpy work is bound by memory and vector units, which the interpreter loop does not track.
+# These cases are scaled by numpy_calibration instead, and get a wider threshold
+NUMPY_CASES = {"vincenty_batch x all country pairs"}
+NUMPY_THRESHOLD_FACTOR = 2
+
+DATA_FILES = ["countries.json", "currency.json", "country_language.json", "languages.json"]
+
+# Madrid -> Tokyo, long enough to go through every pricing branch
+ROUTE = (40.4168, -3.7038, 35.6762, 139.6503)
+
+
+def load_json(name):
+    with open(os.path.join(base_path, name), "r", encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+# Plain interpreter work, tracks how fast the machine is during this run
+def calibration():
+    total = 0
+    for i in range(1000):
+        total += i * i % 7
+    return total
+
+
+# Elementwise trig over arrays as large as vincenty_batch's intermediates all together,
+# a working set that fits in the core's cache misses the memory contention the batch sees
+def numpy_calibration(values):
+    return np.sqrt(np.sin(values) ** 2 + np.cos(values) * np.tan(values * 0.5))
+
+
+def bench_quotes():
+    for distance in (800, 6500, 11000):
+        for airline in AIRLINES:
+            quote(distance, "First class", "High season", airline, "EUR")
+
+
+def bench_coordinates_csv():
+    _read_coordinates(CountryRegistry(), os.path.join(base_path, "coordinates-Sheet.csv"))
+
+
+def bench_json_loads():
+    for name in DATA_FILES:
+        load_json(name)
+
+
+# Every pair of countries, the work behind the distance table
+def country_pairs():
+    registry = CountryRegistry()
+    _read_coordinates(registry, os.path.join(base_path, "coordinates-Sheet.csv"))
+    points = list(registry.coordinates.values())
+    pairs = [(a[0], a[1], b[0], b[1]) for a in points for b in points]
+    return registry.coordinates, [list(column) for column in zip(*pairs)]
+
+
+def benchmarks():
+    # The curve and vincenty are memoized for the app, the benchmark measures the computation itself
+    interpolate = interpolate_great_circle.__wrapped__
+    geodesic = vincenty.__wrapped__
+    translations, currency, languages = (load_json(n) for n in DATA_FILES[:3])
+    coordinates, columns = country_pairs()
+    table = DistanceTable(coordinates)
+    table.get("Spain", "Japan")
+
+    cases = {
+        "calibration": calibration,
+        "haversine": lambda: haversine(*ROUTE),
+        # The two distance modes side by side: per quote, then the whole country table
+        "vincenty": lambda: geodesic(*ROUTE),
+        "distance_table.get": lambda: table.get("Spain", "Japan"),
+        "haversine x all country pairs": lambda: [haversine(*p) for p in zip(*columns)],
+        "vincenty_batch x all country pairs": lambda: vincenty_batch(*columns),
+        "calculate_bearing": lambda: calculate_bearing(*ROUTE),
+        "pricing.quote x9": bench_quotes,
+        "coordinates_csv.parse": bench_coordinates_csv,
+        "registry.build": lambda: build_registry(
+            os.path.join(base_path, "coordinates-Sheet.csv"), translations, currency, languages
+        ),
+        "json.load data files": bench_json_loads,
+    }
+    for steps in (10, 150, 1000):
+        cases[f"interpolate_great_circle[{steps}]"] = lambda steps=steps: interpolate(*ROUTE, steps)
+    if np is not None:
+        values = np.linspace(0.1, 1.4, len(columns[0]) * 16)
+        cases["numpy_calibration"] = lambda: numpy_calibration(values)
+    return cases
+
+
+def is_calibration(name):
+    return name in ("calibration", "numpy_calibration")
+
+
+# Rounds are interleaved so a burst of load on the machine hits every benchmark alike.
+# Best round wins, in microseconds per call
+def run(selected=None, repeat=5, round_time=0.1):
+    cases = {
+        name: fn for name, fn in benchmarks().items()
+        if is_calibration(name) or not selected or any(s in name for s in selected)
+    }
+    timers = {}
+    for name, fn in cases.items():
+        timer = timeit.Timer(fn)
+        number, elapsed = timer.autorange()
+        timers[name] = (timer, max(1, int(number * round_time / max(elapsed, 1e-9))))
+
+    results = {name: float("inf") for name in cases}
+    for _ in range(repeat):
+        for name, (timer, number) in timers.items():
+            results[name] = min(results[name], timer.timeit(number) / number * 1e6)
+
+    for name, value in results.items():
+        print(f"{name:36} {value:12.2f} us")
+    return results
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    data = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "unit": "us",
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Baseline written to {path}")
+
+
+# Median of several full runs per case, so one noisy run does not become the baseline.
+# Each run is its own process like a gate run: numpy is faster once a process reuses its buffers
+def run_median(selected, repeat, runs):
+    samples = []
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, "run.json")
+        for _ in range(runs):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--repeat", str(repeat), "--json", path,
+                            "--baseline", os.path.join(scratch, "none.json"), *(selected or [])],
+                            stdout=subprocess.DEVNULL, check=True)
+            with open(path, "r", encoding="utf-8") as f:
+                samples.append(json.load(f))
+    results = {name: statistics.median(sample[name] for sample in samples) for name in samples[0]}
+    print(f"\nMedian of {runs} runs")
+    for name, value in results.items():
+        print(f"{name:36} {value:12.2f} us")
+    return results
+
+
+def speed_scale(results, baseline, name):
+    base = baseline["results"].get(name)
+    if base and name in results:
+        return results[name] / base
+    return 1.0
+
+
+# Returns the names slower than the baseline by more than threshold percent.
+# Results are first scaled by their calibration, so a slower or busier machine is not a regression
+def compare(results, baseline, threshold, normalize=True):
+    scales = {"calibration": 1.0, "numpy_calibration": 1.0}
+    if normalize:
+        for calibration_name in scales:
+            scales[calibration_name] = speed_scale(results, baseline, calibration_name)
+        print(f"Machine speed vs baseline: x{1 / scales['calibration']:.2f}, "
+              f"numpy x{1 / scales['numpy_calibration']:.2f}")
+
+    regressions = []
+    for name, value in results.items():
+        base = baseline["results"].get(name)
+        if is_calibration(name):
+            continue
+        if not base:
+            print(f"{name:36} no baseline")
+            continue
+        limit = threshold
+        if name in NUMPY_CASES:
+            value /= scales["numpy_calibration"]
+            limit *= NUMPY_THRESHOLD_FACTOR
+        else:
+            value /= scales["calibration"]
+        change = (value - base) / base * 100
+        flag = "REGRESSION" if change > limit else ""
+        print(f"{name:36} {base:12.2f} -> {value:12.2f} us {change:+7.1f}% {flag}")
+        if change > limit:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the geodesy, pricing and data loading paths")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=float(os.environ.get("BENCH_THRESHOLD", DEFAULT_THRESHOLD)),
+                        help="allowed slowdown in percent before failing")
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=SAVE_RUNS, help="full runs behind --save, medians are kept")
+    parser.add_argument("--confirm", type=int, default=CONFIRM_RUNS,
+                        help="times a flagged benchmark is run again before it fails the gate")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--no-normalize", action="store_true", help="compare raw times, without the calibration loop")
+    parser.add_argument("filter", nargs="*", help="only run benchmarks whose name contains one of these")
+    args = parser.parse_args()
+
+    if args.save:
+        results = run_median(args.filter, args.repeat, args.runs)
+    else:
+        results = run(args.filter, args.repeat)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print("No baseline yet, run with --save to create one")
+        return 0
+
+    print()
+    regressions = compare(results, baseline, args.threshold, not args.no_normalize)
+    for attempt in range(args.confirm):
+        if not regressions:
+            break
+        print(f"\nRunning {len(regressions)} flagged benchmark(s) again, {attempt + 1}/{args.confirm}")
+        rerun = run(regressions, args.repeat)
+        print()
+        regressions = [name for name in compare(rerun, baseline, args.threshold, not args.no_normalize)
+                       if name in regressions]
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
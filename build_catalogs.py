@@ -0,0 +1,37 @@
+import argparse
+import json
+import os
+import sys
+
+from i18n import CATALOG_DIR, LANGUAGE_NAMES, catalog_path, compile_language, load_languages, validate
+
+
+# Checks languages.json and writes one compiled catalog per language into catalogs/
+def main():
+    parser = argparse.ArgumentParser(description="Validate languages.json and build the per-language catalogs")
+    parser.add_argument("--output", default=CATALOG_DIR)
+    parser.add_argument("--check", action="store_true", help="only validate, write nothing")
+    args = parser.parse_args()
+
+    languages = load_languages()
+    problems = validate(languages)
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"{len(problems)} problem(s) in languages.json, no catalogs written")
+        return 1
+    if args.check:
+        print(f"{len(LANGUAGE_NAMES)} languages OK")
+        return 0
+
+    os.makedirs(args.output, exist_ok=True)
+    for code in LANGUAGE_NAMES:
+        path = catalog_path(code, args.output)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(compile_language(code, languages[code]), f, ensure_ascii=False, separators=(",", ":"))
+        print(f"{code}: {os.path.getsize(path)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+import time
+
+from places import BUNDLE_PATH, CACHE, DEFAULT_CATEGORY, DEFAULT_RADIUS, fetch_tourist_places, places_key
+from registry import build_registry
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_json(name):
+    with open(os.path.join(base_path, name), "r", encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+# Fetches the tourist places of every country centroid into places_bundle.json
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline tourist places bundle")
+    parser.add_argument("--output", default=BUNDLE_PATH)
+    parser.add_argument("--radius", type=int, default=DEFAULT_RADIUS)
+    parser.add_argument("--category", default=DEFAULT_CATEGORY)
+    parser.add_argument("--delay", type=float, default=0.25, help="seconds between requests")
+    args = parser.parse_args()
+
+    registry = build_registry(
+        os.path.join(base_path, "coordinates-Sheet.csv"),
+        load_json("countries.json"),
+        load_json("currency.json"),
+        load_json("country_language.json"),
+    )
+
+    bundle = {}
+    if os.path.exists(args.output):
+        with open(args.output, "r", encoding="utf-8") as f:
+            bundle = json.load(f)
+
+    for record in registry:
+        key = places_key(record.lat, record.lon, args.radius, args.category)
+        try:
+            places = fetch_tourist_places(record.lat, record.lon, args.radius, args.category)
+        except Exception as ex:
+            print(f"{record.key}: failed ({ex})")
+            continue
+
+        bundle[key] = places
+        CACHE.set("places", key, places)
+        print(f"{record.key}: {len(places)} places")
+        time.sleep(args.delay)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(bundle, f, indent=1, ensure_ascii=False)
+    print(f"Wrote {len(bundle)} locations to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import math
+from collections import deque
+
+TILE_SIZE = 256
+
+
+# Web mercator pixel position of a coordinate at a zoom level
+def project(lat, lon, zoom):
+    scale = TILE_SIZE * (2 ** zoom)
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = (lon + 180.0) / 360.0 * scale
+    sin_lat = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+
+class ClusteredPoints:
+    # Keeps at most max_points points, grouped in a pixel grid for the current zoom
+    def __init__(self, max_points=300, cell_size=64, zoom=0):
+        self.points = deque()
+        self.max_points = max_points
+        self.cell_size = cell_size
+        self.zoom = int(zoom)
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, point):
+        x, y = project(point[0], point[1], self.zoom)
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    # Returns the cells that changed, so only their markers have to be resent
+    def add(self, lat, lon, data=None):
+        point = (lat, lon, data)
+        self.points.append(point)
+        key = self._cell(point)
+        self.cells.setdefault(key, []).append(point)
+        changed = {key}
+
+        while len(self.points) > self.max_points:
+            old = self.points.popleft()
+            old_key = self._cell(old)
+            members = self.cells.get(old_key, [])
+            if old in members:
+                members.remove(old)
+            if not members:
+                self.cells.pop(old_key, None)
+            changed.add(old_key)
+
+        return changed
+
+    # Regroups the points only when the integer zoom level changes
+    def set_zoom(self, zoom):
+        zoom = int(zoom)
+        if zoom == self.zoom:
+            return False
+        self.zoom = zoom
+        self.cells = {}
+        for point in self.points:
+            self.cells.setdefault(self._cell(point), []).append(point)
+        return True
+
+    def cluster(self, key):
+        members = self.cells.get(key)
+        if not members:
+            return None
+        lat = sum(p[0] for p in members) / len(members)
+        lon = sum(p[1] for p in members) / len(members)
+        return lat, lon, members
+
+    def clusters(self):
+        for key in self.cells:
+            yield key, self.cluster(key)
+
+    def clear(self):
+        self.points.clear()
+        self.cells = {}
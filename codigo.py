@@ -2,13 +2,34 @@ import random
 import flet as ft
 import flet_map as fm
 import requests
-import csv
-import math
 import os
 import json
 import asyncio
+import time
 import tracemalloc
-from datetime import datetime
+import metrics
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from airports import load_airports
+from analytics import ANALYTICS
+from currencies import available_currencies, format_price, start_rates_refresher, usd_rate
+from deeplinks import parse_route_link
+from i18n import LANGUAGE_NAMES, catalog
+from registry import build_registry
+from autocomplete import build_country_index
+from clustering import ClusteredPoints
+from weather import cached_weather, start_weather_warmer, store_weather
+from places import get_tourist_places, peek_tourist_places
+from resilience import resilient
+from geocoding import SCHEDULER, geocode
+from ui_updates import MEASURE_BYTES, UpdateBatcher, on_page
+from session_tasks import TaskRegistry
+from session_state import SessionState
+from geodesy import DistanceTable, calculate_bearing, haversine, interpolate_great_circle, vincenty
+from thumbnails import cached_thumbnail, route_thumbnail
+from pricing import quote
+from upstreams import base_url, tile_url_template
 
 tracemalloc.start()
 
@@ -28,113 +49,81 @@ with open(countries_json_path, "r", encoding="utf-8-sig") as f:
 with open("country_language.json", "r", encoding="utf-8-sig") as f:
     COUNTRY_LANGUAGES = json.load(f)
 
-# Reads languages.json
-with open("languages.json", "r", encoding="utf-8-sig") as f:
-    LANGUAGES = json.load(f)
+# One record per country joining coordinates, translations, currency and languages
+COUNTRIES = build_registry(
+    os.path.join(base_path, "coordinates-Sheet.csv"),
+    country_translations,
+    CURRENCY,
+    COUNTRY_LANGUAGES,
+)
+for line in COUNTRIES.report():
+    print(f"Country data gap - {line}")
+
+# Accent-insensitive type-ahead over the country names in every language
+COUNTRY_INDEX = build_country_index(COUNTRIES)
+
+# WGS-84 distance between every pair of countries, built on the first ellipsoidal quote
+COUNTRY_DISTANCES = DistanceTable(COUNTRIES.coordinates)
+
+# Optional airport dataset (IATA/ICAO codes with coordinates), parsed once into columns
+AIRPORTS = load_airports(
+    os.path.join(base_path, "airports.csv"),
+    os.path.join(base_path, "airports.cache"),
+)
  
-EPSILON = 1e-10
-
-# Harvesine method
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371 # Earth radius
-    dlat = math.radians(lat2-lat1)
-    dlon = math.radians(lon2-lon1)
-    a = (math.sin(dlat/2)**2 +
-         math.cos(math.radians(lat1)) *
-         math.cos(math.radians(lat2)) *
-         math.sin(dlon/2)**2
-    )
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R*c
-
-def interpolate_great_circle(lat1, lon1, lat2, lon2, steps):
-
-    if lat1 == lat2 and lon1 == lon2:
-        return [(lat1, lon1)]
-
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-
-    d = 2 * math.asin(math.sqrt(
-        math.sin((lat2-lat1)/2)**2 +
-        math.cos(lat1) * math.cos(lat2) *
-        math.sin((lon2 - lon1)/2)**2
-    ))
-
-    coordinates = []
-    for i in range(steps + 1):
-        f = i / steps
-
-        if abs(d) < EPSILON:
-            A = 1.0
-            B = 0.0
-        else:
-            sin_d = math.sin(d)
-            A = math.sin((1 - f) * d) * sin_d
-            B = math.sin(f * d) / sin_d
+UPSTREAM_TIMEOUT = 5
 
-        x = A * math.cos(lat1) * math.cos(lon1) + B * math.cos(lat2) * math.cos(lon2)
-        y = A * math.cos(lat1) * math.sin(lon1) + B * math.cos(lat2) * math.sin(lon2)
-        z = A * math.sin(lat1) + B * math.sin(lat2)
+# Upstream fetchers raise on failure, the resilience layer turns that into stale data or a default
+@resilient("open-meteo", ttl=15 * 60, stale_ttl=6 * 60 * 60, default=(None, None), shared="temperature")
+def fetch_temperature(lat, lon):
+    url = f"{base_url('open-meteo')}/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true"
 
-        new_lat = math.atan2(z, math.sqrt(x*x + y*y))
-        new_lon = math.atan2(y, x)
+    r = requests.get(url, timeout=UPSTREAM_TIMEOUT)
+    data = r.json()
 
-        coordinates.append((math.degrees(new_lat), math.degrees(new_lon)))
-
-    return coordinates
-
-def calculate_bearing(lat1, lon1, lat2, lon2):
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-
-    dlon = lon2 - lon1
-    x = math.sin(dlon) * math.cos(lat2)
-    y = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlon)
-
-    return math.atan2(x, y)
+    temp = data["current_weather"]["temperature"]
+    weather_code = data["current_weather"]["weathercode"]
+    return temp, weather_code
 
 def get_temperature(lat, lon):
-    try:
-        url = (
-            "https://api.open-meteo.com/v1/forecast"
-            f"?latitude={lat}&longitude={lon}&current_weather=true"
-        )
-
-        r=requests.get(url)
-        data=r.json()
+    cached = cached_weather(lat, lon)
+    if cached:
+        return cached
+
+    temp, weather_code = fetch_temperature(lat, lon)
+    if temp is not None:
+        store_weather(lat, lon, temp, weather_code)
+    return temp, weather_code
+
+# The time zone of a place doesn't change, so only it is cached and the clock is read locally
+@resilient("timeapi", ttl=30 * 24 * 60 * 60, stale_ttl=365 * 24 * 60 * 60, shared="time_zone")
+def fetch_time_zone(lat, lon):
+    url = f"{base_url('timeapi')}/api/TimeZone/coordinate?latitude={lat}&longitude={lon}"
+    r = requests.get(url, timeout=UPSTREAM_TIMEOUT).json()
+
+    offset = (r.get("currentUtcOffset") or {}).get("seconds")
+    if offset is None:
+        raw_time = r["currentLocalTime"]
+        local = datetime.fromisoformat(raw_time.replace("Z", ""))
+        offset = round((local - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds() / 900) * 900
+
+    return r.get("timeZone"), offset
+
+def format_local_time(zone):
+    if zone is None:
+        return None
 
-        if "current_weather" in data:
-            temp = data["current_weather"]["temperature"]
-            weather_code = data["current_weather"]["weathercode"]
-            return temp, weather_code
-       
-        return None, None
-       
-    except:
-        return None, None
-   
-def get_local_time(lat, lon):
+    zone_name, offset = zone
     try:
-        url = f"https://www.timeapi.io/api/TimeZone/coordinate?latitude={lat}&longitude={lon}"
-        r = requests.get(url).json()
+        dt = datetime.now(ZoneInfo(zone_name))
+    except Exception:
+        dt = datetime.now(timezone(timedelta(seconds=offset)))
 
-        if "currentLocalTime" in r:
-            raw_time = r["currentLocalTime"]
+    return dt.strftime("%d/%m %H:%M")
 
-            dt = datetime.fromisoformat(raw_time.replace("Z", "+00:00"))
+def get_local_time(lat, lon):
+    return format_local_time(fetch_time_zone(lat, lon))
 
-            return dt.strftime("%d/%m %H:%M")
-       
-        return None
-    except:
-        return None
-   
-def get_usd_exchange_rate(currency_code):
-    try:
-        url = "https://open.er-api.com/v6/latest/USD"
-        r = requests.get(url).json()
-        return r["rates"].get(currency_code)
-    except:
-        return None
    
 def load_settings():
     if os.path.exists(SETTINGS_PATH):
@@ -151,6 +140,39 @@ def main(page: ft.Page):
     page.bgcolor = ft.Colors.ORANGE_300
     page.window.icon = "Fly_World_plane.png"
 
+    # Every handler goes through the batcher, one websocket message per loop tick
+    ui = UpdateBatcher(page)
+
+    # Everything this session remembers, settings start from settings.json
+    settings = load_settings()
+    state = SessionState(settings)
+
+    # Background work of this session, cancelled on disconnect or when its view is left
+    tasks = TaskRegistry(page)
+
+    # Prometheus endpoint, only when WORLDAIR_METRICS_PORT is set
+    metrics.start_metrics_server()
+    metrics.ACTIVE_SESSIONS.inc()
+    try:
+        metrics.watch_loop(page.session.connection.loop)
+    except (AttributeError, RuntimeError):
+        pass
+
+    def on_connect(e):
+        metrics.ACTIVE_SESSIONS.inc()
+    page.on_connect = on_connect
+
+    def on_disconnect(e):
+        tasks.cancel()
+        SCHEDULER.forget(search_owner)
+        SCHEDULER.forget(suggest_owner)
+        metrics.ACTIVE_SESSIONS.dec()
+        metrics.SESSION_UPDATES.observe(ui.take_flushes())
+        if MEASURE_BYTES:
+            for line in ui.report():
+                print(f"UI updates - {line}")
+    page.on_disconnect = on_disconnect
+
     # Loading screen
     def show_splash():
         page.controls.clear()
@@ -169,327 +191,424 @@ def main(page: ft.Page):
                 start_button
             ]
         )
-        page.add(splash_content)
-        page.update()
-
-    # Reads the csv archive
-    base_path = os.path.dirname(os.path.abspath(__file__))
-    csv_path = os.path.join(base_path, "coordinates-Sheet.csv")
-   
-    countries = {}
-
-    with open(csv_path, encoding="utf-8-sig") as csvfile:
-        reader = csv.reader(csvfile)
+        page.controls.append(splash_content)
+        ui.update("show_splash")
 
-        headers = next(reader)
-        headers = [h.replace('"', '').replace(',', '').strip().lower() for h in headers]
+    # Country coordinates, shared by every session
+    countries = COUNTRIES.coordinates
 
-        for row in reader:
-            if len(row) != len(headers):
-                continue
+    # Keeps the weather of every country warm in the background
+    start_weather_warmer(countries.values())
 
-            data = dict(zip(headers, row))
-            data = {k: v.strip() for k, v in data.items()}
+    # Exchange rates of every currency, refreshed in the background so quotes never wait on er-api
+    start_rates_refresher()
 
-            country = data.get("country")
-            lat = data.get("lat")
-            lon = data.get("lon")
 
-            if country and lat and lon:
-                try:
-                    countries[country] = (float(lat), float(lon))
-                except ValueError:
-                    pass
+    # Destination data fetched in the background as soon as a route is calculated
+    DESTINY_BUNDLE_TTL = 10 * 60
 
-    selected_origin = {"value" : None}
+    async def fetch_destiny_data(destiny):
+        lat, lon = resolve_location(destiny)
+        record = COUNTRIES.get(location_country(destiny))
+        currency_code = record.currency if record else None
 
-    selected_destiny = {"value" : None}
-
-    selected_class = {"value" : None}
+        (temp, weather_code), time_zone, places = await asyncio.gather(
+            tasks.in_thread("get_temperature", get_temperature, lat, lon),
+            tasks.in_thread("fetch_time_zone", fetch_time_zone, lat, lon),
+            tasks.in_thread("get_tourist_places", get_tourist_places, lat, lon),
+        )
+        rate = usd_rate(currency_code) if currency_code else None
+
+        data = {
+            "temp": temp,
+            "weather_code": weather_code,
+            "time_zone": time_zone,
+            "currency": currency_code,
+            "rate": rate,
+            "places": places,
+        }
+        if state.bundle_destiny == destiny:
+            state.bundle_data = data
+            state.bundle_fetched_at = time.time()
+        return data
 
-    selected_season = {"value" : None}
-   
-    selected_airline = {"value": None}
+    # PNG preview of the route for the history, drawn off the event loop
+    async def render_thumbnail(lat1, lon1, lat2, lon2):
+        try:
+            await asyncio.to_thread(route_thumbnail, lat1, lon1, lat2, lon2)
+        except Exception as ex:
+            print(f"Route thumbnail failed: {ex}")
+
+    # A new destination cancels the prefetch of the previous one, and the destiny view showing it
+    def prefetch_destiny(destiny):
+        if state.bundle_destiny == destiny:
+            running = state.bundle_future and not state.bundle_future.done()
+            fresh = state.bundle_data and time.time() - state.bundle_fetched_at < DESTINY_BUNDLE_TTL
+            if running or fresh:
+                return
+        elif state.current_view != "destiny":
+            invalidate_views("destiny")
 
-    settings = load_settings()
+        if state.bundle_future:
+            state.bundle_future.cancel()
+        state.bundle_destiny = destiny
+        state.bundle_data = None
+        state.bundle_future = tasks.start("fetch_destiny_data", fetch_destiny_data, destiny)
 
-    #Main temperature
-    current_temperature = {"value": settings.get("temperature_unit", "°C")}
-
-    # Main language
-    current_language = {"value": settings.get("language", "en")}
-
-    # Main currency
-    current_currency = {"value": settings.get("currency", "USD")}
-
-    # Main distance unit
-    current_distance_unit = {"value": settings.get("distance_unit", "km")}
-
-    current_weather = {"value": None}
-
-    current_temp = {"value": None}
-
-    current_index = {"value": 0}
-
-    airlines = {
-        "low-cost": {
-            "label": {
-                "en": "Low-cost",
-                "es": "Bajo costo",
-                "fr": "Faible coût",
-                "it": "Basso costo",
-                "de": "Niedrige Kosten",
-                "ja": "低コスト",
-                "ch": "低成本",
-                "ar": "تكلفة منخفضة"
-            },
-            "price_multiplier": 0.8,
-            "speed": 850
-        },
-        "standard": {
-            "label": {
-                "en": "Standard",
-                "es": "Estándar",
-                "fr": "Standard",
-                "it": "Standard",
-                "de": "Standard",
-                "ja": "標準",
-                "ch": "标准",
-                "ar": "معيار"
-            },
-            "price_multiplier": 1,
-            "speed": 900
-        },
-        "premium": {
-            "label": {
-                "en": "Premium",
-                "es": "Premium",
-                "fr": "Premium",
-                "it": "Premium",
-                "de": "Prämie",
-                "ja": "プレミアム",
-                "ch": "优质的",
-                "ar": "غالي"
-            },
-            "price_multiplier": 1.3,
-            "speed": 950
-        }
-    }
-   
-    pending_search = {"origin": None, "destiny": None, "class":None, "season": None, "airline": None}
-    search_history = []
     MAX_HISTORY = 10
+    MAX_PICKER_RESULTS = 10
 
     # Def translated words
     def get_translated_country(key):
-        lang = current_language["value"]
-        return country_translations.get(lang, {}).get(key, key)
+        return COUNTRIES.name(key, state.current_language)
    
     def translate_class(value):
-        lang = LANGUAGES[current_language["value"]]
-        mapping = {
-            "Economic": lang["economic"],
-            "First class": lang["first_class"]
-        }
-        return mapping.get(value, value)
-   
-    def translate_season(value):
-        lang = LANGUAGES[current_language["value"]]
-        mapping = {
-            "Low season": lang["low_season"],
-            "High season": lang["high_season"]
-        }
-        return mapping.get(value, value)
-
-    
-    def get_tourist_places(lat, lon, api_key, limit=5):
-        url = f"https://api.geoapify.com/v2/places?categories=tourism.sights&filter=circle:{lon},{lat},10000&limit=5&apiKey=51b26f734313447fa787b92fedd9ee1a"
-        params = {
-            "categories": "tourism.sights",
-            "filter": f"circle:{lon},{lat},10000",
-            5: "limit",
-            "51b26f734313447fa787b92fedd9ee1a": api_key
-        }
+        return state.lang.class_labels.get(value, value)
 
+    def translate_season(value):
+        return state.lang.season_labels.get(value, value)
+
+    # Origin and destiny can be a country or an airport code
+    def resolve_location(value):
+        if value in countries:
+            return countries[value]
+        row = AIRPORTS.find(value)
+        if row is not None:
+            return AIRPORTS.coordinates(row)
+        return None
 
-        r = requests.get(url, params=params)
-        print(r.json())
-        if r.status_code != 200:
+    def location_country(value):
+        if value in countries:
+            return value
+        row = AIRPORTS.find(value)
+        if row is not None:
+            return AIRPORTS.country(row)
+        return value
+
+    def location_label(value):
+        if value in countries:
+            return get_translated_country(value)
+        row = AIRPORTS.find(value)
+        if row is not None:
+            return AIRPORTS.label(row)
+        return value or ""
+
+    def search_locations(query):
+        if not query.strip():
             return []
-        
-        data = r.json()
-        places = []
 
-        for f in data.get("features", []):
-            name = f["properties"].get("name")
-            if name:
-                places.append(name)
+        matches = [
+            (c, get_translated_country(c))
+            for c in COUNTRY_INDEX.search(query, MAX_PICKER_RESULTS)
+        ]
+        for row in AIRPORTS.search(query, MAX_PICKER_RESULTS - len(matches)):
+            matches.append((AIRPORTS.code(row), AIRPORTS.label(row)))
+        return matches
+
+    # Searchable picker, only the best matches are sent to the client
+    # which is "origin" or "destiny", the picked value goes to state.selected_<which>
+    def build_location_picker(label, which):
+        results = ft.ListView(height=200, spacing=0, visible=False)
+
+        def select(value):
+            setattr(state, f"selected_{which}", value)
+            field.value = location_label(value)
+            results.controls.clear()
+            results.visible = False
+            ui.update("location_picker")
+
+        def on_search(e):
+            setattr(state, f"selected_{which}", None)
+            matches = search_locations(e.control.value)
+            results.controls = [
+                ft.ListTile(
+                    title=ft.Text(text),
+                    dense=True,
+                    on_click=lambda e, v=value: select(v)
+                )
+                for value, text in matches
+            ]
+            results.visible = bool(matches)
+            ui.update("location_picker", results)
 
-        return places
+        field = ft.TextField(
+            label=label,
+            value=location_label(getattr(state, f"selected_{which}")),
+            on_change=on_search,
+            width=250,
+        )
+        setattr(state, f"{which}_field", field)
+        return ft.Column([field, results], width=250, spacing=0)
 
      # Change language
     def change_language(e):
-        current_language["value"] = e.control.value
-        settings["language"] = e.control.value
-        save_settings(settings)
+        state.current_language = e.control.value
+        state.lang = catalog(e.control.value)
+        state.settings["language"] = e.control.value
+        save_settings(state.settings)
+        invalidate_views()
         update_navigation_labels()
+        show_settings()
         page.snack_bar = ft.SnackBar(
             ft.Text(f"Language changed to {e.control.value.upper()}")
         )
         page.snack_bar.open = True
-        page.update()
+        ui.update("change_language")
 
     # Change currency
     def change_currency(e):
-        current_currency["value"] = e.control.value
-        settings["currency"] = e.control.value
-        save_settings(settings)
+        state.current_currency = e.control.value
+        state.settings["currency"] = e.control.value
+        save_settings(state.settings)
+        invalidate_views("home", "destiny")
         page.snack_bar = ft.SnackBar(ft.Text(f"Currency changed to {e.control.value}"))
         page.snack_bar.open = True
-        page.update()
+        ui.update("change_currency")
        
+    def change_destiny_currency(e):
+        state.destiny_currency = e.control.value
+        state.settings["destiny_currency"] = e.control.value
+        save_settings(state.settings)
+        invalidate_views("home")
+        ui.update("change_destiny_currency")
+
     def change_distance_unit(e):
-        current_distance_unit["value"] = e.control.value
-        settings["distance_unit"] = e.control.value
-        save_settings(settings)
+        state.current_distance_unit = e.control.value
+        state.settings["distance_unit"] = e.control.value
+        save_settings(state.settings)
+        invalidate_views("home", "destiny")
         page.snack_bar = ft.SnackBar(
             ft.Text(f"Distance unit changed to {e.control.value}")
         )
         page.snack_bar.open = True
-        page.update()
+        ui.update("change_distance_unit")
+
+    def change_distance_model(e):
+        state.distance_model = e.control.value
+        state.settings["distance_model"] = e.control.value
+        save_settings(state.settings)
+        invalidate_views("home", "destiny")
+        page.snack_bar = ft.SnackBar(
+            ft.Text(f"Distance model changed to {e.control.value}")
+        )
+        page.snack_bar.open = True
+        ui.update("change_distance_model")
+
+    # Country pairs come from the precomputed table, airports go through the formula
+    def route_distance(origin_value, destiny_value, lat1, lon1, lat2, lon2):
+        if state.distance_model != "ellipsoidal":
+            return haversine(lat1, lon1, lat2, lon2)
+        distance = COUNTRY_DISTANCES.get(origin_value, destiny_value)
+        if distance is None:
+            distance = vincenty(lat1, lon1, lat2, lon2)
+        return distance
 
     # Change the distance accordind to the selected unit
     def convert_distance(distance_km):
-        if current_distance_unit["value"] == "miles":
+        if state.current_distance_unit == "miles":
             return distance_km * 0.621371, "mi"
         return distance_km, "km"
 
     def change_temperature(e):
-        current_temperature["value"] = e.control.value
-        settings["temperature_unit"] = e.control.value
-        save_settings(settings)
+        state.current_temperature = e.control.value
+        state.settings["temperature_unit"] = e.control.value
+        save_settings(state.settings)
+        invalidate_views("home", "destiny")
         page.snack_bar = ft.SnackBar(
             ft.Text(f"Temperature unit changed to {e.control.value}")
         )
         page.snack_bar.open = True
-        page.update()
+        ui.update("change_temperature")
    
     def show_search_history():
-        page.controls.clear()
-       
+        invalidate_views("history")
+        show_view("history", _build_history_view)
+
+    def _build_history_view():
         back_button = ft.IconButton(
             ft.Icons.CLOSE,
-            tooltip=LANGUAGES[current_language["value"]]["search_history"],
+            tooltip=state.lang["search_history"],
             on_click=lambda e: show_home()
         )
        
         history_buttons = []
-        for item in search_history:
+        for item in state.search_history:
             btn = ft.Button(
                 f"{item['origin']} → {item['destiny']}",
                 on_click=lambda e, orig=item["origin"], dest=item["destiny"], cla=item["class"], sea=item["season"], air=item["airline"]: load_search(orig, dest, cla, sea, air)
             )
-            history_buttons.append(btn)
+            # Only thumbnails already on disk, calcular renders them in the background
+            origin_coords = resolve_location(item["origin"])
+            destiny_coords = resolve_location(item["destiny"])
+            src = cached_thumbnail(*origin_coords, *destiny_coords) if origin_coords and destiny_coords else None
+            if src:
+                history_buttons.append(ft.Row([ft.Image(src=src, width=96, height=96), btn]))
+            else:
+                history_buttons.append(btn)
 
-        page.add(
+        return ft.Column([
             ft.Row([back_button, ft.Text(
-                f"{LANGUAGES[current_language['value']]['search_history']}", size=22, weight=ft.FontWeight.BOLD)]),
+                f"{state.lang['search_history']}", size=22, weight=ft.FontWeight.BOLD)]),
                 ft.Column(history_buttons, scroll="AUTO")
-        )
-        page.update()
-       
-        def load_search(origin_val, destiny_val, class_val, season_val, airline_val):
-            pending_search["origin"] = origin_val
-            pending_search["destiny"] = destiny_val
-            pending_search["class"] = class_val
-            pending_search["season"] = season_val
-            pending_search["airline"] = airline_val
+        ])
+
+    def load_search(origin_val, destiny_val, class_val, season_val, airline_val):
+            state.pending_search = (origin_val, destiny_val, class_val, season_val, airline_val)
 
             show_home()
-            if calculate_fn["fn"]:
-                calculate_fn["fn"](None)
-
-    # Resources of the map
-    marker_layer_ref = ft.Ref[fm.MarkerLayer]()
-    circle_layer_ref = ft.Ref[fm.CircleLayer]()
-    map = ft.Ref[fm.Map]()
-    buscador = ft.Ref[ft.TextField]()
-    navigation_bar_ref = ft.Ref[ft.NavigationBar]()
-    mini_map_ref = ft.Ref[fm.Map]()
-    mini_marker_layer_ref = ft.Ref[fm.MarkerLayer]()
-    mini_polyline_layer_ref = ft.Ref[fm.PolylineLayer]()
-    origin_ref = ft.Ref[ft.Dropdown]()
-    destiny_ref = ft.Ref[ft.Dropdown]()
-    class_ref = ft.Ref[ft.Dropdown]()
-    season_ref = ft.Ref[ft.Dropdown]()
-    airline_ref = ft.Ref[ft.Dropdown]()
-    calculate_fn = {"fn": None}
-
-    # Search place
-    def buscar_lugar(e):
-        query = buscador.current.value.strip()
+            if state.calculate_fn:
+                state.calculate_fn(None)
+
+    # Map points survive page switches, are capped and grouped per zoom level
+    MAP_INITIAL_ZOOM = 4.2
+    max_map_markers = state.settings.get("max_map_markers", 300)
+    state.map_points = ClusteredPoints(max_points=max_map_markers, zoom=MAP_INITIAL_ZOOM)
+    state.map_circles = deque(maxlen=max_map_markers)
+
+    def build_cluster_marker(lat, lon, members):
+        if len(members) == 1:
+            content = ft.Icon(ft.Icons.LOCATION_ON, color=members[0][2])
+        else:
+            content = ft.Container(
+                content=ft.Text(str(len(members)), size=12, color=ft.Colors.WHITE),
+                bgcolor=ft.Colors.DEEP_ORANGE,
+                border_radius=15,
+                alignment=ft.Alignment.CENTER,
+                width=30,
+                height=30,
+            )
+        return fm.Marker(content=content, coordinates=fm.MapLatitudeLongitude(lat, lon))
+
+    def render_all_clusters():
+        state.cluster_markers.clear()
+        for key, (lat, lon, members) in state.map_points.clusters():
+            state.cluster_markers[key] = build_cluster_marker(lat, lon, members)
+        if state.marker_layer:
+            state.marker_layer.markers = list(state.cluster_markers.values())
+
+    # Only the cells touched by the new point are sent, not the whole layer
+    def add_map_point(lat, lon, color):
+        changed = state.map_points.add(lat, lon, color)
+        layer = state.marker_layer
+        for key in changed:
+            old_marker = state.cluster_markers.pop(key, None)
+            if old_marker in layer.markers:
+                layer.markers.remove(old_marker)
+            cluster = state.map_points.cluster(key)
+            if cluster:
+                state.cluster_markers[key] = build_cluster_marker(*cluster)
+                layer.markers.append(state.cluster_markers[key])
+        ui.update("add_map_point", layer)
+
+    def handle_map_position(e):
+        if state.map_points.set_zoom(e.camera.zoom):
+            render_all_clusters()
+            ui.update("handle_map_position", state.marker_layer)
+
+    # Search place. The scheduler keeps only the latest request per owner, so the search and the
+    # suggestions have one each: a late suggestion must never drop the search the user submitted
+    search_owner = object()
+    suggest_owner = object()
+    SEARCH_DEBOUNCE = 0.3
+    MIN_SUGGESTION_LENGTH = 3
+
+    def go_to_place(lat, lon):
+        state.suggestions.controls.clear()
+        state.suggestions.visible = False
+        state.map.center = fm.MapLatitudeLongitude(lat, lon)
+        state.map.zoom = 10
+        add_map_point(lat, lon, ft.Colors.RED)
+        ui.update("go_to_place")
+
+    async def buscar_lugar(e):
+        tasks.track_current("buscar_lugar", scope="map")
+        query = state.buscador.value.strip()
         if not query:
             return
         try:
-            url = "https://nominatim.openstreetmap.org/search"
-            params = {"q": query, "format": "json", "limit": 1}
-            headers = {"User-Agent": "WorldAirApp"}
-            response = requests.get(url, params=params, headers=headers)
-            data = response.json()
+            # A submit supersedes the suggestions still waiting
+            SCHEDULER.forget(suggest_owner)
+            results = await geocode(search_owner, query, limit=1)
 
-            if not data:
+            if not results:
                 page.snack_bar = ft.SnackBar(
-                    ft.Text(LANGUAGES[current_language["value"]]["place_not_found"])
+                    ft.Text(state.lang["place_not_found"])
                 )
                 page.snack_bar.open = True
-                page.update()
+                ui.update("buscar_lugar")
                 return
-                       
-            lat = float(data[0]["lat"])
-            lon = float(data[0]["lon"])
 
-            map.current.center = fm.MapLatitudeLongitude(lat, lon)
-            map.current.zoom = 10
-
-            marker_layer_ref.current.markers.append(
-                fm.Marker(
-                    content=ft.Icon(ft.Icons.LOCATION_ON, color=ft.Colors.RED),
-                    coordinates=fm.MapLatitudeLongitude(lat, lon),
-                )
-            )
+            _, lat, lon = results[0]
+            go_to_place(lat, lon)
 
-            page.update()
+        except asyncio.CancelledError:
+            return
 
         except Exception as ex:
             page.snack_bar = ft.SnackBar(
-                ft.Text(f"{LANGUAGES[current_language['value']]['error_search']}: {ex}")
+                ft.Text(f"{state.lang['error_search']}: {ex}")
             )
             page.snack_bar.open = True
-            page.update()
+            ui.update("buscar_lugar")
+
+    # Type-ahead suggestions, debounced and dropped when a newer keystroke arrives
+    async def sugerir_lugares(e):
+        tasks.track_current("sugerir_lugares", scope="map")
+        query = e.control.value.strip()
+        await asyncio.sleep(SEARCH_DEBOUNCE)
+        if state.buscador is None or state.buscador.value.strip() != query:
+            return
+
+        suggestions = state.suggestions
+        if len(query) < MIN_SUGGESTION_LENGTH:
+            suggestions.controls.clear()
+            suggestions.visible = False
+            ui.update("sugerir_lugares", suggestions)
+            return
+
+        try:
+            results = await geocode(suggest_owner, query)
+        except asyncio.CancelledError:
+            return
+        except Exception:
+            return
+
+        if state.buscador is None or state.buscador.value.strip() != query:
+            return
+
+        suggestions.controls = [
+            ft.ListTile(
+                title=ft.Text(name, max_lines=1),
+                dense=True,
+                on_click=lambda e, lat=lat, lon=lon: go_to_place(lat, lon)
+            )
+            for name, lat, lon in results
+        ]
+        suggestions.visible = bool(results)
+        ui.update("sugerir_lugares", suggestions)
 
     # Clean map
     def limpiar_mapa(e):
-        marker_layer_ref.current.markers.clear()
-        circle_layer_ref.current.circles.clear()
+        state.map_points.clear()
+        state.map_circles.clear()
+        state.cluster_markers.clear()
+        state.marker_layer.markers.clear()
+        state.circle_layer.circles.clear()
         page.snack_bar = ft.SnackBar(
-            ft.Text(LANGUAGES[current_language["value"]]["cleaned_map"])
+            ft.Text(state.lang["cleaned_map"])
         )
         page.snack_bar.open = True
-        page.update()
+        ui.update("limpiar_mapa")
 
     # Tap and hold markers
     def handle_tap(e: fm.MapEvent):
         if e.name == "tap":
-            marker = fm.Marker(
-                content=ft.Icon(ft.Icons.LOCATION_ON, color=ft.Colors.random()),
-                coordinates=e.coordinates,
+            add_map_point(
+                e.coordinates.latitude, e.coordinates.longitude, ft.Colors.random()
             )
 
-            marker_layer_ref.current.markers.append(marker)
-            page.update()
-
         elif e.name == "long_press":
-            circle_layer_ref.current.circles.append(
+            state.map_circles.append(
                 fm.CircleMarker(
                     radius=random.randint(5, 10),
                     coordinates=e.coordinates,
@@ -498,8 +617,8 @@ def main(page: ft.Page):
                     border_stroke_width=4,
                 )
             )
-
-        page.update()
+            state.circle_layer.circles = list(state.map_circles)
+            ui.update("handle_tap", state.circle_layer)
 
     # Index
     def on_navigation_change(e):
@@ -514,38 +633,64 @@ def main(page: ft.Page):
 
     # Update index language
     def update_navigation_labels():
-        lang = LANGUAGES[current_language["value"]]
-        navigation_bar_ref.current.destinations = [
+        lang = state.lang
+        state.navigation_bar.destinations = [
             ft.NavigationBarDestination(icon=ft.Icons.HOME, label=lang["nav_home"]),
             ft.NavigationBarDestination(icon=ft.Icons.MAP, label=lang["nav_map"]),
             ft.NavigationBarDestination(icon=ft.Icons.VIDEOGAME_ASSET, label=lang["nav_destiny_info"]),
             ft.NavigationBarDestination(icon=ft.Icons.SETTINGS, label=lang["nav_settings"]),
         ]
-        page.update()
+        ui.update("update_navigation_labels")
 
     # Navigation bar
-    navigation_bar = ft.NavigationBar(
-        ref=navigation_bar_ref,
+    state.navigation_bar = ft.NavigationBar(
         selected_index=0,
         on_change=on_navigation_change,
         bgcolor=ft.Colors.ORANGE_200,
         indicator_color=ft.Colors.AMBER,
     )
 
+    # Each view is built once per session, switching tabs only toggles visibility
+
+    def show_view(name, build):
+        if state.current_view != name:
+            if state.current_view:
+                tasks.cancel(state.current_view)
+            state.current_view = name
+
+        if not page.controls or page.controls[0] is not state.navigation_bar:
+            page.controls.clear()
+            page.controls.append(state.navigation_bar)
+            page.controls.extend(state.views.values())
+
+        if name not in state.views:
+            state.views[name] = build()
+            page.controls.append(state.views[name])
+
+        for key, view in state.views.items():
+            view.visible = key == name
+        ui.update("show_view")
+
+    # Without names every view is dropped (language change), with the work it still had running
+    def invalidate_views(*names):
+        for name in names or list(state.views):
+            tasks.cancel(name)
+            view = state.views.pop(name, None)
+            if view is not None and view in page.controls:
+                page.controls.remove(view)
+
     # Destinations of navigation
     def show_home():
-        current_index["value"] = 0
-        global last_width
-        last_width = page.width
-        _build_home_layout()
+        state.current_index = 0
+        state.last_width = page.width
+        show_view("home", _build_home_layout)
+        apply_pending_search()
 
     def _build_home_layout():
-        page.controls.clear()
-        page.add(navigation_bar)
-
         # Mini map
-        mini_map = fm.Map(
-            ref=mini_map_ref,
+        state.mini_marker_layer = fm.MarkerLayer(markers=[])
+        state.mini_polyline_layer = fm.PolylineLayer(polylines=[])
+        mini_map = state.mini_map = fm.Map(
             height=250 if page.width < 700 else 300,
             width=page.width if page.width < 700 else 500,
             initial_center=fm.MapLatitudeLongitude(20, 0),
@@ -554,74 +699,41 @@ def main(page: ft.Page):
                 flags=fm.InteractionFlag.ALL
             ),
             layers=[
-                fm.TileLayer(url_template="https://tile.openstreetmap.org/{z}/{x}/{y}.png"),
-                fm.MarkerLayer(ref=mini_marker_layer_ref, markers=[]),
-                fm.PolylineLayer(ref=mini_polyline_layer_ref, polylines=[])
+                fm.TileLayer(url_template=tile_url_template()),
+                state.mini_marker_layer,
+                state.mini_polyline_layer
             ],
         )
-        lang=LANGUAGES[current_language["value"]]
+        lang=state.lang
 
         # Dropdowns
-        class1 = ft.Dropdown(
-            ref=class_ref,
+        class1 = state.class_dropdown = ft.Dropdown(
             label=lang["flight_class"],
-            value = selected_class["value"],
-            options=[
-                ft.dropdown.Option("Economic", lang["economic"]),
-                ft.dropdown.Option("First class", lang["first_class"])
-            ],
+            value = state.selected_class,
+            options=[ft.dropdown.Option(k, text) for k, text in lang.class_options],
             width=250,
         )
-        class1.on_change=lambda e: selected_class.update({"value": e.control.value})
+        class1.on_change=lambda e: setattr(state, "selected_class", e.control.value)
 
-        season = ft.Dropdown(
-            ref=season_ref,
+        season = state.season_dropdown = ft.Dropdown(
             label=lang["season"],
-            value = selected_season["value"],
-            options=[
-                ft.dropdown.Option("Low season", lang["low_season"]),
-                ft.dropdown.Option("High season", lang["high_season"])
-            ],
+            value = state.selected_season,
+            options=[ft.dropdown.Option(k, text) for k, text in lang.season_options],
             width=250,
         )
-        season.on_change=lambda e: selected_season.update({"value": e.control.value})
-
-        origin = ft.Dropdown(
-            ref = origin_ref,
-            label=lang["origin_country"],
-            value = selected_origin["value"],
-            options=[ft.dropdown.Option(key=c, text=get_translated_country(c))
-                     for c in countries.keys()
-            ],
-            width=250,
-        )
-        origin.on_change=lambda e: selected_origin.update({"value": e.control.value})
-
-        destiny = ft.Dropdown(
-            ref = destiny_ref,
-            label=lang["destiny_country"],
-            value = selected_destiny["value"],
-            options=[ft.dropdown.Option(key=c, text=get_translated_country(c))
-                     for c in countries.keys()
-            ],
-            width=250,
-        )
-        destiny.on_change=lambda e: selected_destiny.update({"value": e.control.value})
+        season.on_change=lambda e: setattr(state, "selected_season", e.control.value)
+
+        origin = build_location_picker(lang["origin_country"], "origin")
+
+        destiny = build_location_picker(lang["destiny_country"], "destiny")
 
-        airline = ft.Dropdown(
-            ref=airline_ref,
+        airline = state.airline_dropdown = ft.Dropdown(
             label = lang["airline"],
-            value = selected_airline["value"],
-            options=[
-                ft.dropdown.Option(
-                    key=k,
-                    text=airlines[k]["label"].get(current_language["value"], k)
-                )
-                for k in airlines.keys()  
-            ],
+            value = state.selected_airline,
+            options=[ft.dropdown.Option(key=k, text=text) for k, text in lang.airline_options],
             width=250,
         )
-        airline.on_change=lambda e: selected_airline.update({"value": e.control.value})
+        airline.on_change=lambda e: setattr(state, "selected_airline", e.control.value)
 
         result = ft.Text(value="", size=18, weight=ft.FontWeight.BOLD)
        
@@ -632,11 +744,11 @@ def main(page: ft.Page):
 
         # Flight calculation
         def calcular(e=None):
-            origin_value = origin_ref.current.value
-            destiny_value = destiny_ref.current.value
-            class_value = class_ref.current.value
-            season_value = season_ref.current.value
-            airline_value = airline_ref.current.value
+            origin_value = state.selected_origin
+            destiny_value = state.selected_destiny
+            class_value = state.class_dropdown.value
+            season_value = state.season_dropdown.value
+            airline_value = state.airline_dropdown.value
             if not (
                 origin_value
                 and  destiny_value
@@ -645,100 +757,56 @@ def main(page: ft.Page):
                 and airline_value
             ):
                 result.value = lang["please"]
-                page.update()
+                ui.update("calcular")
                 return
-           
-            selected_origin["value"] = origin_value
-            selected_destiny["value"] = destiny_value
-            selected_class["value"] = class_value
-            selected_season["value"] = season_value
-            selected_airline["value"] = airline_value
-                   
-            lat1, lon1 = countries[origin_value]
-            lat2, lon2 = countries[destiny_value]
-            distance = haversine(lat1, lon1, lat2, lon2)
-
-            # Base price per km
-            price_km = 0.15
-            price = distance * price_km
-               
-            # Adjust per class
-            if class1.value == "First class":
-                price *= 2
-               
-            # Adjust per season
-            if season.value == "High season":
-                price *= 1.5
-
-            airline_data = airlines[airline_value]
-            price *= airline_data["price_multiplier"]
-            # Currency changes
-            currency_rates = {
-                "USD": 1,
-                "EUR": 0.93,
-                "GBP": 0.79,
-                "CHF": 0.90,
-                "JPY": 150
-            }
-
-            currency_symbols = {
-                "USD": "$",
-                "EUR": "€",
-                "GBP": "£",
-                "CHF": "Fr.",
-                "JPY": "¥"
-            }
-
-            selected_currency = current_currency["value"]
-            rate = currency_rates[selected_currency]
-            symbol = currency_symbols[selected_currency]
-            converted_price = price * rate
-
-            # Determine type of flight and duration
-            airline = airlines[airline_value]
-            airplane_speed = airline["speed"]
-            flight_time = distance / airplane_speed
-            extra_time = 0
-            flight_type = ""
-
-            if distance < 5000:
-                flight_type = lang["direct_flight"]
-            elif distance < 10000:
-                flight_type = lang["flight_with_stopover"]
-                extra_time = 2 # Extra time for waiting the next flight
-            else:
-                flight_type = lang["flight_with_many_stopovers"]
-                extra_time = 4 # Extra time for waiting multiple stopovers
 
-            total_duration = flight_time + extra_time
+            started = time.perf_counter()
+            state.selected_origin = origin_value
+            state.selected_destiny = destiny_value
+            state.selected_class = class_value
+            state.selected_season = season_value
+            state.selected_airline = airline_value
+                   
+            lat1, lon1 = resolve_location(origin_value)
+            lat2, lon2 = resolve_location(destiny_value)
+            distance = route_distance(origin_value, destiny_value, lat1, lon1, lat2, lon2)
 
-            # Duration in hours and minutes
-            hours = int(total_duration)
-            minutes = int((total_duration-hours) * 60)
+            q = quote(distance, class_value, season_value, airline_value, state.current_currency)
+            flight_type = lang[q["flight_type"]]
+            hours, minutes = q["hours"], q["minutes"]
 
             dist, unit = convert_distance(distance)
 
+            price = format_price(q["price"], q["currency"], state.current_language)
+            # Same quote at the rate already in memory, no request
+            if state.destiny_currency:
+                record = COUNTRIES.get(location_country(destiny_value))
+                destiny_code = record.currency if record else None
+                destiny_rate = usd_rate(destiny_code) if destiny_code else None
+                if destiny_rate and destiny_code != q["currency"]:
+                    price += f" (≈ {format_price(q['usd'] * destiny_rate, destiny_code, state.current_language)})"
+
             result.value = (
-                f"{lang['flight_from'].format(origin=origin.value, destiny=destiny.value)}\n"
+                f"{lang['flight_from'].format(origin=location_label(origin_value), destiny=location_label(destiny_value))}\n"
                 f"{flight_type}\n"
-                f"{lang['airline']}: {airlines[airline_value]['label'][current_language['value']]}\n"
+                f"{lang['airline']}: {lang.airline_labels[airline_value]}\n"
                 f"{lang['distance'].format(distance=f'{dist:1,.1f} {unit}')}\n"
                 f"{lang['estimated_duration'].format(hours=hours, minutes=minutes)}\n"
-                f"{lang['estimated_price']} {symbol}{converted_price:,.2f} {selected_currency}"
+                f"{lang['estimated_price']} {price}"
             )
-            page.update()
+            ui.update("calcular")
 
-            mini_marker_layer_ref.current.markers.clear()
-            mini_polyline_layer_ref.current.polylines.clear()
+            state.mini_marker_layer.markers.clear()
+            state.mini_polyline_layer.polylines.clear()
            
             # Mini map resources
-            mini_marker_layer_ref.current.markers.append(
+            state.mini_marker_layer.markers.append(
                 fm.Marker(
                     content=ft.Icon(ft.Icons.LOCATION_ON, color=ft.Colors.GREEN),
                     coordinates=fm.MapLatitudeLongitude(lat1, lon1),
                 )
             )
-            mini_marker_layer_ref.current.markers.append(
+            state.mini_marker_layer.markers.append(
                 fm.Marker(
                     content=ft.Icon(ft.Icons.FLAG, color=ft.Colors.RED),
                     coordinates=fm.MapLatitudeLongitude(lat2, lon2),
@@ -751,8 +819,8 @@ def main(page: ft.Page):
                 fm.MapLatitudeLongitude(lat, lon) for lat, lon in curve_coordinates
             ]
 
-            mini_polyline_layer_ref.current.polylines.clear()
-            mini_polyline_layer_ref.current.polylines.append(
+            state.mini_polyline_layer.polylines.clear()
+            state.mini_polyline_layer.polylines.append(
                 fm.PolylineMarker(
                     coordinates=poly_coordinates,
                     color=ft.Colors.BLUE,
@@ -763,11 +831,10 @@ def main(page: ft.Page):
             mid_index = len(curve_coordinates) // 2
             mid_lat, mid_lon = curve_coordinates[mid_index]
 
-            mini_map_ref.current.center_on = fm.MapLatitudeLongitude(mid_lat, mid_lon)
-            mini_map_ref.current.zoom_in = 2.5
+            state.mini_map.center_on = fm.MapLatitudeLongitude(mid_lat, mid_lon)
+            state.mini_map.zoom_in = 2.5
 
-            mini_map_ref.current.update()
-            page.update()
+            ui.update("calcular")
            
             new_search = {
                 "origin": origin_value,
@@ -777,12 +844,17 @@ def main(page: ft.Page):
                 "airline": airline_value
                 }
 
-            if new_search in search_history:
-                search_history.remove(new_search)
-            search_history.insert(0, new_search)
+            if new_search in state.search_history:
+                state.search_history.remove(new_search)
+            state.search_history.insert(0, new_search)
+
+            if len(state.search_history) > MAX_HISTORY:
+                state.search_history.pop()
 
-            if len(search_history) > MAX_HISTORY:
-                search_history.pop()
+            # The destiny view shows the route, class, season and airline of the last calculation
+            invalidate_views("destiny")
+            prefetch_destiny(destiny_value)
+            tasks.start("route_thumbnail", render_thumbnail, lat1, lon1, lat2, lon2)
        
             async def animate_airplane(lat1, lon1, lat2, lon2):
 
@@ -792,7 +864,7 @@ def main(page: ft.Page):
                     path = interpolate_great_circle(lat1, lon1, lat2, lon2, steps)
 
                     airplane_image = ft.Image(
-                        src="airplane.png" if selected_airline["value"] == "premium" else "airplane(normal).png",
+                        src="airplane.png" if state.selected_airline == "premium" else "airplane(normal).png",
                         width=40,
                         height=40,
                         rotate=0,
@@ -803,34 +875,52 @@ def main(page: ft.Page):
                         content=airplane_image
                     )
            
-                    mini_marker_layer_ref.current.markers.append(airplane_marker)
-                    mini_map_ref.current.update()
-
-                    await asyncio.sleep(delay)
-
-                    for i in range(len(path) - 1):
-                        lat, lon = path[i]
-                        lat_next, lon_next = path[i + 1]
-
-                        angle = calculate_bearing(lat, lon, lat_next, lon_next)
-                        airplane_image.rotate = angle
-                        if not mini_map_ref.current or mini_map_ref.current.page is None:
-                            return
-                        airplane_marker = fm.Marker(
-                            coordinates=fm.MapLatitudeLongitude(lat, lon),
-                            content=airplane_image
-                        )
-                        mini_marker_layer_ref.current.markers[-1] = airplane_marker
-                        mini_marker_layer_ref.current.update()
+                    state.mini_marker_layer.markers.append(airplane_marker)
+                    ui.update("animate_airplane", state.mini_map)
 
+                    try:
                         await asyncio.sleep(delay)
-           
-            page.run_task(animate_airplane, lat1, lon1, lat2, lon2)
 
-            page.update()
+                        for i in range(len(path) - 1):
+                            lat, lon = path[i]
+                            lat_next, lon_next = path[i + 1]
+
+                            angle = calculate_bearing(lat, lon, lat_next, lon_next)
+                            airplane_image.rotate = angle
+                            if not state.mini_map or not on_page(state.mini_map):
+                                return
+                            airplane_marker = fm.Marker(
+                                coordinates=fm.MapLatitudeLongitude(lat, lon),
+                                content=airplane_image
+                            )
+                            state.mini_marker_layer.markers[-1] = airplane_marker
+                            ui.update("animate_airplane", state.mini_marker_layer)
+                            metrics.ANIMATION_FRAMES.inc()
+
+                            await asyncio.sleep(delay)
+
+                    # Leaving home stops the flight, the plane is not left halfway
+                    except asyncio.CancelledError:
+                        markers = state.mini_marker_layer.markers
+                        if airplane_marker in markers:
+                            markers.remove(airplane_marker)
+                            ui.update("animate_airplane", state.mini_marker_layer)
+                        raise
+
+            # A new route replaces the plane still flying the previous one
+            tasks.cancel("home")
+            tasks.start("animate_airplane", animate_airplane, lat1, lon1, lat2, lon2, scope="home")
+
+            ui.update("calcular")
+            latency = time.perf_counter() - started
+            metrics.CALCULAR_SECONDS.observe(latency)
+            ANALYTICS.record(
+                origin_value, destiny_value, class_value, season_value, airline_value,
+                distance, q["price"], q["currency"], latency,
+            )
            
         button = ft.Button(
-            LANGUAGES[current_language["value"]]["calculate"],
+            state.lang["calculate"],
             on_click=calcular,
             icon=ft.Icons.FLIGHT_TAKEOFF
         )
@@ -864,8 +954,8 @@ def main(page: ft.Page):
                         scroll="AUTO",
                         expand=1,
                         controls=[
-                            ft.Text(LANGUAGES[current_language["value"]]["home_title"], size=30),
-                            ft.Text(LANGUAGES[current_language["value"]]["calculator"], size=22, weight=ft.FontWeight.BOLD),
+                            ft.Text(state.lang["home_title"], size=30),
+                            ft.Text(state.lang["calculator"], size=22, weight=ft.FontWeight.BOLD),
                             origin,
                             destiny,
                             class1,
@@ -879,68 +969,73 @@ def main(page: ft.Page):
                     mini_map
                 ]    
             )
-        calculate_fn["fn"] = calcular
-        page.add(home_content)
-
-        if pending_search["origin"] and pending_search["destiny"] and pending_search["class"] and pending_search["season"] and pending_search["airline"]:
-            origin_ref.current.value = pending_search["origin"]
-            destiny_ref.current.value = pending_search["destiny"]
-            class_ref.current.value = pending_search["class"]
-            season_ref.current.value = pending_search["season"]
-            airline_ref.current.value = pending_search["airline"]
-
-            pending_search["origin"] = None
-            pending_search["destiny"] = None
-            pending_search["class"] = None
-            pending_search["season"] = None
-            pending_search["airline"] = None
-
-            if calculate_fn["fn"]:
-                calculate_fn["fn"](None)
-        page.update()
+        state.calculate_fn = calcular
+        return home_content
+
+    def apply_pending_search():
+        if state.pending_search and all(state.pending_search):
+            origin_val, destiny_val, class_val, season_val, airline_val = state.pending_search
+            state.selected_origin = origin_val
+            state.selected_destiny = destiny_val
+            state.origin_field.value = location_label(origin_val)
+            state.destiny_field.value = location_label(destiny_val)
+            state.class_dropdown.value = class_val
+            state.season_dropdown.value = season_val
+            state.airline_dropdown.value = airline_val
+
+            state.pending_search = None
+
+            if state.calculate_fn:
+                state.calculate_fn(None)
      
     def handle_resize(e):
-        global last_width
-        if current_index["value"] != 0:
+        if state.current_index != 0:
             return
        
-        if abs(page.width - last_width) > 20:
-            last_width = page.width
-            _build_home_layout()
+        if abs(page.width - state.last_width) > 20:
+            state.last_width = page.width
+            invalidate_views("home")
+            show_view("home", _build_home_layout)
     page.on_resized = handle_resize
 
     def show_map():
-        current_index["value"] = 1
-        page.controls.clear()
-        page.add(navigation_bar)
+        state.current_index = 1
+        show_view("map", _build_map_view)
+
+    def _build_map_view():
+        state.map_points.set_zoom(MAP_INITIAL_ZOOM)
+        render_all_clusters()
 
         # Seach bar
+        state.buscador = ft.TextField(
+            label=state.lang["search_label"],
+            expand=True,
+            on_submit=buscar_lugar,
+            on_change=sugerir_lugares,
+        )
+        state.suggestions = ft.ListView(height=200, spacing=0, visible=False)
         search_bar = ft.Row(
             controls=[
-                ft.TextField(
-                    ref=buscador,
-                    label=LANGUAGES[current_language["value"]]["search_label"],
-                    expand=True,
-                    on_submit=buscar_lugar,
-                ),
+                state.buscador,
                 ft.IconButton(
                     ft.Icons.SEARCH,
                     on_click=buscar_lugar,
-                    tooltip=LANGUAGES[current_language["value"]]["search_tooltip"],
+                    tooltip=state.lang["search_tooltip"],
                 ),
                 ft.IconButton(
                     ft.Icons.CLEANING_SERVICES_ROUNDED,
-                    tooltip=LANGUAGES[current_language["value"]]["clean_tooltip"],
+                    tooltip=state.lang["clean_tooltip"],
                     on_click=limpiar_mapa,
                 ),
             ]
         )
 
-        map_control = fm.Map(
-            ref=map,
+        state.marker_layer = fm.MarkerLayer(markers=list(state.cluster_markers.values()))
+        state.circle_layer = fm.CircleLayer(circles=list(state.map_circles))
+        map_control = state.map = fm.Map(
             expand=True,
             initial_center=fm.MapLatitudeLongitude(15, 10),
-            initial_zoom=4.2,
+            initial_zoom=MAP_INITIAL_ZOOM,
             interaction_configuration=fm.InteractionConfiguration(
                 flags=(
                     fm.InteractionFlag.DRAG,
@@ -950,28 +1045,44 @@ def main(page: ft.Page):
             ),
             on_tap=handle_tap,
             on_long_press=handle_tap,
+            on_position_change=handle_map_position,
             layers=[
                 fm.TileLayer(
-                    url_template="https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+                    url_template=tile_url_template()
                 ),
-                fm.MarkerLayer(ref=marker_layer_ref, markers=[]),
-                fm.CircleLayer(ref=circle_layer_ref, circles=[]),
+                state.marker_layer,
+                state.circle_layer,
             ],
         )
 
-        page.add(
-            ft.Text(LANGUAGES[current_language["value"]]["map_instructions"]),
-            ft.Column([search_bar]),
-            map_control,  
+        return ft.Column(
+            expand=True,
+            controls=[
+                ft.Text(state.lang["map_instructions"]),
+                ft.Column([
+                    search_bar,
+                    state.suggestions,
+                ]),
+                map_control,
+            ]
         )
-        page.update()
+
+    def has_route():
+        return None not in (state.selected_origin, state.selected_destiny, state.selected_class,
+                            state.selected_season, state.selected_airline)
 
     def show_destiny_info():
-        current_index["value"] = 2
-        page.controls.clear()
-        page.add(navigation_bar)
-        
-        lang = LANGUAGES[current_language["value"]]
+        state.current_index = 2
+
+        # The cached view is rebuilt once its prefetched data gets old. The placeholder shown
+        # before any calculation is never kept
+        bundle_age = time.time() - state.bundle_fetched_at
+        if not has_route() or (state.bundle_data and bundle_age >= DESTINY_BUNDLE_TTL):
+            invalidate_views("destiny")
+        show_view("destiny", _build_destiny_view)
+
+    def _build_destiny_view():
+        lang = state.lang
 
         places_column = ft.Column(
             scroll="AUTO",
@@ -994,110 +1105,80 @@ def main(page: ft.Page):
         time_text = ft.Text("Loading local time...")
         currency_column = ft.Column([ft.Text("Loading currency...")])
 
-        dest_language = COUNTRY_LANGUAGES.get(selected_destiny["value"], ["Unknown"])
+        dest_record = COUNTRIES.get(location_country(state.selected_destiny))
+        dest_language = dest_record.languages if dest_record and dest_record.languages else ["Unknown"]
        
-        if ( selected_origin["value"] is None
-            or selected_destiny["value"] is None
-            or selected_class["value"] is None
-            or selected_season["value"] is None
-            or selected_airline["value"] is None
-           
-        ):
-            page.add(
-                ft.Column(
-                    expand=True,
-                    horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                    controls=[
-                        ft.Text(
-                            lang["do_home_calculation"],
-                            size=20,
-                            weight=ft.FontWeight.BOLD,
-                            color=ft.Colors.RED
-                        )
-                    ]
-                )
+        if not has_route():
+            return ft.Column(
+                expand=True,
+                horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+                controls=[
+                    ft.Text(
+                        lang["do_home_calculation"],
+                        size=20,
+                        weight=ft.FontWeight.BOLD,
+                        color=ft.Colors.RED
+                    )
+                ]
             )
-            page.update()
-            return
 
-        left_column = ft.Column(
-            expand=True,
-            spacing=10,
-            controls=[
-                ft.Text(lang["left_title"], size=22, weight=ft.FontWeight.BOLD),
-                ft.Text(f"{lang['origin_country']}: {get_translated_country(selected_origin['value'])}"),
-                ft.Text(f"{lang['destiny_country']}: {get_translated_country(selected_destiny['value'])}"),
-                ft.Text(f"{lang['flight_class']}: {translate_class(selected_class['value'])}"),
-                ft.Text(f"{lang['season']}: {translate_season(selected_season['value'])}"),
-                ft.Text(f"{lang['airline']}: {airlines[selected_airline['value']]['label'][current_language['value']]}"),
-                ft.Divider(),
-                temp_text,
-                weather_text_ui,
-                time_text,
-                currency_column,
-            ]
-        )
-        right_column = ft.Column(
-            expand=True,
-            spacing=10,
-            controls=[
-                ft.Text(lang["right_title"], size=22, weight=ft.FontWeight.BOLD),
-                places_column,
-                tips_column
-            ]
-        )
-       
-        page.add(ft.Row(expand=True, controls=[left_column, right_column]))
-        page.update()
+        def render_places(places):
+            places_column.controls.clear()
+            places_column.controls.append(
+                ft.Text(lang["popular_places"], size=18, weight=ft.FontWeight.BOLD)
+            )
 
-        async def load_destiny_data(
-                temp_text,
-                weather_text_ui,
-                time_text,
-                currency_column,
-                lang,
-        ):
-            lat, lon = countries[selected_destiny["value"]]
-            dest_key = selected_destiny["value"].lower()
-            currency_code = CURRENCY.get(dest_key, {}).get("currency")
+            for place in places:
+                places_column.controls.append(
+                    ft.Row([
+                        ft.Icon(ft.Icons.LOCATION_ON),
+                        ft.Text(place)
+                    ])
+                )
+
+        def generate_travel_tips(temp, weather_code, currency_code):
+            tips = []
+
+            # 🌡 Temperature tip
+            if temp is not None:
+                if temp >= 30:
+                    tips.append("wear a shirt")
+                elif temp <= 10:
+                    tips.append("wear a coat")
+
+            # 🌧 Weather tips
+            if weather_code in [61, 63, 65]:
+                tips.append("use umbrella")
+
+            if weather_code in [95]:
+                tips.append("be careful with storms")
 
-            temp, weather_code = await asyncio.to_thread(get_temperature, lat, lon)
-            local_time = await asyncio.to_thread(get_local_time, lat, lon)
+            # 💱 Currency tip
+            if currency_code != "USD":
+                  tips.append("exchange dollars")
 
-            current_temp["value"] = temp
-            current_weather["value"] = weather_code
+            if not tips:
+                tips.append("no tips")
 
-            rate = None
-            if currency_code:
-                rate = await asyncio.to_thread(get_usd_exchange_rate, currency_code)
+            return tips
+
+        def render_destiny_data(data):
+            temp = data["temp"]
+            weather_code = data["weather_code"]
+            currency_code = data["currency"]
+            rate = data["rate"]
 
             if temp is not None:
-                if current_temperature["value"] == "°F":
+                if state.current_temperature == "°F":
                     temp_text.value = f"{lang['temperature']}: {(temp * 9/5 + 32):.1f}°F"
                 else:
                     temp_text.value = f"{lang['temperature']}: {temp:.1f}°C"
             else:
                 temp_text.value = f"{lang['temperature']}: Not available"
 
-            weather_dict = {
-                0: lang["clear_sky"],
-                1: lang["mainly_clear"],
-                2: lang["partly_cloudy"],
-                3: lang["overcast"],
-                45: lang["foggy"],
-                48: lang["depositing_rime_fog"],
-                51: lang["light_drizzle"],
-                53: lang["moderate_drizzle"],
-                55: lang["dense_drizzle"],
-                61: lang["slight_rain"],
-                63: lang["moderate_rain"],
-                65: lang["heavy_rain"],
-                71: lang["slight_snowfall"],
-                73: lang["heavy_snowfall"],
-                95: lang["thunderstorm"]    
-            }
-            weather_text_ui.value = f"{lang['weather_condition']}: {weather_dict.get(weather_code, 'Unknown')}"
+            weather_text_ui.value = f"{lang['weather_condition']}: {lang.weather.get(weather_code, 'Unknown')}"
 
+            local_time = format_local_time(data["time_zone"])
             time_text.value = f"{lang['local_time']}: {local_time or 'Unknown'}"
 
             currency_column.controls.clear()
@@ -1108,77 +1189,10 @@ def main(page: ft.Page):
                     ft.Text(f"1 {currency_code} = {1/rate:.2f} USD"),
                 ])
             else:
-                currency_column.controls.append("Exchange rate unavailable")
-
-            page.update()
-           
-        page.run_task(
-            load_destiny_data,
-            temp_text,
-            weather_text_ui,
-            time_text,
-            currency_column,
-            lang
-        )
-
-        async def load_destiny_tips(places_column, tips_column):
-
-            lat, lon = countries[selected_destiny["value"]]
-            dest_key = selected_destiny["value"].lower()
-
-            currency_code = CURRENCY.get(dest_key, {}).get("currency")
-
-            temp, weather_code = await asyncio.to_thread(get_temperature, lat, lon)
-
-            def generate_travel_tips():
-                tips = []
-
-                # 🌡 Temperature tip
-                if temp is not None:
-                    if temp >= 30:
-                        tips.append("wear a shirt")
-                    elif temp <= 10:
-                        tips.append("wear a coat")
-
-                # 🌧 Weather tips
-                if weather_code in [61, 63, 65]:
-                    tips.append("use umbrella")
-
-                if weather_code in [95]:
-                    tips.append("be careful with storms")
-
-                # 💱 Currency tip
-                if currency_code != "USD":
-                      tips.append("exchange dollars")
-
-                if not tips:
-                    tips.append("no tips")
-
-                return tips
-
-
-            places = await asyncio.to_thread(
-                get_tourist_places,
-                lat,
-                lon,
-                "5ae2e3f221c38a28845f05b69199742ec5381eb0e7d6915ec281f9a5"
-            )
-
-            tips = generate_travel_tips()
+                currency_column.controls.append(ft.Text("Exchange rate unavailable"))
 
     # 🔹 PLACES
-            places_column.controls.clear()
-            places_column.controls.append(
-                ft.Text(lang["popular_places"], size=18, weight=ft.FontWeight.BOLD)
-            )   
-
-            for place in places:
-                places_column.controls.append(
-                    ft.Row([
-                        ft.Icon(ft.Icons.LOCATION_ON),
-                        ft.Text(place)
-                    ])
-                )
+            render_places(data["places"])
 
     # 🔹 TIPS
             tips_column.controls.clear()
@@ -1186,7 +1200,7 @@ def main(page: ft.Page):
                 ft.Text(lang["travel_tips"], size=18, weight=ft.FontWeight.BOLD)
             )
 
-            for tip in tips:
+            for tip in generate_travel_tips(temp, weather_code, currency_code):
                 tips_column.controls.append(
                     ft.Row([
                         ft.Icon(ft.Icons.LIGHTBULB),
@@ -1194,68 +1208,156 @@ def main(page: ft.Page):
                     ])
                 )
 
-        page.update()
-        page.run_task(load_destiny_tips, places_column, tips_column)
+        # Renders straight from the prefetched bundle when calcular already loaded it
+        destiny = state.selected_destiny
+        prefetch_destiny(destiny)
+        bundle_data = state.bundle_data
+        if bundle_data:
+            render_destiny_data(bundle_data)
+        else:
+            # Places from the cache or the offline bundle are shown on the first render
+            cached_places = peek_tourist_places(*resolve_location(destiny))
+            if cached_places is not None:
+                render_places(cached_places)
+
+        left_column = ft.Column(
+            expand=True,
+            spacing=10,
+            controls=[
+                ft.Text(lang["left_title"], size=22, weight=ft.FontWeight.BOLD),
+                ft.Text(f"{lang['origin_country']}: {location_label(state.selected_origin)}"),
+                ft.Text(f"{lang['destiny_country']}: {location_label(state.selected_destiny)}"),
+                ft.Text(f"{lang['flight_class']}: {translate_class(state.selected_class)}"),
+                ft.Text(f"{lang['season']}: {translate_season(state.selected_season)}"),
+                ft.Text(f"{lang['airline']}: {lang.airline_labels[state.selected_airline]}"),
+                ft.Divider(),
+                temp_text,
+                weather_text_ui,
+                time_text,
+                currency_column,
+            ]
+        )
+        right_column = ft.Column(
+            expand=True,
+            spacing=10,
+            controls=[
+                ft.Text(lang["right_title"], size=22, weight=ft.FontWeight.BOLD),
+                places_column,
+                tips_column
+            ]
+        )
+       
+        destiny_view = ft.Row(expand=True, controls=[left_column, right_column])
+        if bundle_data:
+            return destiny_view
+
+        async def load_destiny_data(future):
+            # Shielded: leaving the view must not cancel the prefetch itself
+            try:
+                data = await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                # Rebuilt on the next visit instead of staying on "Loading..."
+                if state.views.get("destiny") is destiny_view:
+                    invalidate_views("destiny")
+                return
+            if state.views.get("destiny") is not destiny_view:
+                return
+            render_destiny_data(data)
+            ui.update("load_destiny_data")
+
+        tasks.start("load_destiny_data", load_destiny_data, state.bundle_future, scope="destiny")
+        return destiny_view
 
     def show_settings():
-        current_index["value"] = 3
-        page.controls.clear()
-        page.add(navigation_bar)
-        page.add(ft.Text(LANGUAGES[current_language["value"]]["settings_title"], size=22))
+        state.current_index = 3
+        show_view("settings", _build_settings_view)
 
-        # Main dropdowns of settings
+    def _build_settings_view():
+        title = ft.Text(state.lang["settings_title"], size=22)
+
+        # Main dropdowns of settings. data names the setting, the load test finds them by it
         language_dropdown = ft.Dropdown(
-            label=LANGUAGES[current_language["value"]]["language_label"],
-            value=current_language["value"],
-            options=[
-                ft.dropdown.Option("es", "Español"),
-                ft.dropdown.Option("en", "English"),
-                ft.dropdown.Option("fr", "Français"),
-                ft.dropdown.Option("it", "Italiano"),
-                ft.dropdown.Option("de", "Deutsch"),
-                ft.dropdown.Option("ch", "中国人"),
-                ft.dropdown.Option("ja", "日本語"),
-                ft.dropdown.Option("ar", "عربي")
-            ],
+            data="language",
+            label=state.lang["language_label"],
+            value=state.current_language,
+            options=[ft.dropdown.Option(code, name) for code, name in LANGUAGE_NAMES.items()],
         )
         language_dropdown.on_text_change=change_language
        
         currency_dropdown = ft.Dropdown(
-            label = LANGUAGES[current_language["value"]]["currency_label"],
-            value=current_currency["value"],
-            options=[
-                ft.dropdown.Option("USD", "USD - $"),
-                ft.dropdown.Option("EUR", "EUR - €"),
-                ft.dropdown.Option("GBP", "GBP - £"),
-                ft.dropdown.Option("CHF", "CHF -Fr."),
-                ft.dropdown.Option("JPY", "JPY - ¥"),
-            ],
+            data="currency",
+            label = state.lang["currency_label"],
+            value=state.current_currency,
+            options=[ft.dropdown.Option(code, f"{code} - {name}") for code, name in available_currencies().items()],
         )
         currency_dropdown.on_text_change=change_currency
 
+        destiny_currency_switch = ft.Switch(
+            label=state.lang["destiny_currency_label"],
+            value=state.destiny_currency,
+            on_change=change_destiny_currency,
+        )
+
         distance_dropdown = ft.Dropdown(
-            label=LANGUAGES[current_language["value"]]["distance_label"],
-            value=current_distance_unit["value"],
-            options=[
-                ft.dropdown.Option("km", LANGUAGES[current_language["value"]]["kilometers"]),
-                ft.dropdown.Option("miles", LANGUAGES[current_language["value"]]["miles"])
-            ],
+            data="distance_unit",
+            label=state.lang["distance_label"],
+            value=state.current_distance_unit,
+            options=[ft.dropdown.Option(k, text) for k, text in state.lang.distance_options],
         )
         distance_dropdown.on_text_change=lambda e: change_distance_unit(e)
 
+        distance_model_dropdown = ft.Dropdown(
+            data="distance_model",
+            label=state.lang["distance_model_label"],
+            value=state.distance_model,
+            options=[ft.dropdown.Option(k, text) for k, text in state.lang.distance_model_options],
+        )
+        distance_model_dropdown.on_text_change=change_distance_model
+
         temperature_dropdown = ft.Dropdown(
-            label = LANGUAGES[current_language["value"]]["temperature"],
-            value=current_temperature["value"],
-            options = [
-                ft.dropdown.Option("°C", LANGUAGES[current_language["value"]]["celsius"]),
-                ft.dropdown.Option("°F", LANGUAGES[current_language["value"]]["fahrenheit"])
-            ],
+            data="temperature_unit",
+            label = state.lang["temperature"],
+            value=state.current_temperature,
+            options=[ft.dropdown.Option(k, text) for k, text in state.lang.temperature_options],
         )
         temperature_dropdown.on_text_change=change_temperature
 
-        page.add(language_dropdown, currency_dropdown, distance_dropdown, temperature_dropdown)
-        page.update()
+        return ft.Column([title, language_dropdown, currency_dropdown, destiny_currency_switch, distance_dropdown,
+                          distance_model_dropdown,
+                          temperature_dropdown])
+
+    # Country by its key or its name in any language, airport by its code
+    def link_location(value):
+        if resolve_location(value) is not None:
+            return value
+        return COUNTRY_INDEX.exact(value)
+
+    # A /route?origin=...&destiny=... link skips the splash. Home, its quote and the polyline are
+    # built in this tick, so the batcher sends them as the first update; the destination data is
+    # prefetched by calcular. Settings from the link last for this session, settings.json is left alone
+    def open_route_link(route):
+        link = parse_route_link(route)
+        if link is None:
+            return False
+        origin = link_location(link["origin"])
+        destiny = link_location(link["destiny"])
+        if origin is None or destiny is None:
+            print(f"Route link with unknown places: {route}")
+            return False
+        if link["lang"]:
+            state.current_language = link["lang"]
+            state.lang = catalog(link["lang"])
+        if link["currency"]:
+            state.current_currency = link["currency"]
+        if link["unit"]:
+            state.current_distance_unit = link["unit"]
+        state.pending_search = (origin, destiny, link["class"], link["season"], link["airline"])
+        update_navigation_labels()
+        show_home()
+        return True
 
-    update_navigation_labels()
-    show_splash()
-ft.app(main, view=ft.AppView.WEB_BROWSER, assets_dir="assets")
+    if not open_route_link(page.route):
+        update_navigation_labels()
+        show_splash()
+if __name__ == "__main__":
+    ft.app(main, view=ft.AppView.WEB_BROWSER, assets_dir="assets")
@@ -0,0 +1,142 @@
+import functools
+import json
+import os
+import threading
+import time
+
+import requests
+
+from resilience import resilient
+from upstreams import base_url
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+UPSTREAM_TIMEOUT = 5
+REFRESH_SECONDS = 30 * 60
+
+# Used until the first refresh, so the majors can always be quoted
+FALLBACK_RATES = {
+    "USD": 1,
+    "EUR": 0.93,
+    "GBP": 0.79,
+    "CHF": 0.90,
+    "JPY": 150
+}
+
+CURRENCY_SYMBOLS = {
+    "USD": "$", "EUR": "€", "GBP": "£", "CHF": "Fr.", "JPY": "¥", "CNY": "¥", "INR": "₹",
+    "KRW": "₩", "RUB": "₽", "TRY": "₺", "BRL": "R$", "ILS": "₪", "NGN": "₦", "PHP": "₱",
+    "THB": "฿", "UAH": "₴", "VND": "₫", "PLN": "zł", "CAD": "$", "AUD": "$", "MXN": "$",
+    "ARS": "$", "NZD": "$", "SGD": "$", "HKD": "$", "ZAR": "R", "SEK": "kr", "NOK": "kr", "DKK": "kr",
+}
+
+# ISO 4217 minor units, 2 for everything else
+CURRENCY_DECIMALS = {
+    "BIF": 0, "CLP": 0, "DJF": 0, "GNF": 0, "ISK": 0, "JPY": 0, "KMF": 0, "KRW": 0, "PYG": 0,
+    "RWF": 0, "UGX": 0, "VND": 0, "VUV": 0, "XAF": 0, "XOF": 0, "XPF": 0,
+    "BHD": 3, "IQD": 3, "JOD": 3, "KWD": 3, "LYD": 3, "OMR": 3, "TND": 3,
+}
+
+# Thousands and decimal separators per app language, and the languages that put the symbol last
+SEPARATORS = {
+    "en": (",", "."),
+    "es": (".", ","),
+    "fr": (" ", ","),
+    "it": (".", ","),
+    "de": (".", ","),
+    "ja": (",", "."),
+    "ch": (",", "."),
+    "ar": (",", "."),
+}
+SYMBOL_AFTER = {"es", "fr", "it", "de"}
+
+
+def load_currency_names():
+    with open(os.path.join(base_path, "currency.json"), "r", encoding="utf-8-sig") as f:
+        data = json.load(f)
+    names = {"USD": "US Dollar"}
+    for value in data.values():
+        if value.get("currency"):
+            names.setdefault(value["currency"], value.get("currency_name") or value["currency"])
+    return dict(sorted(names.items()))
+
+
+# ISO code -> name, every currency of currency.json
+CURRENCY_NAMES = load_currency_names()
+
+# Units per USD. Replaced as a whole by the refresher, a quote reads it without a lock
+_rates = {"rates": dict(FALLBACK_RATES), "updated_at": 0}
+_refresher = {"thread": None}
+_lock = threading.Lock()
+
+
+@resilient("er-api", ttl=60 * 60, stale_ttl=24 * 60 * 60, shared="usd_rates")
+def fetch_usd_rates():
+    url = base_url("er-api") + "/v6/latest/USD"
+    r = requests.get(url, timeout=UPSTREAM_TIMEOUT).json()
+    return r["rates"]
+
+
+def refresh_rates():
+    rates = fetch_usd_rates()
+    if not rates:
+        return False
+    table = dict(FALLBACK_RATES)
+    for code, value in rates.items():
+        if code in CURRENCY_NAMES and value:
+            table[code] = float(value)
+    _rates["rates"] = table
+    _rates["updated_at"] = time.time()
+    return True
+
+
+def start_rates_refresher(interval=REFRESH_SECONDS):
+    with _lock:
+        if _refresher["thread"] is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    refresh_rates()
+                except Exception as ex:
+                    print(f"Exchange rates refresh failed: {ex}")
+                time.sleep(interval)
+
+        _refresher["thread"] = threading.Thread(target=run, name="rates-refresher", daemon=True)
+        _refresher["thread"].start()
+
+
+# Units of currency per USD, None until a refresh brought it
+def usd_rate(currency):
+    return _rates["rates"].get(currency)
+
+
+# Currencies a quote can be priced in right now, for the settings dropdown
+def available_currencies():
+    rates = _rates["rates"]
+    return {code: name for code, name in CURRENCY_NAMES.items() if code in rates}
+
+
+def currency_symbol(currency):
+    return CURRENCY_SYMBOLS.get(currency, currency)
+
+
+# Built once per currency and language, formatting a price is then one format call and a translate
+@functools.lru_cache(maxsize=None)
+def price_format(currency, language):
+    group, decimal = SEPARATORS.get(language, SEPARATORS["en"])
+    separators = str.maketrans({",": group, ".": decimal})
+    symbol = currency_symbol(currency)
+    if symbol == currency:
+        template = "{number} " + currency
+    elif language in SYMBOL_AFTER:
+        template = "{number} " + symbol + " " + currency
+    else:
+        template = symbol + "{number} " + currency
+    return CURRENCY_DECIMALS.get(currency, 2), separators, template
+
+
+def format_price(value, currency, language="en"):
+    decimals, separators, template = price_format(currency, language)
+    return template.format(number=f"{value:,.{decimals}f}".translate(separators))
@@ -0,0 +1,44 @@
+import urllib.parse
+
+from currencies import CURRENCY_NAMES
+from i18n import LANGUAGE_NAMES
+from pricing import AIRLINES, CLASS_MULTIPLIERS, SEASON_MULTIPLIERS
+
+# /route?origin=Spain&destiny=Japan&class=First+class&season=High+season&airline=premium&currency=EUR&unit=km
+ROUTE_PATH = "/route"
+
+DEFAULTS = {"class": "Economic", "season": "Low season", "airline": "standard"}
+UNITS = ("km", "miles")
+
+
+# Link to a quote, for the booking emails. base_url is where the app is served
+def route_link(base_url, origin, destiny, flight_class=None, season=None, airline=None,
+               currency=None, unit=None, language=None):
+    params = {"origin": origin, "destiny": destiny, "class": flight_class, "season": season,
+              "airline": airline, "currency": currency, "unit": unit, "lang": language}
+    query = urllib.parse.urlencode({k: v for k, v in params.items() if v})
+    return f"{base_url.rstrip('/')}{ROUTE_PATH}?{query}"
+
+
+# The route of a deep link as plain values, None for any other route.
+# Missing route fields get the dropdown defaults; unknown settings are left out, not an error
+def parse_route_link(route):
+    if not route:
+        return None
+    # Hash routing puts the route after the #
+    parts = urllib.parse.urlsplit(route.split("#", 1)[-1])
+    if parts.path.rstrip("/") != ROUTE_PATH:
+        return None
+    params = dict(urllib.parse.parse_qsl(parts.query))
+    if not params.get("origin") or not params.get("destiny"):
+        return None
+
+    link = {"origin": params["origin"], "destiny": params["destiny"]}
+    for name, allowed in (("class", CLASS_MULTIPLIERS), ("season", SEASON_MULTIPLIERS), ("airline", AIRLINES)):
+        link[name] = params.get(name) if params.get(name) in allowed else DEFAULTS[name]
+
+    currency = params.get("currency", "").upper()
+    link["currency"] = currency if currency in CURRENCY_NAMES else None
+    link["unit"] = params.get("unit") if params.get("unit") in UNITS else None
+    link["lang"] = params.get("lang") if params.get("lang") in LANGUAGE_NAMES else None
+    return link
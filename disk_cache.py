@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+# Every worker process opens the same file, WAL lets them read while one writes
+CACHE_PATH = os.environ.get("WORLDAIR_CACHE_PATH", os.path.join(base_path, "cache.db"))
+
+# Map taps and searches add keys forever, so once an hour one process drops what no reader
+# would accept any more (the longest stale_ttl is a year) and keeps only the newest rows
+MAX_AGE_SECONDS = 366 * 24 * 60 * 60
+MAX_ROWS = int(os.environ.get("WORLDAIR_CACHE_MAX_ROWS", 50000))
+PRUNE_SECONDS = 60 * 60
+
+
+class DiskCache:
+    # JSON values in a small SQLite table, grouped by namespace
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.commit()
+        self._next_prune = 0
+
+    # Returns (value, age in seconds) or None, callers decide what is fresh or stale
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), time.time() - row[1]
+
+    def set(self, namespace, key, value):
+        self.set_many(namespace, [(key, value)])
+
+    # One transaction for a whole batch, e.g. the weather of 50 countries
+    def set_many(self, namespace, items):
+        now = time.time()
+        rows = [(namespace, key, json.dumps(value, ensure_ascii=False), now) for key, value in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, stored_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+        if now >= self._next_prune:
+            self._next_prune = now + PRUNE_SECONDS
+            if self.claim("prune", PRUNE_SECONDS):
+                self.prune()
+
+    # True for one process per period: a lease row whose timestamp only moves once it expired
+    def claim(self, name, seconds):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO cache (namespace, key, value, stored_at) VALUES ('lease', ?, 'null', ?)"
+                " ON CONFLICT (namespace, key) DO UPDATE SET stored_at = excluded.stored_at"
+                " WHERE cache.stored_at <= ?",
+                (name, now, now - seconds),
+            )
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+
+    # Leases are left alone, they are a handful of rows
+    def prune(self, max_age=MAX_AGE_SECONDS, max_rows=MAX_ROWS):
+        with self._lock:
+            expired = self._conn.execute(
+                "DELETE FROM cache WHERE namespace != 'lease' AND stored_at < ?",
+                (time.time() - max_age,),
+            ).rowcount
+            extra = self._conn.execute(
+                "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache WHERE namespace != 'lease'"
+                " ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (max_rows,),
+            ).rowcount
+            self._conn.commit()
+        if expired or extra:
+            print(f"Cache pruned: {expired} expired and {extra} oldest rows removed")
+        return expired + extra
+
+
+_shared = {"cache": None}
+_shared_lock = threading.Lock()
+
+
+# The cache.db every module and worker shares, opened on first use
+def shared_cache():
+    with _shared_lock:
+        if _shared["cache"] is None:
+            _shared["cache"] = DiskCache(CACHE_PATH)
+        return _shared["cache"]
@@ -0,0 +1,189 @@
+import argparse
+import csv
+import importlib.util
+import io
+import itertools
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from currencies import refresh_rates, usd_rate
+from geodesy import haversine, np, vincenty_batch
+from pricing import AIRLINES, CLASS_MULTIPLIERS, FLIGHT_TYPES, SEASON_MULTIPLIERS, flight_price
+from registry import CountryRegistry, _read_coordinates
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+COLUMNS = ("origin", "destiny", "class", "season", "airline", "distance_km",
+           "flight_type", "hours", "minutes", "price", "currency")
+
+# Origins being computed or waiting to be written, per worker. Bounds the memory of the export
+WINDOW_PER_WORKER = 2
+
+_points = {}
+
+
+def load_points():
+    registry = CountryRegistry()
+    _read_coordinates(registry, os.path.join(base_path, "coordinates-Sheet.csv"))
+    keys = list(registry.coordinates)
+    lats = [registry.coordinates[k][0] for k in keys]
+    lons = [registry.coordinates[k][1] for k in keys]
+    return keys, lats, lons
+
+
+def init_worker(keys, lats, lons, distance_model, currency, rate):
+    _points.update(keys=keys, lats=np.array(lats), lons=np.array(lons), distance_model=distance_model,
+                   currency=currency, rate=rate)
+
+
+# Same distances as calcular: haversine per pair, or the batch behind the ellipsoidal table
+def distances_from(i):
+    keys, lats, lons = _points["keys"], _points["lats"], _points["lons"]
+    if _points["distance_model"] == "ellipsoidal":
+        n = len(keys)
+        return vincenty_batch(np.full(n, lats[i]), np.full(n, lons[i]), lats, lons)
+    return np.array([haversine(lats[i], lons[i], lat, lon) for lat, lon in zip(lats, lons)])
+
+
+# Every destiny, class, season and airline of one origin, as numpy columns.
+# Prices come from pricing.flight_price and durations from pricing.FLIGHT_TYPES, so they match quote()
+def origin_columns(i):
+    keys = _points["keys"]
+    others = np.array([j for j in range(len(keys)) if j != i])
+    distance = distances_from(i)[others]
+
+    limits = np.array([limit for limit, _, _ in FLIGHT_TYPES])
+    kind = np.searchsorted(limits, distance, side="right")
+    waiting = np.array([w for _, _, w in FLIGHT_TYPES])[kind]
+    flight_types = np.array([name for _, name, _ in FLIGHT_TYPES])[kind]
+
+    columns = {name: [] for name in COLUMNS}
+    for flight_class in CLASS_MULTIPLIERS:
+        for season in SEASON_MULTIPLIERS:
+            for airline, data in AIRLINES.items():
+                total = distance / data["speed"] + waiting
+                hours = total.astype(int)
+                columns["destiny"].append(np.array(keys, dtype=object)[others])
+                columns["class"].append(np.full(len(others), flight_class, dtype=object))
+                columns["season"].append(np.full(len(others), season, dtype=object))
+                columns["airline"].append(np.full(len(others), airline, dtype=object))
+                columns["distance_km"].append(distance)
+                columns["flight_type"].append(flight_types)
+                columns["hours"].append(hours)
+                columns["minutes"].append(((total - hours) * 60).astype(int))
+                columns["price"].append(flight_price(distance, flight_class, season, airline) * _points["rate"])
+    columns = {name: np.concatenate(parts) for name, parts in columns.items() if parts}
+    size = len(columns["destiny"])
+    columns["origin"] = np.full(size, keys[i], dtype=object)
+    columns["currency"] = np.full(size, _points["currency"], dtype=object)
+    return {name: columns[name] for name in COLUMNS}
+
+
+# Runs in the worker: the CSV text of one origin, or its columns for Parquet
+def export_origin(i, fmt):
+    columns = origin_columns(i)
+    if fmt == "parquet":
+        return columns
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerows(zip(
+        columns["origin"], columns["destiny"], columns["class"], columns["season"], columns["airline"],
+        np.round(columns["distance_km"], 1), columns["flight_type"], columns["hours"], columns["minutes"],
+        np.round(columns["price"], 2), columns["currency"],
+    ))
+    return out.getvalue()
+
+
+# Origins in order, at most window of them in flight so a slow writer never piles results up
+def ordered_results(executor, origins, fmt, window):
+    origins = iter(origins)
+    pending = deque(executor.submit(export_origin, i, fmt) for i in itertools.islice(origins, window))
+    while pending:
+        result = pending.popleft().result()
+        following = next(origins, None)
+        if following is not None:
+            pending.append(executor.submit(export_origin, following, fmt))
+        yield result
+
+
+def write_csv(path, chunks):
+    rows = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        csv.writer(f).writerow(COLUMNS)
+        for text in chunks:
+            f.write(text)
+            rows += text.count("\n")
+    return rows
+
+
+def write_parquet(path, chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = 0
+    writer = None
+    try:
+        # One row group per origin
+        for columns in chunks:
+            table = pa.table({name: list(values) if values.dtype == object else values
+                              for name, values in columns.items()})
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+            writer.write_table(table)
+            rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export every origin x destiny x class x season x airline quote, one origin per job"
+    )
+    parser.add_argument("--output", default=None, help="default routes.csv or routes.parquet")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--currency", default="USD")
+    parser.add_argument("--distance-model", choices=("spherical", "ellipsoidal"), default="spherical")
+    parser.add_argument("--live-rates", action="store_true", help="fetch today's exchange rates first")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if np is None:
+        print("The export needs numpy: pip install numpy")
+        return 1
+    if args.format == "parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            print("Parquet needs pyarrow: pip install pyarrow, or use --format csv")
+            return 1
+
+    if args.live_rates and not refresh_rates():
+        print("Exchange rates not available, using the built-in ones")
+    rate = usd_rate(args.currency)
+    if rate is None:
+        print(f"No exchange rate for {args.currency}, try --live-rates")
+        return 1
+
+    output = args.output or f"routes.{args.format}"
+    keys, lats, lons = load_points()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_worker,
+        initargs=(keys, lats, lons, args.distance_model, args.currency, rate),
+    ) as executor:
+        chunks = ordered_results(executor, range(len(keys)), args.format, args.workers * WINDOW_PER_WORKER)
+        if args.format == "parquet":
+            rows = write_parquet(output, chunks)
+        else:
+            rows = write_csv(output, chunks)
+    elapsed = time.perf_counter() - started
+    print(f"{rows:,} routes from {len(keys)} origins written to {output} in {elapsed:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import asyncio
+import itertools
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError
+
+import requests
+
+import metrics
+from disk_cache import shared_cache
+from resilience import call_upstream
+from upstreams import base_url
+
+USER_AGENT = "WorldAirApp"
+
+# Nominatim's usage policy allows one request per second for the whole application
+MIN_INTERVAL = 1.0
+MAX_CACHED_QUERIES = 500
+# Places don't move, answers are kept in cache.db for every worker
+SHARED_TTL = 30 * 24 * 60 * 60
+
+
+def fetch_places(query, limit):
+    params = {"q": query, "format": "json", "limit": limit}
+    headers = {"User-Agent": USER_AGENT}
+    r = requests.get(base_url("nominatim") + "/search", params=params, headers=headers, timeout=5)
+    r.raise_for_status()
+    return [
+        (item.get("display_name", query), float(item["lat"]), float(item["lon"]))
+        for item in r.json()
+    ]
+
+
+class GeocodeScheduler:
+    # One worker thread per process: rate limited, coalesces equal queries and
+    # skips the ones whose session already typed something newer
+    def __init__(self, min_interval=MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._queue = deque()
+        self._waiters = {}
+        self._latest = {}
+        self._cache = OrderedDict()
+        self._tokens = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self.counters = {"requests": 0, "coalesced": 0, "dropped": 0, "cache_hits": 0}
+
+    def submit(self, owner, query, limit=5):
+        key = (" ".join(query.lower().split()), limit)
+        future = Future()
+
+        # submit runs on the event loop thread, cache.db is read before taking the lock
+        stored = None
+        if key not in self._cache:
+            try:
+                stored = shared_cache().get("geocode", f"{key[1]}:{key[0]}")
+            except sqlite3.Error as ex:
+                print(f"Geocode cache read failed: {ex}")
+
+        with self._condition:
+            token = next(self._tokens)
+            self._latest[owner] = token
+
+            if key not in self._cache and stored and stored[1] <= SHARED_TTL:
+                self._remember(key, [tuple(item) for item in stored[0]])
+
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.counters["cache_hits"] += 1
+                metrics.CACHE_LOOKUPS.inc("geocode", "hit")
+                future.set_result(self._cache[key])
+                return future
+            metrics.CACHE_LOOKUPS.inc("geocode", "miss")
+
+            if key in self._waiters:
+                self.counters["coalesced"] += 1
+                self._waiters[key].append((owner, token, future))
+            else:
+                self._waiters[key] = [(owner, token, future)]
+                self._queue.append(key)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="geocoder", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+        return future
+
+    # Caller holds the condition
+    def _remember(self, key, results):
+        self._cache[key] = results
+        while len(self._cache) > MAX_CACHED_QUERIES:
+            self._cache.popitem(last=False)
+
+    def forget(self, owner):
+        with self._condition:
+            self._latest.pop(owner, None)
+
+    def _take(self):
+        with self._condition:
+            while True:
+                while not self._queue:
+                    self._condition.wait()
+
+                key = self._queue.popleft()
+                live = []
+                for owner, token, future in self._waiters.pop(key, []):
+                    if self._latest.get(owner) == token:
+                        live.append(future)
+                    else:
+                        self.counters["dropped"] += 1
+                        future.cancel()
+                if live:
+                    return key, live
+
+    # asyncio's wrap_future can cancel a future from the loop thread at any moment
+    @staticmethod
+    def _settle(future, results=None, error=None):
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results)
+        except InvalidStateError:
+            pass
+
+    def _lookup(self, key):
+        # The interval holds across every worker sharing cache.db
+        while not shared_cache().claim("nominatim", self.min_interval):
+            time.sleep(self.min_interval / 4)
+
+        results = call_upstream("nominatim", fetch_places, key[0], key[1])
+
+        try:
+            shared_cache().set("geocode", f"{key[1]}:{key[0]}", results)
+        except sqlite3.Error as ex:
+            print(f"Geocode cache write failed: {ex}")
+        with self._condition:
+            self.counters["requests"] += 1
+            self._remember(key, results)
+        return results
+
+    # One failed lookup fails its waiters, never the thread every session depends on
+    def _run(self):
+        try:
+            while True:
+                key, futures = self._take()
+                try:
+                    results = self._lookup(key)
+                except Exception as ex:
+                    for future in futures:
+                        self._settle(future, error=ex)
+                    continue
+                for future in futures:
+                    self._settle(future, results)
+        finally:
+            # The next submit starts a new thread
+            with self._condition:
+                self._thread = None
+
+
+SCHEDULER = GeocodeScheduler()
+
+
+# Raises asyncio.CancelledError when a newer query from the same owner replaced this one
+async def geocode(owner, query, limit=5):
+    return await asyncio.wrap_future(SCHEDULER.submit(owner, query, limit))
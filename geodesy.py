@@ -0,0 +1,207 @@
+import functools
+import math
+import threading
+
+# Optional: without numpy the batch falls back to the scalar formula and there is no pair table
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EPSILON = 1e-10
+
+# WGS-84 ellipsoid, in meters
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+VINCENTY_TOLERANCE = 1e-12
+VINCENTY_ITERATIONS = 200
+
+
+# Harvesine method
+def haversine(lat1, lon1, lat2, lon2):
+    R = 6371 # Earth radius
+    dlat = math.radians(lat2-lat1)
+    dlon = math.radians(lon2-lon1)
+    a = (math.sin(dlat/2)**2 +
+         math.cos(math.radians(lat1)) *
+         math.cos(math.radians(lat2)) *
+         math.sin(dlon/2)**2
+    )
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    return R*c
+
+
+# Vincenty inverse formula on the WGS-84 ellipsoid, in km. The sphere of haversine is off
+# by up to 0.5%. Nearly antipodal points don't converge and get the spherical distance
+@functools.lru_cache(maxsize=4096)
+def vincenty(lat1, lon1, lat2, lon2):
+    f = WGS84_F
+    L = math.radians(lon2 - lon1)
+    U1 = math.atan((1 - f) * math.tan(math.radians(lat1)))
+    U2 = math.atan((1 - f) * math.tan(math.radians(lat2)))
+    sinU1, cosU1 = math.sin(U1), math.cos(U1)
+    sinU2, cosU2 = math.sin(U2), math.cos(U2)
+
+    lam = L
+    for _ in range(VINCENTY_ITERATIONS):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.sqrt((cosU2 * sin_lam) ** 2 + (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+        if sin_sigma == 0:
+            return 0.0
+        cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cosU1 * cosU2 * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha ** 2
+        # Zero when both points are on the equator
+        cos_2sm = cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha if cos2_alpha else 0.0
+        C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        previous = lam
+        lam = L + (1 - C) * f * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm ** 2)))
+        if abs(lam - previous) < VINCENTY_TOLERANCE:
+            break
+    else:
+        return haversine(lat1, lon1, lat2, lon2)
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sm ** 2)
+        - B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sm ** 2)))
+    return WGS84_B * A * (sigma - delta_sigma) / 1000
+
+
+# Same formula over arrays, every pair iterates together until all of them converged
+def vincenty_batch(lat1, lon1, lat2, lon2):
+    if np is None:
+        return [vincenty(*pair) for pair in zip(lat1, lon1, lat2, lon2)]
+
+    f = WGS84_F
+    phi1, lam1, phi2, lam2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    L = lam2 - lam1
+    U1 = np.arctan((1 - f) * np.tan(phi1))
+    U2 = np.arctan((1 - f) * np.tan(phi2))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    def step(lam):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.sqrt((cosU2 * sin_lam) ** 2 + (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+        cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        # Same point: sigma is 0 and so is the distance
+        sin_alpha = np.divide(cosU1 * cosU2 * sin_lam, sin_sigma,
+                              out=np.zeros_like(sin_sigma), where=sin_sigma != 0)
+        cos2_alpha = 1 - sin_alpha ** 2
+        cos_2sm = cos_sigma - np.divide(2 * sinU1 * sinU2, cos2_alpha,
+                                        out=np.zeros_like(cos2_alpha), where=cos2_alpha != 0)
+        cos_2sm[cos2_alpha == 0] = 0.0
+        C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        new_lam = L + (1 - C) * f * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm ** 2)))
+        return new_lam, sin_sigma, cos_sigma, sigma, cos2_alpha, cos_2sm
+
+    lam = L.copy()
+    pending = np.ones(L.shape, dtype=bool)
+    for _ in range(VINCENTY_ITERATIONS):
+        new_lam = step(lam)[0]
+        converged = np.abs(new_lam - lam) < VINCENTY_TOLERANCE
+        lam = np.where(pending, new_lam, lam)
+        pending &= ~converged
+        if not pending.any():
+            break
+    _, sin_sigma, cos_sigma, sigma, cos2_alpha, cos_2sm = step(lam)
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sm ** 2)
+        - B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sm ** 2)))
+    distance = WGS84_B * A * (sigma - delta_sigma) / 1000
+
+    if pending.any():
+        a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(L / 2) ** 2
+        distance = np.where(pending, 6371 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)), distance)
+    return distance
+
+
+class DistanceTable:
+    # Geodesic distance between every pair of points, computed as one batch on first use.
+    # A lookup costs less than haversine, so the accurate mode is free for country routes
+    def __init__(self, points):
+        self.index = {key: i for i, key in enumerate(points)}
+        self._points = list(points.values())
+        self._table = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        lats = np.array([p[0] for p in self._points], dtype=np.float64)
+        lons = np.array([p[1] for p in self._points], dtype=np.float64)
+        n = len(self._points)
+        distances = vincenty_batch(np.repeat(lats, n), np.repeat(lons, n), np.tile(lats, n), np.tile(lons, n))
+        return distances.reshape(n, n)
+
+    # None when a key is not in the table or numpy is missing, callers use vincenty then
+    def get(self, key1, key2):
+        i = self.index.get(key1)
+        j = self.index.get(key2)
+        if i is None or j is None or np is None:
+            return None
+        if self._table is None:
+            with self._lock:
+                if self._table is None:
+                    self._table = self._build()
+        return float(self._table[i, j])
+
+
+# The route and the plane animation use the same curve, computed once per route
+@functools.lru_cache(maxsize=256)
+def interpolate_great_circle(lat1, lon1, lat2, lon2, steps):
+
+    if lat1 == lat2 and lon1 == lon2:
+        return ((lat1, lon1),)
+
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+
+    d = 2 * math.asin(math.sqrt(
+        math.sin((lat2-lat1)/2)**2 +
+        math.cos(lat1) * math.cos(lat2) *
+        math.sin((lon2 - lon1)/2)**2
+    ))
+
+    coordinates = []
+    for i in range(steps + 1):
+        f = i / steps
+
+        if abs(d) < EPSILON:
+            A = 1.0
+            B = 0.0
+        else:
+            sin_d = math.sin(d)
+            A = math.sin((1 - f) * d) * sin_d
+            B = math.sin(f * d) / sin_d
+
+        x = A * math.cos(lat1) * math.cos(lon1) + B * math.cos(lat2) * math.cos(lon2)
+        y = A * math.cos(lat1) * math.sin(lon1) + B * math.cos(lat2) * math.sin(lon2)
+        z = A * math.sin(lat1) + B * math.sin(lat2)
+
+        new_lat = math.atan2(z, math.sqrt(x*x + y*y))
+        new_lon = math.atan2(y, x)
+
+        coordinates.append((math.degrees(new_lat), math.degrees(new_lon)))
+
+    return tuple(coordinates)
+
+
+def calculate_bearing(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+
+    dlon = lon2 - lon1
+    x = math.sin(dlon) * math.cos(lat2)
+    y = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlon)
+
+    return math.atan2(x, y)
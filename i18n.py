@@ -0,0 +1,165 @@
+import json
+import os
+import string
+import threading
+
+from pricing import AIRLINES
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+LANGUAGES_PATH = os.path.join(base_path, "languages.json")
+CATALOG_DIR = os.path.join(base_path, "catalogs")
+REFERENCE_LANGUAGE = "en"
+
+# Names in the language itself, for the settings dropdown
+LANGUAGE_NAMES = {
+    "es": "Español",
+    "en": "English",
+    "fr": "Français",
+    "it": "Italiano",
+    "de": "Deutsch",
+    "ch": "中国人",
+    "ja": "日本語",
+    "ar": "عربي",
+}
+
+# Open-Meteo weather codes
+WEATHER_KEYS = {
+    0: "clear_sky",
+    1: "mainly_clear",
+    2: "partly_cloudy",
+    3: "overcast",
+    45: "foggy",
+    48: "depositing_rime_fog",
+    51: "light_drizzle",
+    53: "moderate_drizzle",
+    55: "dense_drizzle",
+    61: "slight_rain",
+    63: "moderate_rain",
+    65: "heavy_rain",
+    71: "slight_snowfall",
+    73: "heavy_snowfall",
+    95: "thunderstorm",
+}
+
+# Dropdown value -> key of its label
+CLASS_KEYS = {"Economic": "economic", "First class": "first_class"}
+SEASON_KEYS = {"Low season": "low_season", "High season": "high_season"}
+DISTANCE_KEYS = {"km": "kilometers", "miles": "miles"}
+DISTANCE_MODEL_KEYS = {"spherical": "spherical", "ellipsoidal": "ellipsoidal"}
+TEMPERATURE_KEYS = {"°C": "celsius", "°F": "fahrenheit"}
+
+
+class Catalog:
+    # Everything one language needs, resolved once: lang["key"] for plain strings
+    __slots__ = ("code", "strings", "weather", "class_labels", "season_labels", "airline_labels",
+                 "class_options", "season_options", "airline_options", "distance_options",
+                 "distance_model_options", "temperature_options")
+
+    def __init__(self, code, data):
+        self.code = code
+        self.strings = data["strings"]
+        self.weather = {int(k): v for k, v in data["weather"].items()}
+        self.class_labels = data["class_labels"]
+        self.season_labels = data["season_labels"]
+        self.airline_labels = data["airline_labels"]
+        self.class_options = [tuple(o) for o in data["class_options"]]
+        self.season_options = [tuple(o) for o in data["season_options"]]
+        self.airline_options = [tuple(o) for o in data["airline_options"]]
+        self.distance_options = [tuple(o) for o in data["distance_options"]]
+        self.distance_model_options = [tuple(o) for o in data["distance_model_options"]]
+        self.temperature_options = [tuple(o) for o in data["temperature_options"]]
+
+    def __getitem__(self, key):
+        return self.strings[key]
+
+    def get(self, key, default=None):
+        return self.strings.get(key, default)
+
+
+def compile_language(code, strings):
+    def labels(keys):
+        return {value: strings[key] for value, key in keys.items()}
+
+    airline_labels = {k: a["label"].get(code, k) for k, a in AIRLINES.items()}
+    return {
+        "strings": strings,
+        "weather": {str(c): strings[key] for c, key in WEATHER_KEYS.items()},
+        "class_labels": labels(CLASS_KEYS),
+        "season_labels": labels(SEASON_KEYS),
+        "airline_labels": airline_labels,
+        "class_options": list(labels(CLASS_KEYS).items()),
+        "season_options": list(labels(SEASON_KEYS).items()),
+        "airline_options": list(airline_labels.items()),
+        "distance_options": list(labels(DISTANCE_KEYS).items()),
+        "distance_model_options": list(labels(DISTANCE_MODEL_KEYS).items()),
+        "temperature_options": list(labels(TEMPERATURE_KEYS).items()),
+    }
+
+
+def placeholders(template):
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field}
+
+
+# Every language must have the reference language's keys with the same {placeholders}
+def validate(languages):
+    problems = []
+    reference = languages[REFERENCE_LANGUAGE]
+    needed = set(reference) | set(WEATHER_KEYS.values()) | set(CLASS_KEYS.values()) \
+        | set(SEASON_KEYS.values()) | set(DISTANCE_KEYS.values()) | set(DISTANCE_MODEL_KEYS.values()) \
+        | set(TEMPERATURE_KEYS.values())
+    for code in LANGUAGE_NAMES:
+        strings = languages.get(code)
+        if strings is None:
+            problems.append(f"{code}: not in languages.json")
+            continue
+        for key in sorted(needed - set(strings)):
+            problems.append(f"{code}: missing '{key}'")
+        for key in sorted(set(strings) - set(reference)):
+            problems.append(f"{code}: '{key}' is not in {REFERENCE_LANGUAGE}")
+        for key in sorted(set(strings) & set(reference)):
+            try:
+                if placeholders(strings[key]) != placeholders(reference[key]):
+                    problems.append(f"{code}: '{key}' has placeholders {sorted(placeholders(strings[key]))}, "
+                                    f"{REFERENCE_LANGUAGE} has {sorted(placeholders(reference[key]))}")
+            except ValueError as ex:
+                problems.append(f"{code}: '{key}' is not a valid template ({ex})")
+        for airline, data in AIRLINES.items():
+            if code not in data["label"]:
+                problems.append(f"{code}: no label for airline '{airline}'")
+    return problems
+
+
+def load_languages():
+    with open(LANGUAGES_PATH, "r", encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+def catalog_path(code, directory=CATALOG_DIR):
+    return os.path.join(directory, f"{code}.json")
+
+
+_catalogs = {}
+_lock = threading.Lock()
+
+
+# Loaded on first use. The compiled file from build_catalogs.py is used while it is
+# newer than languages.json, otherwise the language is compiled from the source
+def catalog(code):
+    found = _catalogs.get(code)
+    if found is not None:
+        return found
+    if code not in LANGUAGE_NAMES:
+        code = REFERENCE_LANGUAGE
+    with _lock:
+        if code not in _catalogs:
+            path = catalog_path(code)
+            try:
+                if os.path.getmtime(path) < os.path.getmtime(LANGUAGES_PATH):
+                    raise OSError("older than languages.json")
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = compile_language(code, load_languages()[code])
+            _catalogs[code] = Catalog(code, data)
+        return _catalogs[code]
@@ -0,0 +1,411 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import msgpack
+import flet as ft
+import flet_map as fm
+from flet.controls.base_control import BaseControl
+from flet.controls.context import _context_page
+from flet.messaging.connection import Connection
+from flet.messaging.protocol import ClientAction, configure_encode_object_for_msgpack
+from flet.messaging.session import Session
+from flet.pubsub.pubsub_hub import PubSubHub
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+# The app reads its data files from the working directory
+os.chdir(base_path)
+
+ENCODE = configure_encode_object_for_msgpack(BaseControl)
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Background work a step waits for before it counts as done
+DESTINY_TASKS = ("fetch_destiny_data", "load_destiny_data")
+STEP_TIMEOUT = 30
+
+
+class LoadConnection(Connection):
+    # Stands in for the websocket: encodes every message like the real one and only counts it
+    def __init__(self, loop, executor, pubsubhub):
+        super().__init__()
+        self.loop = loop
+        self.executor = executor
+        self.pubsubhub = pubsubhub
+        self.messages = 0
+        self.bytes = 0
+        self.errors = []
+
+    def send_message(self, message):
+        self.messages += 1
+        self.bytes += len(msgpack.packb([message.action, message.body], default=ENCODE))
+        # A handler raised, Flet reports it to the browser
+        if message.action == ClientAction.SESSION_CRASHED:
+            self.errors.append(str(message.body.message).splitlines()[0])
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    # The loop's default executor, counts jobs waiting for a thread and jobs running
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers, thread_name_prefix="loadtest")
+        self.size = max_workers
+        self.queued = 0
+        self.running = 0
+        self._counts_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._counts_lock:
+            self.queued += 1
+
+        def job():
+            with self._counts_lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counts_lock:
+                    self.running -= 1
+
+        return super().submit(job)
+
+
+class Stats:
+    def __init__(self):
+        self.latency = {}
+        self.bytes = {}
+        self.lag = []
+        self.pool = []
+        self.errors = []
+
+    def record(self, handler, seconds, sent):
+        self.latency.setdefault(handler, []).append(seconds)
+        self.bytes.setdefault(handler, []).append(sent)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def walk(control):
+    yield control
+    for name in ("controls", "content", "title", "destinations", "layers", "markers"):
+        value = getattr(control, name, None)
+        if isinstance(value, list):
+            for child in value:
+                if isinstance(child, BaseControl):
+                    yield from walk(child)
+        elif isinstance(value, BaseControl):
+            yield from walk(value)
+
+
+def find(page, kind, predicate=lambda c: True):
+    found = []
+    for control in list(page.controls):
+        for c in walk(control):
+            if isinstance(c, kind) and predicate(c) and c not in found:
+                found.append(c)
+    return found
+
+
+def visible(control):
+    return control.visible is not False
+
+
+def start_stand_in(profile):
+    from stand_in import StandIn, load_profile, make_handler
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(StandIn("synth", load_profile(profile), None)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# Samples how late a short sleep wakes up and how busy the thread pool is
+async def monitor(stats, executor, stop, interval=0.05):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        stats.lag.append(max(0.0, loop.time() - start - interval))
+        stats.pool.append((executor.running, executor.queued))
+
+
+class SimulatedSession:
+    # One browser tab: a real flet Session whose messages go to a LoadConnection
+    def __init__(self, number, app, executor, pubsubhub, stats, args):
+        self.number = number
+        self.app = app
+        self.stats = stats
+        self.args = args
+        self.rng = random.Random(args.seed + number)
+        self.conn = LoadConnection(asyncio.get_running_loop(), executor, pubsubhub)
+        self.session = Session(self.conn)
+        self.conn.session = self.session
+        self.page = self.session.page
+        self.registry = None
+
+    async def settle(self, wait_for=()):
+        # Two ticks: the handler's flush is scheduled with call_soon
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        deadline = time.perf_counter() + STEP_TIMEOUT
+        while wait_for and time.perf_counter() < deadline:
+            live = self.registry.live() if self.registry else {}
+            if not any(name in live for name in wait_for):
+                break
+            await asyncio.sleep(0.005)
+
+    async def step(self, handler, control, event, data=None, wait_for=()):
+        sent = self.conn.bytes
+        start = time.perf_counter()
+        await self.session.dispatch_event(control._i, event, data)
+        await self.settle(wait_for)
+        self.stats.record(handler, time.perf_counter() - start, self.conn.bytes - sent)
+        if self.args.think:
+            await asyncio.sleep(self.rng.uniform(0, self.args.think / 1000))
+
+    def navigation(self):
+        return find(self.page, ft.NavigationBar)[0]
+
+    async def navigate(self, handler, index, wait_for=()):
+        nav = self.navigation()
+        nav.selected_index = index
+        await self.step(handler, nav, "change", wait_for=wait_for)
+
+    async def pick_country(self, handler, field, name):
+        field.value = name[:4]
+        await self.step(f"{handler}.search", field, "change")
+        tiles = find(self.page, ft.ListTile, visible)
+        if tiles:
+            await self.step(f"{handler}.select", tiles[0], "click")
+
+    async def connect(self):
+        from session_tasks import registry_for
+
+        _context_page.set(self.page)
+        # What the server does when a browser registers: apply its page size, answer with the whole page
+        self.session.apply_page_patch({"width": 1280, "height": 800, "route": "/"})
+        self.conn.bytes += len(msgpack.packb(self.session.get_page_patch(), default=ENCODE))
+        self.conn.messages += 1
+        sent = self.conn.bytes
+        start = time.perf_counter()
+        self.app.main(self.page)
+        await self.settle()
+        self.stats.record("main", time.perf_counter() - start, self.conn.bytes - sent)
+        self.registry = registry_for(self.page)
+
+    # splash -> calcular -> destination page -> map taps -> settings
+    async def run_flow(self, countries):
+        await self.step("show_home", find(self.page, ft.Button)[0], "click")
+
+        origin, destiny = find(self.page, ft.TextField)[:2]
+        origin_name, destiny_name = self.rng.sample(countries, 2)
+        await self.pick_country("origin", origin, origin_name)
+        await self.pick_country("destiny", destiny, destiny_name)
+        for dropdown in find(self.page, ft.Dropdown, visible)[:3]:
+            dropdown.value = self.rng.choice(dropdown.options).key
+            await self.step("dropdown.change", dropdown, "change")
+
+        calculate = [b for b in find(self.page, ft.Button) if b.icon == ft.Icons.FLIGHT_TAKEOFF][0]
+        await self.step("calcular", calculate, "click")
+
+        await self.navigate("show_destiny_info", 2, wait_for=DESTINY_TASKS)
+
+        await self.navigate("show_map", 1)
+        world_map = find(self.page, fm.Map, lambda c: c.on_tap)[0]
+        for _ in range(self.args.taps):
+            point = {"latitude": self.rng.uniform(-60, 70), "longitude": self.rng.uniform(-170, 170)}
+            await self.step("handle_tap", world_map, "tap", {"coordinates": point})
+
+        await self.navigate("show_settings", 3)
+        await self.change_setting("change_language", "language", self.rng.choice(["es", "en"]))
+        await self.change_setting("change_currency", "currency", self.rng.choice(["EUR", "USD", "GBP", "JPY"]))
+
+    # Settings dropdowns by their data name, never by position: a new setting must not
+    # send a value to the wrong handler without anyone noticing
+    def setting(self, name):
+        found = find(self.page, ft.Dropdown, lambda c: visible(c) and c.data == name)
+        if len(found) != 1:
+            raise RuntimeError(f"{len(found)} visible settings dropdowns for {name}")
+        return found[0]
+
+    async def change_setting(self, handler, name, value):
+        dropdown = self.setting(name)
+        if value not in [option.key for option in dropdown.options]:
+            raise RuntimeError(f"{value} is not an option of the {name} dropdown")
+        dropdown.value = value
+        await self.step(handler, dropdown, "text_change", value)
+        # The view may have been rebuilt (language), so the new dropdown has to show the value too
+        if self.setting(name).value != value:
+            raise RuntimeError(f"{handler} did not set {name} to {value}")
+
+    def disconnect(self):
+        if self.page.on_disconnect:
+            self.page.on_disconnect(None)
+
+
+async def run(args, app):
+    from session_state import live_footprints
+
+    loop = asyncio.get_running_loop()
+    executor = InstrumentedExecutor(args.threads)
+    loop.set_default_executor(executor)
+    pubsubhub = PubSubHub(loop=loop, executor=executor)
+    stats = Stats()
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(monitor(stats, executor, stop))
+    countries = sorted(app.COUNTRIES.coordinates)
+
+    rss_before = rss_bytes()
+    sessions = []
+
+    async def user(number):
+        await asyncio.sleep(args.ramp * number / max(1, args.sessions))
+        simulated = SimulatedSession(number, app, executor, pubsubhub, stats, args)
+        sessions.append(simulated)
+        await simulated.connect()
+        try:
+            await simulated.run_flow(countries)
+        except Exception as ex:
+            stats.errors.append(f"session {number}: {type(ex).__name__}: {ex}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(args.sessions)))
+    duration = time.perf_counter() - started
+
+    # Every session is still connected here, like the tabs of real users
+    rss_after = rss_bytes()
+    state_sizes = live_footprints()
+    for simulated in sessions:
+        stats.errors.extend(simulated.conn.errors)
+        simulated.disconnect()
+    stop.set()
+    await watcher
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    return report(args, stats, sessions, duration, rss_before, rss_after, state_sizes)
+
+
+def report(args, stats, sessions, duration, rss_before, rss_after, state_sizes):
+    total_bytes = sum(s.conn.bytes for s in sessions)
+    total_messages = sum(s.conn.messages for s in sessions)
+    saturated = sum(1 for running, queued in stats.pool if running >= args.threads or queued)
+    result = {
+        "sessions": args.sessions,
+        "duration_s": round(duration, 3),
+        "profile": args.profile,
+        "handlers": {},
+        "websocket": {
+            "bytes": total_bytes,
+            "messages": total_messages,
+            "bytes_per_session": total_bytes // max(1, len(sessions)),
+        },
+        "loop_lag_ms": {
+            "p50": percentile(stats.lag, 50) * 1000,
+            "p99": percentile(stats.lag, 99) * 1000,
+            "max": max(stats.lag, default=0) * 1000,
+        },
+        "thread_pool": {
+            "size": args.threads,
+            "peak_running": max((r for r, _ in stats.pool), default=0),
+            "peak_queued": max((q for _, q in stats.pool), default=0),
+            "saturated_pct": saturated / max(1, len(stats.pool)) * 100,
+        },
+        "rss": {
+            "before_mb": rss_before / 2 ** 20,
+            "after_mb": rss_after / 2 ** 20,
+            "per_session_kb": (rss_after - rss_before) / max(1, len(sessions)) / 1024,
+            # SessionState.footprint(), the containers the session state owns without its controls
+            "state_bytes_per_session": sum(state_sizes) // max(1, len(state_sizes)),
+        },
+        "errors": stats.errors,
+    }
+    for handler, values in stats.latency.items():
+        result["handlers"][handler] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p90_ms": percentile(values, 90) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values) * 1000,
+            "bytes_per_call": sum(stats.bytes[handler]) / len(values),
+        }
+
+    print(f"{args.sessions} sessions in {duration:.2f}s, stand-in profile {args.profile}")
+    print(f"{'handler':24} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'bytes/call':>11}")
+    for handler, row in result["handlers"].items():
+        print(f"{handler:24} {row['count']:6} {row['p50_ms']:8.1f}ms {row['p90_ms']:8.1f}ms "
+              f"{row['p99_ms']:8.1f}ms {row['max_ms']:8.1f}ms {row['bytes_per_call']:11.0f}")
+    ws = result["websocket"]
+    print(f"Websocket: {ws['bytes']} bytes in {ws['messages']} messages, {ws['bytes_per_session']} bytes per session")
+    lag = result["loop_lag_ms"]
+    print(f"Event loop lag: p50 {lag['p50']:.1f}ms, p99 {lag['p99']:.1f}ms, max {lag['max']:.1f}ms")
+    pool = result["thread_pool"]
+    print(f"Thread pool: {pool['size']} threads, peak {pool['peak_running']} running and {pool['peak_queued']} queued, "
+          f"saturated {pool['saturated_pct']:.0f}% of the time")
+    rss = result["rss"]
+    print(f"RSS: {rss['before_mb']:.1f}MB -> {rss['after_mb']:.1f}MB, {rss['per_session_kb']:.0f}KB per session, "
+          f"{rss['state_bytes_per_session']} bytes of session state")
+    if stats.errors:
+        print(f"{len(stats.errors)} error(s), first: {stats.errors[0]}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drives N simulated web sessions through the app against local stand-ins")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--taps", type=int, default=10, help="map taps per session")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds until every session has started")
+    parser.add_argument("--think", type=float, default=50, help="max pause between steps in ms")
+    parser.add_argument("--threads", type=int, default=min(32, (os.cpu_count() or 1) + 4),
+                        help="size of the default thread pool, same as asyncio's default")
+    parser.add_argument("--profile", default="realistic", help="stand-in latency and error profile")
+    parser.add_argument("--standin", help="URL of a running stand_in.py instead of an in-process one")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # Before the app is imported: upstream URLs, a cold cache, and settings.json,
+    # the analytics logs and the thumbnails of the repo left alone
+    if args.standin:
+        os.environ["WORLDAIR_STANDIN"] = args.standin
+    else:
+        _, os.environ["WORLDAIR_STANDIN"] = start_stand_in(args.profile)
+    scratch = tempfile.mkdtemp(prefix="worldair-loadtest-")
+    os.environ.setdefault("WORLDAIR_CACHE_PATH", os.path.join(scratch, "cache.db"))
+    os.environ.setdefault("WORLDAIR_ANALYTICS_DIR", os.path.join(scratch, "analytics"))
+    os.environ.setdefault("WORLDAIR_THUMBNAIL_DIR", os.path.join(scratch, "thumbnails"))
+
+    import codigo
+    codigo.SETTINGS_PATH = os.path.join(scratch, "settings.json")
+
+    result = asyncio.run(run(args, codigo))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
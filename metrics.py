@@ -0,0 +1,257 @@
+import bisect
+import os
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Off unless a port is given, serve.py hands each worker its own
+METRICS_PORT = os.environ.get("WORLDAIR_METRICS_PORT")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# How long a scrape waits for an event loop to run a callback
+LAG_PROBE_TIMEOUT = 1.0
+
+_metrics = []
+_collectors = []
+_loops = weakref.WeakSet()
+_loops_lock = threading.Lock()
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def lines(self):
+        with self._lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self.values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count per bucket (+Inf last), sum]
+        self.values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def lines(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = format_labels(self.labels + ("le",), labels + (bound,))
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}"
+
+
+# Hot path series, updating one is a dict lookup under a lock
+UPSTREAM_REQUESTS = Counter(
+    "worldair_upstream_requests_total", "Calls to external services", ("upstream", "outcome")
+)
+UPSTREAM_LATENCY = Histogram(
+    "worldair_upstream_latency_seconds", "Latency of the calls to external services", ("upstream",)
+)
+CALCULAR_SECONDS = Histogram("worldair_calcular_seconds", "Time spent in calcular")
+PAGE_UPDATES = Counter(
+    "worldair_page_updates_total", "Batched page updates sent to browsers", ("handler",)
+)
+UPDATE_SECONDS = Histogram(
+    "worldair_page_update_seconds", "Time to diff, encode and send one batched page update"
+)
+SESSION_UPDATES = Histogram(
+    "worldair_session_page_updates", "Page updates sent to one session connection, observed on disconnect",
+    buckets=COUNT_BUCKETS,
+)
+ANIMATION_FRAMES = Counter("worldair_animation_frames_total", "Plane animation frames sent")
+CACHE_LOOKUPS = Counter(
+    "worldair_cache_lookups_total", "Cache lookups by result (hit, stale, miss)", ("cache", "result")
+)
+ACTIVE_SESSIONS = Gauge("worldair_active_sessions", "Sessions connected to this worker")
+
+
+# Functions called on scrape only, they return (name, kind, help, [(label names, label values, value)])
+def collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+# Event loops whose lag is probed on scrape, added as sessions connect
+def watch_loop(loop):
+    with _loops_lock:
+        _loops.add(loop)
+
+
+@collector
+def loop_lag():
+    with _loops_lock:
+        loops = list(_loops)
+    samples = []
+    for i, loop in enumerate(loops):
+        if loop.is_closed():
+            continue
+        done = threading.Event()
+        queued = time.perf_counter()
+        ran = []
+        loop.call_soon_threadsafe(lambda: (ran.append(time.perf_counter()), done.set()))
+        done.wait(LAG_PROBE_TIMEOUT)
+        lag = ran[0] - queued if ran else LAG_PROBE_TIMEOUT
+        samples.append((("loop",), (i,), lag))
+    return [("worldair_event_loop_lag_seconds", "gauge", "Delay before the event loop ran a probe callback", samples)]
+
+
+@collector
+def upstream_health():
+    from resilience import health_snapshot
+
+    states = []
+    short_circuits = []
+    events = []
+    latencies = []
+    for name, health in health_snapshot().items():
+        states.append((("upstream",), (name,), 1 if health["state"] == "open" else 0))
+        short_circuits.append((("upstream",), (name,), health["short_circuits"]))
+        for event in ("calls", "successes", "failures", "stale_served"):
+            events.append((("upstream", "event"), (name, event), health[event]))
+        if health["last_latency"] is not None:
+            latencies.append((("upstream",), (name,), health["last_latency"]))
+    return [
+        ("worldair_upstream_circuit_open", "gauge", "1 while the circuit breaker of an upstream is open", states),
+        ("worldair_upstream_short_circuits_total", "counter", "Calls refused by an open circuit", short_circuits),
+        ("worldair_upstream_breaker_events_total", "counter",
+         "Calls, successes, failures and stale values served, per circuit breaker", events),
+        ("worldair_upstream_last_latency_seconds", "gauge", "Latency of the last call through each breaker", latencies),
+    ]
+
+
+@collector
+def live_tasks():
+    from session_tasks import live_task_counts
+
+    totals = {}
+    for counts in live_task_counts():
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+    samples = [(("task",), (name,), count) for name, count in sorted(totals.items())]
+    return [("worldair_live_tasks", "gauge", "Background tasks running, over every session", samples)]
+
+
+@collector
+def session_state():
+    from session_state import live_footprints
+
+    sizes = live_footprints()
+    return [("worldair_session_state_bytes", "gauge", "Bytes held by the SessionState of every live session",
+             [((), (), sum(sizes))])]
+
+
+def render():
+    out = []
+    for metric in _metrics:
+        out.append(f"# HELP {metric.name} {metric.help}")
+        out.append(f"# TYPE {metric.name} {metric.kind}")
+        out.extend(metric.lines())
+    for fn in _collectors:
+        try:
+            families = fn()
+        except Exception as ex:
+            print(f"Metrics collector {fn.__name__} failed: {ex}")
+            continue
+        for name, kind, help, samples in families:
+            out.append(f"# HELP {name} {help}")
+            out.append(f"# TYPE {name} {kind}")
+            for label_names, label_values, value in samples:
+                out.append(f"{name}{format_labels(label_names, label_values)} {value}")
+    return "\n".join(out) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = {"server": None}
+_server_lock = threading.Lock()
+
+
+# Started once per process, next to the Flet server
+def start_metrics_server(port=None, host="0.0.0.0"):
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    with _server_lock:
+        if _server["server"] is None:
+            try:
+                server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+            except OSError as ex:
+                print(f"Metrics endpoint not started on port {port}: {ex}")
+                return None
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            _server["server"] = server
+            print(f"Metrics on http://{host}:{port}/metrics")
+        return _server["server"]
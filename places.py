@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+
+import requests
+
+import metrics
+from disk_cache import shared_cache
+from resilience import call_upstream
+from upstreams import base_url
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+GEOAPIFY_API_KEY = os.environ.get("GEOAPIFY_API_KEY", "51b26f734313447fa787b92fedd9ee1a")
+
+DEFAULT_RADIUS = 10000
+DEFAULT_CATEGORY = "tourism.sights"
+
+# Points of interest barely change: fresh for a month, served stale for a year
+FRESH_SECONDS = 30 * 24 * 60 * 60
+STALE_SECONDS = 365 * 24 * 60 * 60
+
+BUNDLE_PATH = os.path.join(base_path, "places_bundle.json")
+
+CACHE = shared_cache()
+_bundle = {"data": None}
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def places_key(lat, lon, radius=DEFAULT_RADIUS, category=DEFAULT_CATEGORY):
+    return f"{lat:.4f},{lon:.4f},{radius},{category}"
+
+
+def load_bundle():
+    if _bundle["data"] is None:
+        try:
+            with open(BUNDLE_PATH, "r", encoding="utf-8") as f:
+                _bundle["data"] = json.load(f)
+        except (OSError, ValueError):
+            _bundle["data"] = {}
+    return _bundle["data"]
+
+
+def fetch_tourist_places(lat, lon, radius=DEFAULT_RADIUS, category=DEFAULT_CATEGORY, limit=5):
+    params = {
+        "categories": category,
+        "filter": f"circle:{lon},{lat},{radius}",
+        "limit": limit,
+        "apiKey": GEOAPIFY_API_KEY,
+    }
+    r = requests.get(base_url("geoapify") + "/v2/places", params=params, timeout=15)
+    r.raise_for_status()
+
+    places = []
+    for f in r.json().get("features", []):
+        name = f["properties"].get("name")
+        if name:
+            places.append(name)
+    return places
+
+
+def _refresh(key, lat, lon, radius, category):
+    try:
+        places = call_upstream("geoapify", fetch_tourist_places, lat, lon, radius, category)
+        CACHE.set("places", key, places)
+    except Exception as ex:
+        print(f"Places refresh failed: {ex}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def _refresh_in_background(key, lat, lon, radius, category):
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    threading.Thread(
+        target=_refresh, args=(key, lat, lon, radius, category), daemon=True
+    ).start()
+
+
+# Cache or offline bundle only, never touches the network
+def peek_tourist_places(lat, lon, radius=DEFAULT_RADIUS, category=DEFAULT_CATEGORY):
+    key = places_key(lat, lon, radius, category)
+    cached = CACHE.get("places", key)
+    if cached and cached[1] <= STALE_SECONDS:
+        return cached[0]
+    return load_bundle().get(key)
+
+
+def get_tourist_places(lat, lon, radius=DEFAULT_RADIUS, category=DEFAULT_CATEGORY):
+    key = places_key(lat, lon, radius, category)
+
+    cached = CACHE.get("places", key)
+    if cached:
+        places, age = cached
+        if age <= FRESH_SECONDS:
+            metrics.CACHE_LOOKUPS.inc("places", "hit")
+            return places
+        if age <= STALE_SECONDS:
+            metrics.CACHE_LOOKUPS.inc("places", "stale")
+            _refresh_in_background(key, lat, lon, radius, category)
+            return places
+
+    bundled = load_bundle().get(key)
+    if bundled is not None:
+        metrics.CACHE_LOOKUPS.inc("places", "bundle")
+        _refresh_in_background(key, lat, lon, radius, category)
+        return bundled
+
+    metrics.CACHE_LOOKUPS.inc("places", "miss")
+    try:
+        places = call_upstream("geoapify", fetch_tourist_places, lat, lon, radius, category)
+    except Exception:
+        return []
+    CACHE.set("places", key, places)
+    return places
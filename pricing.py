@@ -0,0 +1,104 @@
+# Pricing and duration of a quote, shared by the calculator and anything else that prices routes
+
+import math
+
+from currencies import currency_symbol, usd_rate
+
+BASE_PRICE_PER_KM = 0.15
+
+# Airline labels, price multiplier and cruise speed
+AIRLINES = {
+    "low-cost": {
+        "label": {
+            "en": "Low-cost",
+            "es": "Bajo costo",
+            "fr": "Faible coût",
+            "it": "Basso costo",
+            "de": "Niedrige Kosten",
+            "ja": "低コスト",
+            "ch": "低成本",
+            "ar": "تكلفة منخفضة"
+        },
+        "price_multiplier": 0.8,
+        "speed": 850
+    },
+    "standard": {
+        "label": {
+            "en": "Standard",
+            "es": "Estándar",
+            "fr": "Standard",
+            "it": "Standard",
+            "de": "Standard",
+            "ja": "標準",
+            "ch": "标准",
+            "ar": "معيار"
+        },
+        "price_multiplier": 1,
+        "speed": 900
+    },
+    "premium": {
+        "label": {
+            "en": "Premium",
+            "es": "Premium",
+            "fr": "Premium",
+            "it": "Premium",
+            "de": "Prämie",
+            "ja": "プレミアム",
+            "ch": "优质的",
+            "ar": "غالي"
+        },
+        "price_multiplier": 1.3,
+        "speed": 950
+    }
+}
+
+# Dropdown value -> price multiplier
+CLASS_MULTIPLIERS = {"Economic": 1, "First class": 2}
+SEASON_MULTIPLIERS = {"Low season": 1, "High season": 1.5}
+
+# Flight types by distance: below the limit (km), languages.json key, extra hours waiting connections
+FLIGHT_TYPES = (
+    (5000, "direct_flight", 0),
+    (10000, "flight_with_stopover", 2), # Extra time for waiting the next flight
+    (math.inf, "flight_with_many_stopovers", 4), # Extra time for waiting multiple stopovers
+)
+
+
+# Price in USD before the currency conversion. Also works on a numpy array of distances
+def flight_price(distance, flight_class, season, airline):
+    price = distance * BASE_PRICE_PER_KM
+    price = price * CLASS_MULTIPLIERS.get(flight_class, 1) * SEASON_MULTIPLIERS.get(season, 1)
+    return price * AIRLINES[airline]["price_multiplier"]
+
+
+# Returns the languages.json key of the flight type and the duration in hours
+def flight_duration(distance, airline):
+    flight_time = distance / AIRLINES[airline]["speed"]
+
+    for limit, flight_type, waiting in FLIGHT_TYPES:
+        if distance < limit:
+            return flight_type, flight_time + waiting
+
+
+def quote(distance, flight_class, season, airline, currency="USD"):
+    flight_type, total_duration = flight_duration(distance, airline)
+
+    # Duration in hours and minutes
+    hours = int(total_duration)
+    minutes = int((total_duration - hours) * 60)
+
+    usd = flight_price(distance, flight_class, season, airline)
+    # A currency without a rate yet is quoted in dollars, the quote says which one it used
+    rate = usd_rate(currency)
+    if rate is None:
+        currency, rate = "USD", 1
+
+    return {
+        "price": usd * rate,
+        "usd": usd,
+        "currency": currency,
+        "symbol": currency_symbol(currency),
+        "flight_type": flight_type,
+        "hours": hours,
+        "minutes": minutes,
+    }
@@ -0,0 +1,196 @@
+import csv
+import unicodedata
+
+# Names used by the data files that don't match the coordinates sheet
+KNOWN_ALIASES = {
+    "cabo verde": "capo verde",
+    "congo (brazzaville)": "congo",
+    "congo (kinshasa)": "democratic republic of the congo",
+    "czech republic": "czechia",
+    "palestine": "palestinian territories",
+    "united states": "united states of america",
+    "usa": "united states of america",
+    "uk": "united kingdom",
+}
+
+# ISO 3166 alpha-2 code -> country of the coordinates sheet, for data keyed by code
+# (the OurAirports dump only has iso_country)
+ISO_COUNTRIES = {
+    "AF": "Afghanistan", "AL": "Albania", "AG": "Antigua and Barbuda", "SA": "Saudi Arabia",
+    "DZ": "Algeria", "AR": "Argentina", "AM": "Armenia", "AU": "Australia", "AT": "Austria",
+    "AZ": "Azerbaijan", "AW": "Aruba", "BS": "Bahamas", "BH": "Bahrain", "BD": "Bangladesh",
+    "BB": "Barbados", "BE": "Belgium", "BZ": "Belize", "BJ": "Benin", "BY": "Belarus",
+    "MM": "Myanmar", "BO": "Bolivia", "BA": "Bosnia and Herzegovina", "BW": "Botswana",
+    "BR": "Brazil", "BN": "Brunei", "BG": "Bulgaria", "BF": "Burkina Faso", "BI": "Burundi",
+    "BT": "Bhutan", "CV": "Capo Verde", "KH": "Cambodia", "CM": "Cameroon", "CA": "Canada",
+    "TD": "Chad", "CL": "Chile", "CN": "China", "CY": "Cyprus", "CO": "Colombia", "KM": "Comoros",
+    "CG": "Congo", "CF": "Central African Republic", "CZ": "Czechia", "CR": "Costa Rica",
+    "HR": "Croatia", "CU": "Cuba", "CW": "Curacao", "CI": "Côte d'ivoire", "DO": "Dominican Republic",
+    "DJ": "Djibouti", "CD": "Democratic Republic of the Congo", "DK": "Denmark", "DM": "Dominica",
+    "GQ": "Equatorial Guinea", "EC": "Ecuador", "EG": "Egypt", "SV": "El Salvador", "ER": "Eritrea",
+    "EE": "Estonia", "SZ": "Eswatini", "ET": "Ethiopia", "FI": "Finland", "FJ": "Fiji", "FR": "France",
+    "DE": "Germany", "GA": "Gabon", "GM": "Gambia", "GE": "Georgia", "GH": "Ghana", "GD": "Grenada",
+    "GR": "Greece", "GT": "Guatemala", "GN": "Guinea", "GW": "Guinea-Bissau", "GY": "Guyana",
+    "HT": "Haiti", "HN": "Honduras", "HU": "Hungary", "IN": "India", "ID": "Indonesia", "IQ": "Iraq",
+    "IE": "Ireland", "IR": "Iran", "IS": "Iceland", "IL": "Israel", "IT": "Italy", "JM": "Jamaica",
+    "JP": "Japan", "JO": "Jordan", "KZ": "Kazakhstan", "KE": "Kenya", "KG": "Kyrgyzstan",
+    "KI": "Kiribati", "KW": "Kuwait", "LS": "Lesotho", "LR": "Liberia", "LY": "Libya",
+    "LT": "Lithuania", "LU": "Luxembourg", "LB": "Lebanon", "LA": "Laos", "MG": "Madagascar",
+    "MW": "Malawi", "MY": "Malaysia", "MV": "Maldives", "MT": "Malta", "ML": "Mali", "MA": "Morocco",
+    "MH": "Marshall Islands", "MU": "Mauritius", "MR": "Mauritania", "FM": "Micronesia",
+    "MD": "Moldova", "MN": "Mongolia", "ME": "Montenegro", "MZ": "Mozambique", "MX": "Mexico",
+    "MK": "North Macedonia", "NA": "Namibia", "NR": "Nauru", "NP": "Nepal", "NI": "Nicaragua",
+    "NG": "Nigeria", "NO": "Norway", "NZ": "New Zealand", "NL": "Netherlands", "NE": "Niger",
+    "OM": "Oman", "PS": "Palestinian Territories", "PK": "Pakistan", "PW": "Palau", "PA": "Panama",
+    "PG": "Papua New Guinea", "PY": "Paraguay", "PH": "Philippines", "PE": "Peru", "PL": "Poland",
+    "PT": "Portugal", "QA": "Qatar", "AE": "United Arab Emirates", "GB": "United Kingdom",
+    "RW": "Rwanda", "RO": "Romania", "RU": "Russia", "SK": "Slovakia", "SI": "Slovenia", "ES": "Spain",
+    "KR": "South Korea", "SB": "Solomon Islands", "WS": "Samoa", "KN": "Saint kitts and Nevis",
+    "MF": "Saint Martin", "VC": "Saint Vincent and the Grenadines", "ST": "São Tomé and Príncipe",
+    "SN": "Senegal", "RS": "Serbia", "SC": "Seychelles", "SL": "Sierra Leone", "SG": "Singapore",
+    "SY": "Syria", "SO": "Somalia", "LK": "Sri Lanka", "ZA": "South Africa", "SD": "Sudan",
+    "SS": "South Sudan", "SE": "Sweden", "CH": "Switzerland", "SR": "Suriname", "TH": "Thailand",
+    "TZ": "Tanzania", "TJ": "Tajikistan", "TL": "Timor-Leste", "TG": "Togo", "TO": "Tonga",
+    "TT": "Trinidad and Tobago", "TM": "Turkmenistan", "TN": "Tunisia", "TR": "Turkey",
+    "US": "United States of America", "UA": "Ukraine", "UG": "Uganda", "UY": "Uruguay",
+    "UZ": "Uzbekistan", "VU": "Vanuatu", "VE": "Venezuela", "VN": "Vietnam", "YE": "Yemen",
+    "ZM": "Zambia", "ZW": "Zimbabwe",
+}
+
+
+# "Saudi_Arabia", "saudi arabia" and "Saudi Arabia" all become "saudi arabia"
+def normalize(name):
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    return " ".join(name.replace("_", " ").lower().split())
+
+
+class CountryRecord:
+    __slots__ = ("id", "key", "lat", "lon", "currency", "currency_name",
+                 "languages", "names")
+
+    def __init__(self, country_id, key, lat, lon):
+        self.id = country_id
+        self.key = key
+        self.lat = lat
+        self.lon = lon
+        self.currency = None
+        self.currency_name = None
+        self.languages = ()
+        self.names = {}
+
+    def name(self, lang):
+        return self.names.get(lang) or self.names.get("en") or self.key
+
+
+class CountryRegistry:
+    def __init__(self):
+        self.records = []
+        self.coordinates = {}
+        self._ids = {}
+        self.gaps = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def add(self, key, lat, lon):
+        record = CountryRecord(len(self.records), key, lat, lon)
+        self.records.append(record)
+        self.coordinates[key] = (lat, lon)
+        self._ids[key] = record.id
+        self._ids[normalize(key)] = record.id
+        return record
+
+    def add_alias(self, alias, country_id):
+        self._ids.setdefault(alias, country_id)
+
+    # Raw strings are remembered, so a repeated lookup is a single dict hit
+    def id_of(self, name):
+        if not name:
+            return None
+        country_id = self._ids.get(name)
+        if country_id is None:
+            key = normalize(name)
+            country_id = self._ids.get(KNOWN_ALIASES.get(key, key))
+            if country_id is not None:
+                self._ids[name] = country_id
+        return country_id
+
+    def get(self, name):
+        country_id = self.id_of(name)
+        return None if country_id is None else self.records[country_id]
+
+    def name(self, key, lang):
+        record = self.get(key)
+        return record.name(lang) if record else key
+
+    def report(self):
+        lines = []
+        for source, (unmatched, missing) in self.gaps.items():
+            if unmatched:
+                lines.append(f"{source}: no country for {', '.join(sorted(unmatched))}")
+            if missing:
+                lines.append(f"{source}: no entry for {', '.join(sorted(missing))}")
+        return lines
+
+
+def _read_coordinates(registry, csv_path):
+    with open(csv_path, encoding="utf-8-sig") as csvfile:
+        reader = csv.reader(csvfile)
+
+        headers = next(reader)
+        headers = [h.replace('"', '').replace(',', '').strip().lower() for h in headers]
+
+        for row in reader:
+            if len(row) != len(headers):
+                continue
+
+            data = {k: v.strip() for k, v in zip(headers, row)}
+
+            country = data.get("country")
+            lat = data.get("lat")
+            lon = data.get("lon")
+
+            if country and lat and lon:
+                try:
+                    registry.add(country, float(lat), float(lon))
+                except ValueError:
+                    pass
+
+
+# Joins coordinates, translations, currency and languages into one record per country
+def build_registry(csv_path, translations, currency, languages):
+    registry = CountryRegistry()
+    _read_coordinates(registry, csv_path)
+
+    def join(source, entries, apply):
+        found = set()
+        unmatched = []
+        for name, value in entries:
+            record = registry.get(name)
+            if record is None:
+                unmatched.append(name)
+                continue
+            registry.add_alias(name, record.id)
+            found.add(record.id)
+            apply(record, value)
+        missing = [r.key for r in registry.records if r.id not in found]
+        registry.gaps[source] = (unmatched, missing)
+
+    for lang, names in translations.items():
+        join(f"countries.json[{lang}]", names.items(),
+             lambda record, text, lang=lang: record.names.__setitem__(lang, text))
+
+    def set_currency(record, value):
+        record.currency = value.get("currency")
+        record.currency_name = value.get("currency_name")
+
+    join("currency.json", currency.items(), set_currency)
+
+    join("country_language.json", languages.items(),
+         lambda record, value: setattr(record, "languages", tuple(value)))
+
+    return registry
@@ -0,0 +1,209 @@
+import functools
+import json
+import threading
+import time
+
+import metrics
+from disk_cache import shared_cache
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold errors in a row, lets one trial call through after reset_timeout.
+    # While the trial runs every other caller is short-circuited
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        # When the half-open trial started, None when no trial is running
+        self.trial_started_at = None
+        self.counters = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "short_circuits": 0,
+            "stale_served": 0,
+        }
+        self.last_error = None
+        self.last_latency = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.time()
+            if self.state == OPEN:
+                if now - self.opened_at < self.reset_timeout:
+                    self.counters["short_circuits"] += 1
+                    return False
+                self.state = HALF_OPEN
+                self.trial_started_at = now
+            elif self.state == HALF_OPEN:
+                # A trial that never reported back (its thread died) does not block the upstream forever
+                if self.trial_started_at is not None and now - self.trial_started_at < self.reset_timeout:
+                    self.counters["short_circuits"] += 1
+                    return False
+                self.trial_started_at = now
+            return True
+
+    def count_stale(self):
+        with self._lock:
+            self.counters["stale_served"] += 1
+
+    def record_success(self, latency):
+        with self._lock:
+            self.counters["calls"] += 1
+            self.counters["successes"] += 1
+            self.last_latency = latency
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                print(f"Upstream {self.name}: circuit closed, {self._totals()}")
+            self.state = CLOSED
+            self.trial_started_at = None
+
+    def record_failure(self, error, latency=None):
+        with self._lock:
+            self.counters["calls"] += 1
+            self.counters["failures"] += 1
+            self.last_error = repr(error)
+            self.last_latency = latency
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"Upstream {self.name}: circuit open ({self.last_error}), {self._totals()}")
+                self.state = OPEN
+                self.opened_at = time.time()
+            self.trial_started_at = None
+
+    # Caller holds the lock. Logged with every state change, so the counters show up without /metrics
+    def _totals(self):
+        return ", ".join(f"{value} {name}" for name, value in self.counters.items())
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "last_error": self.last_error,
+                "last_latency": self.last_latency,
+                **self.counters,
+            }
+
+
+BREAKERS = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name):
+    with _breakers_lock:
+        if name not in BREAKERS:
+            BREAKERS[name] = CircuitBreaker(name)
+        return BREAKERS[name]
+
+
+def health_snapshot():
+    return {name: b.snapshot() for name, b in list(BREAKERS.items())}
+
+
+# Runs fn through the breaker of an upstream, failing fast while it is open
+def call_upstream(name, fn, *args, **kwargs):
+    b = breaker(name)
+    if not b.allow():
+        metrics.UPSTREAM_REQUESTS.inc(name, "short_circuit")
+        raise UpstreamUnavailable(f"{name} circuit is open")
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as ex:
+        latency = time.perf_counter() - start
+        b.record_failure(ex, latency)
+        metrics.UPSTREAM_REQUESTS.inc(name, "failure")
+        metrics.UPSTREAM_LATENCY.observe(latency, name)
+        raise
+    latency = time.perf_counter() - start
+    b.record_success(latency)
+    metrics.UPSTREAM_REQUESTS.inc(name, "success")
+    metrics.UPSTREAM_LATENCY.observe(latency, name)
+    return result
+
+
+# Caches results per arguments; past ttl the last value is served stale while a thread refreshes it.
+# With shared set, values also go to that namespace of cache.db so every worker and restart reuses them
+def resilient(name, ttl, stale_ttl, default=None, shared=None):
+    def decorator(fn):
+        cache = {}
+        refreshing = set()
+        lock = threading.Lock()
+
+        def store(args, value):
+            with lock:
+                cache[args] = (value, time.time())
+            if shared:
+                shared_cache().set(shared, json.dumps(args), value)
+
+        def lookup(args):
+            entry = cache.get(args)
+            # Once the local copy is old another worker may already have refreshed it
+            if shared and (entry is None or time.time() - entry[1] > ttl):
+                stored = shared_cache().get(shared, json.dumps(args))
+                if stored:
+                    value, age = stored
+                    stored_at = time.time() - age
+                    if entry is None or stored_at > entry[1]:
+                        entry = (value, stored_at)
+                        with lock:
+                            cache[args] = entry
+            return entry
+
+        def refresh(args):
+            try:
+                store(args, call_upstream(name, fn, *args))
+            except Exception:
+                pass
+            finally:
+                with lock:
+                    refreshing.discard(args)
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            entry = lookup(args)
+            if entry:
+                age = time.time() - entry[1]
+                if age <= ttl:
+                    metrics.CACHE_LOOKUPS.inc(name, "hit")
+                    return entry[0]
+                if age <= stale_ttl:
+                    metrics.CACHE_LOOKUPS.inc(name, "stale")
+                    breaker(name).count_stale()
+                    with lock:
+                        start_refresh = args not in refreshing
+                        refreshing.add(args)
+                    if start_refresh:
+                        threading.Thread(target=refresh, args=(args,), daemon=True).start()
+                    return entry[0]
+
+            metrics.CACHE_LOOKUPS.inc(name, "miss")
+            try:
+                value = call_upstream(name, fn, *args)
+            except Exception:
+                if entry:
+                    breaker(name).count_stale()
+                    return entry[0]
+                return default
+
+            store(args, value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import zlib
+
+from disk_cache import shared_cache
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+
+# One Flet web server per worker, only reachable through the proxy
+def start_worker(port, metrics_port=None):
+    env = dict(
+        os.environ,
+        FLET_SERVER_IP="127.0.0.1",
+        FLET_SERVER_PORT=str(port),
+        FLET_FORCE_WEB_SERVER="true",
+    )
+    if metrics_port:
+        env["WORLDAIR_METRICS_PORT"] = str(metrics_port)
+    return subprocess.Popen([sys.executable, os.path.join(base_path, "codigo.py")], cwd=base_path, env=env)
+
+
+# Request head read to find the client, asyncio's stream limit. The rest is piped untouched
+MAX_HEAD_BYTES = 2 ** 16
+
+
+# A Flet session lives in one process, so a client always goes back to the same worker
+def pick_worker(client, ports):
+    return ports[zlib.crc32(client.encode()) % len(ports)]
+
+
+# Behind a PaaS router every connection comes from the router, so the client is the first
+# address of X-Forwarded-For when the request has one. Without it this only balances
+# direct client connections
+def client_address(head, peer):
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"x-forwarded-for":
+            client = value.split(b",")[0].strip().decode("latin-1")
+            if client:
+                return client
+    return peer
+
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def handle_client(client_reader, client_writer, ports):
+    peer = client_writer.get_extra_info("peername")[0]
+    try:
+        head = await client_reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as ex:
+        head = ex.partial
+    except asyncio.LimitOverrunError:
+        head = await client_reader.read(MAX_HEAD_BYTES)
+    except ConnectionError:
+        client_writer.close()
+        return
+    try:
+        worker_reader, worker_writer = await asyncio.open_connection(
+            "127.0.0.1", pick_worker(client_address(head, peer), ports)
+        )
+    except OSError:
+        client_writer.close()
+        return
+    worker_writer.write(head)
+    await asyncio.gather(pipe(client_reader, worker_writer), pipe(worker_reader, client_writer))
+
+
+async def supervise(workers, ports, metrics_ports, interval=2):
+    while True:
+        await asyncio.sleep(interval)
+        for i, process in enumerate(workers):
+            if process.poll() is not None:
+                print(f"Worker on port {ports[i]} exited ({process.returncode}), restarting")
+                workers[i] = start_worker(ports[i], metrics_ports[i])
+
+
+async def serve(host, port, ports, workers, metrics_ports):
+    server = await asyncio.start_server(
+        lambda r, w: handle_client(r, w, ports), host, port
+    )
+    print(f"Serving {len(ports)} workers on http://{host}:{port}")
+    async with server:
+        await asyncio.gather(server.serve_forever(), supervise(workers, ports, metrics_ports))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several app workers behind a sticky proxy")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8550)))
+    parser.add_argument("--base-port", type=int, default=9100, help="first port of the workers")
+    parser.add_argument("--metrics-base-port", type=int, default=int(os.environ.get("METRICS_BASE_PORT", 0)),
+                        help="first port of the workers' /metrics endpoints, 0 to turn them off")
+    args = parser.parse_args()
+
+    # Creates cache.db in WAL mode before the workers open it
+    shared_cache()
+
+    ports = [args.base_port + i for i in range(args.workers)]
+    metrics_ports = [args.metrics_base_port + i if args.metrics_base_port else None for i in range(args.workers)]
+    workers = [start_worker(p, m) for p, m in zip(ports, metrics_ports)]
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        asyncio.run(serve(args.host, args.port, ports, workers, metrics_ports))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import sys
+import threading
+import weakref
+
+from i18n import catalog
+
+# Every live SessionState of this process, for the memory metric and the load test
+_states = weakref.WeakSet()
+_lock = threading.Lock()
+
+
+class SessionState:
+    # Everything one session keeps between events, a fixed slot each
+    FIELDS = (
+        # Route form
+        "selected_origin", "selected_destiny", "selected_class", "selected_season", "selected_airline",
+        # User settings
+        "settings", "current_language", "lang", "current_currency", "current_distance_unit", "current_temperature",
+        "distance_model", "destiny_currency",
+        # Navigation and the views kept alive
+        "current_index", "current_view", "views", "last_width",
+        # Search history, the search waiting for home and home's calculate function
+        "search_history", "pending_search", "calculate_fn",
+        # Destination data prefetched when a route is calculated
+        "bundle_destiny", "bundle_data", "bundle_future", "bundle_fetched_at",
+        # Map points and markers
+        "map_points", "map_circles", "cluster_markers",
+        # Controls the handlers update, None until their view is built
+        "navigation_bar", "mini_map", "mini_marker_layer", "mini_polyline_layer",
+        "origin_field", "destiny_field", "class_dropdown", "season_dropdown", "airline_dropdown",
+        "map", "marker_layer", "circle_layer", "buscador", "suggestions",
+    )
+    __slots__ = FIELDS + ("__weakref__",)
+
+    def __init__(self, settings):
+        for name in self.FIELDS:
+            setattr(self, name, None)
+
+        self.settings = settings
+        self.current_language = settings.get("language", "en")
+        # The compiled catalog of current_language, lang["key"] like the old dicts
+        self.lang = catalog(self.current_language)
+        self.current_currency = settings.get("currency", "USD")
+        self.current_distance_unit = settings.get("distance_unit", "km")
+        self.current_temperature = settings.get("temperature_unit", "°C")
+        # "spherical" (haversine) or "ellipsoidal" (WGS-84 geodesic)
+        self.distance_model = settings.get("distance_model", "spherical")
+        # Also price quotes in the currency of the destination
+        self.destiny_currency = settings.get("destiny_currency", False)
+
+        self.current_index = 0
+        self.views = {}
+        self.last_width = 0
+        self.search_history = []
+        self.bundle_fetched_at = 0
+        self.cluster_markers = {}
+        with _lock:
+            _states.add(self)
+
+    # Bytes of the object and the containers it owns, controls not included
+    def footprint(self):
+        size = sys.getsizeof(self)
+        for name in ("settings", "views", "search_history", "cluster_markers", "pending_search"):
+            value = getattr(self, name)
+            if value is not None:
+                size += sys.getsizeof(value)
+        for item in self.search_history:
+            size += sys.getsizeof(item)
+        return size
+
+
+# footprint() of every session still alive in this process
+def live_footprints():
+    with _lock:
+        states = list(_states)
+    return [state.footprint() for state in states]
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import weakref
+
+# Tasks that live as long as the session, not cancelled when the view changes
+SESSION_SCOPE = "session"
+
+_registries = weakref.WeakSet()
+_lock = threading.Lock()
+
+
+class TaskRegistry:
+    # Every coroutine and thread pool job started by one session, grouped by the view that owns it
+    def __init__(self, page):
+        self.page = page
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.counters = {"started": 0, "finished": 0, "cancelled": 0}
+        with _lock:
+            _registries.add(self)
+
+    def _track(self, future, name, scope):
+        with self._lock:
+            self._tasks[future] = (name, scope)
+            self.counters["started"] += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            if self._tasks.pop(future, None) is None:
+                return
+            if future.cancelled():
+                self.counters["cancelled"] += 1
+            else:
+                self.counters["finished"] += 1
+
+    # Same as page.run_task, returns the concurrent future
+    def start(self, name, handler, *args, scope=SESSION_SCOPE):
+        return self._track(self.page.run_task(handler, *args), name, scope)
+
+    # Blocking call on the default executor, cancelling drops it if it did not start yet
+    def in_thread(self, name, fn, *args, scope=SESSION_SCOPE):
+        loop = asyncio.get_running_loop()
+        return self._track(loop.run_in_executor(None, fn, *args), name, scope)
+
+    # Async event handlers are started by Flet, they register themselves
+    def track_current(self, name, scope=SESSION_SCOPE):
+        task = asyncio.current_task()
+        if task is not None and task not in self._tasks:
+            self._track(task, name, scope)
+
+    # Without scope everything is cancelled (disconnect)
+    def cancel(self, scope=None):
+        with self._lock:
+            futures = [f for f, (_, s) in self._tasks.items() if scope is None or s == scope]
+        for future in futures:
+            future.cancel()
+        return len(futures)
+
+    def live(self):
+        counts = {}
+        with self._lock:
+            for name, _ in self._tasks.values():
+                counts[name] = counts.get(name, 0) + 1
+        return counts
+
+
+# The registry of one session, for tools that drive a page from outside
+def registry_for(page):
+    with _lock:
+        for registry in _registries:
+            if registry.page is page:
+                return registry
+    return None
+
+
+# Live tasks of every session in this process
+def live_task_counts():
+    with _lock:
+        registries = list(_registries)
+    return [registry.live() for registry in registries]
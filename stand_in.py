@@ -0,0 +1,340 @@
+import argparse
+import base64
+import csv
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+from upstreams import REAL_URLS
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_PORT = 8700
+
+# Latency in milliseconds (min, max) and the share of requests that fail, per service.
+# "realistic" is roughly what the real services answer with from Europe
+PROFILES = {
+    "fast": {"default": {"latency": (0, 0), "error_rate": 0}},
+    "realistic": {
+        "default": {"latency": (40, 120), "error_rate": 0},
+        "open-meteo": {"latency": (80, 250), "error_rate": 0},
+        "timeapi": {"latency": (150, 600), "error_rate": 0.01},
+        "er-api": {"latency": (60, 200), "error_rate": 0},
+        "geoapify": {"latency": (120, 400), "error_rate": 0},
+        "nominatim": {"latency": (200, 900), "error_rate": 0.01},
+        "osm-tiles": {"latency": (20, 80), "error_rate": 0},
+    },
+    "flaky": {
+        "default": {"latency": (100, 1500), "error_rate": 0.1, "timeout_rate": 0.05},
+    },
+}
+
+ERROR_STATUSES = (500, 502, 503, 429)
+# Longer than any UPSTREAM_TIMEOUT in the app, so the client gives up first
+TIMEOUT_SECONDS = 30
+
+# Query parameters left out of cassette keys, API keys never end up in a file
+SECRET_PARAMS = {"apiKey", "api_key", "key"}
+
+# Rough USD rates of the majors, the rest of currency.json gets a stable made-up rate
+KNOWN_RATES = {
+    "USD": 1, "EUR": 0.92, "GBP": 0.79, "JPY": 151.0, "CHF": 0.90, "CAD": 1.36, "AUD": 1.52,
+    "CNY": 7.23, "INR": 83.4, "MXN": 17.1, "BRL": 5.05, "KRW": 1350.0, "RUB": 92.0, "ARS": 870.0,
+}
+
+
+def load_json(name):
+    with open(os.path.join(base_path, name), "r", encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+def load_countries():
+    with open(os.path.join(base_path, "coordinates-Sheet.csv"), "r", encoding="utf-8-sig") as f:
+        return [(row["country"], float(row["lat"]), float(row["lon"])) for row in csv.DictReader(f)]
+
+
+COUNTRIES = load_countries()
+CURRENCY_CODES = sorted({v["currency"] for v in load_json("currency.json").values() if v.get("currency")})
+
+
+# Same input, same answer: synthetic data is stable between runs
+def seeded(*parts):
+    return random.Random(zlib.crc32(repr(parts).encode()))
+
+
+def floats(params, name):
+    return [float(v) for v in params.get(name, "0").split(",")]
+
+
+def synth_open_meteo(path, params):
+    items = []
+    for lat, lon in zip(floats(params, "latitude"), floats(params, "longitude")):
+        rng = seeded("weather", round(lat, 2), round(lon, 2))
+        items.append({
+            "latitude": lat,
+            "longitude": lon,
+            "current_weather": {
+                "temperature": round(30 - abs(lat) * 0.55 + rng.uniform(-4, 4), 1),
+                "windspeed": round(rng.uniform(0, 40), 1),
+                "winddirection": rng.randrange(360),
+                "weathercode": rng.choice((0, 1, 2, 3, 45, 61, 63, 71, 80, 95)),
+                "time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:00"),
+            },
+        })
+    return json_body(items[0] if len(items) == 1 else items)
+
+
+def synth_timeapi(path, params):
+    lon = floats(params, "longitude")[0]
+    hours = max(-12, min(14, round(lon / 15)))
+    # Etc/GMT zones have the sign the other way round
+    zone = "Etc/UTC" if hours == 0 else f"Etc/GMT{-hours:+d}"
+    local = datetime.now(timezone.utc) + timedelta(hours=hours)
+    return json_body({
+        "timeZone": zone,
+        "currentLocalTime": local.replace(tzinfo=None).isoformat(),
+        "currentUtcOffset": {"seconds": hours * 3600},
+        "hasDayLightSaving": False,
+        "isDayLightSavingActive": False,
+    })
+
+
+def synth_er_api(path, params):
+    rates = {code: round(seeded("rate", code).uniform(0.3, 3000), 4) for code in CURRENCY_CODES}
+    rates.update(KNOWN_RATES)
+    return json_body({"result": "success", "base_code": "USD", "time_last_update_unix": int(time.time()), "rates": rates})
+
+
+def synth_geoapify(path, params):
+    # filter=circle:lon,lat,radius
+    lon, lat = (float(v) for v in params.get("filter", "circle:0,0").split(":")[1].split(",")[:2])
+    kinds = ("Cathedral", "Old Town", "Museum", "Castle", "Viewpoint", "Market", "Botanical Garden")
+    rng = seeded("places", round(lat, 3), round(lon, 3))
+    features = []
+    for i in range(int(params.get("limit", 5))):
+        features.append({
+            "type": "Feature",
+            "properties": {"name": f"{rng.choice(kinds)} {i + 1}", "lat": lat, "lon": lon},
+            "geometry": {"type": "Point", "coordinates": [lon + rng.uniform(-0.05, 0.05), lat + rng.uniform(-0.05, 0.05)]},
+        })
+    return json_body({"type": "FeatureCollection", "features": features})
+
+
+def synth_nominatim(path, params):
+    query = params.get("q", "").strip().lower()
+    limit = int(params.get("limit", 5))
+    results = [
+        {"display_name": name, "lat": str(lat), "lon": str(lon)}
+        for name, lat, lon in COUNTRIES if query and query in name.lower()
+    ][:limit]
+    if not results and query:
+        rng = seeded("geocode", query)
+        results = [{
+            "display_name": params["q"].strip().title(),
+            "lat": str(round(rng.uniform(-60, 70), 4)),
+            "lon": str(round(rng.uniform(-180, 180), 4)),
+        }]
+    return json_body(results)
+
+
+def png(width, height, color):
+    row = b"\x00" + bytes(color) * width
+    raw = zlib.compress(row * height, 9)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", raw) + chunk(b"IEND", b""))
+
+
+_tiles = {}
+
+
+# A plain 256x256 tile, the colour only tells zoom levels apart
+def synth_osm_tiles(path, params):
+    z = int(path.strip("/").split("/")[0] or 0)
+    if z not in _tiles:
+        shade = 200 - min(z, 19) * 5
+        _tiles[z] = png(256, 256, (shade, shade + 20, 255))
+    return 200, "image/png", _tiles[z]
+
+
+SYNTH = {
+    "open-meteo": synth_open_meteo,
+    "timeapi": synth_timeapi,
+    "er-api": synth_er_api,
+    "geoapify": synth_geoapify,
+    "nominatim": synth_nominatim,
+    "osm-tiles": synth_osm_tiles,
+}
+
+
+def json_body(data):
+    return 200, "application/json", json.dumps(data).encode()
+
+
+def cassette_key(service, path, params):
+    public = sorted((k, v) for k, v in params.items() if k not in SECRET_PARAMS)
+    return f"{service}{path}?{urlencode(public)}"
+
+
+class Cassette:
+    # Recorded responses in one JSON file, bodies in base64 so tiles fit too
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return entry["status"], entry["content_type"], base64.b64decode(entry["body"])
+
+    def put(self, key, status, content_type, body):
+        with self._lock:
+            self.entries[key] = {
+                "status": status,
+                "content_type": content_type,
+                "body": base64.b64encode(body).decode(),
+            }
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+
+def forward(service, path, query, headers):
+    url = REAL_URLS[service] + path + (f"?{query}" if query else "")
+    r = requests.get(url, headers=headers, timeout=15)
+    return r.status_code, r.headers.get("Content-Type", "application/octet-stream"), r.content
+
+
+class StandIn:
+    def __init__(self, mode, profile, cassette, fallback=True):
+        self.mode = mode
+        self.profile = profile
+        self.cassette = cassette
+        self.fallback = fallback
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def rules(self, service):
+        return self.profile.get(service) or self.profile.get("default") or {}
+
+    # Sleeps and maybe fails like the real service would, returns an error response or None
+    def inject(self, service):
+        rules = self.rules(service)
+        low, high = rules.get("latency", (0, 0))
+        if high:
+            time.sleep(random.uniform(low, high) / 1000)
+        roll = random.random()
+        if roll < rules.get("timeout_rate", 0):
+            time.sleep(TIMEOUT_SECONDS)
+            return 504, "text/plain", b"stand-in timeout"
+        if roll < rules.get("timeout_rate", 0) + rules.get("error_rate", 0):
+            return random.choice(ERROR_STATUSES), "text/plain", b"stand-in error"
+        return None
+
+    def respond(self, service, path, query, headers):
+        params = dict(parse_qsl(query))
+        key = cassette_key(service, path, params)
+        with self._lock:
+            self.counts[service] = self.counts.get(service, 0) + 1
+
+        if self.mode == "record":
+            # Real latency and real errors, nothing injected
+            response = forward(service, path, query, headers)
+            self.cassette.put(key, *response)
+            return response
+
+        error = self.inject(service)
+        if error:
+            return error
+        if self.mode == "replay":
+            response = self.cassette.get(key)
+            if response is not None:
+                return response
+            if not self.fallback:
+                return 404, "text/plain", f"not in cassette: {key}".encode()
+        return SYNTH[service](path, params)
+
+
+def make_handler(stand_in):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            service, _, path = url.path.lstrip("/").partition("/")
+            if service not in SYNTH:
+                self.send_reply(404, "text/plain", b"unknown service")
+                return
+            headers = {"User-Agent": self.headers.get("User-Agent", "WorldAirApp")}
+            try:
+                status, content_type, body = stand_in.respond(service, "/" + path, url.query, headers)
+            except Exception as ex:
+                status, content_type, body = 502, "text/plain", str(ex).encode()
+            self.send_reply(status, content_type, body)
+
+        def send_reply(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            # The map tiles are loaded by the browser from another origin
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def load_profile(name):
+    if name in PROFILES:
+        return PROFILES[name]
+    # Otherwise a JSON file with the same shape, e.g. {"default": {"latency": [50, 200], "error_rate": 0.02}}
+    with open(name, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the external services, start the app with WORLDAIR_STANDIN=http://host:port"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("STANDIN_PORT", DEFAULT_PORT)))
+    parser.add_argument("--mode", choices=("synth", "record", "replay"), default="synth")
+    parser.add_argument("--cassette", default=os.path.join(base_path, "stand_in_cassette.json"))
+    parser.add_argument("--profile", default="fast", help=f"{', '.join(PROFILES)} or a JSON file")
+    parser.add_argument("--strict", action="store_true", help="in replay mode, 404 instead of synthetic data on a miss")
+    args = parser.parse_args()
+
+    cassette = Cassette(args.cassette) if args.mode != "synth" else None
+    stand_in = StandIn(args.mode, load_profile(args.profile), cassette, fallback=not args.strict)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(stand_in))
+    server.daemon_threads = True
+    print(f"Stand-in ({args.mode}, profile {args.profile}) on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Requests served: {stand_in.counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,6 @@
-flet run codigo.py --web --port $PORT
\ No newline at end of file
+python build_catalogs.py || exit 1
+
+if [ "${WORKERS:-1}" -gt 1 ]; then
+    exec python serve.py --workers $WORKERS --port $PORT
+fi
+flet run codigo.py --web --port $PORT
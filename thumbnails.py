@@ -0,0 +1,272 @@
+import hashlib
+import json
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+
+import requests
+
+from geodesy import interpolate_great_circle
+from registry import build_registry
+from resilience import call_upstream
+from upstreams import REAL_URLS, base_url
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+# Inside the assets dir, so the browser loads them over HTTP and not through the websocket.
+# The load test points it at its scratch dir
+THUMBNAIL_DIR = os.environ.get("WORLDAIR_THUMBNAIL_DIR", os.path.join(base_path, "assets", "thumbnails"))
+THUMBNAIL_URL = "/thumbnails"
+MAX_THUMBNAILS = int(os.environ.get("WORLDAIR_MAX_THUMBNAILS", 500))
+
+# The OSM zoom 0 tile is the whole world in 256x256, halved for a thumbnail
+SIZE = 128
+MAX_LATITUDE = 85.0511
+PATH_STEPS = 64
+
+OCEAN = (170, 211, 223)
+LAND = (242, 239, 233)
+ROUTE = (30, 90, 220)
+ORIGIN = (20, 150, 60)
+DESTINY = (210, 40, 40)
+
+USER_AGENT = "WorldAirApp"
+
+# Without the real world tile the country dots are used, and the tile is tried again after this
+BASEMAP_RETRY_SECONDS = 10 * 60
+
+# pixels, whether they are the real OSM tile, and when to try the tile again if not
+_basemap = {"pixels": None, "real": False, "retry_at": 0, "fallback": None}
+_lock = threading.Lock()
+
+
+def write_png(path, width, height, pixels):
+    raw = b"".join(b"\x00" + bytes(v for pixel in row for v in pixel) for row in pixels)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    data = (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 9))
+            + chunk(b"IEND", b""))
+    # Written aside then renamed, a worker never serves half a file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+# 8-bit grey, RGB, palette, grey+alpha and RGBA PNGs, enough for OSM tiles. Rows of RGB tuples
+def read_png(data):
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("not a PNG")
+    offset = 8
+    idat = b""
+    palette = None
+    while offset < len(data):
+        size, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        body = data[offset + 8:offset + 8 + size]
+        offset += 12 + size
+        if kind == b"IHDR":
+            width, height, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = [tuple(body[i:i + 3]) for i in range(0, len(body), 3)]
+        elif kind == b"IDAT":
+            idat += body
+        elif kind == b"IEND":
+            break
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color)
+    if depth != 8 or channels is None or interlace:
+        raise ValueError(f"unsupported PNG (depth {depth}, color type {color}, interlace {interlace})")
+
+    raw = zlib.decompress(idat)
+    stride = width * channels
+    rows = []
+    previous = bytearray(stride)
+    pos = 0
+    for _ in range(height):
+        kind = raw[pos]
+        line = bytearray(raw[pos + 1:pos + 1 + stride])
+        pos += 1 + stride
+        for i in range(stride):
+            left = line[i - channels] if i >= channels else 0
+            up = previous[i]
+            if kind == 1:
+                line[i] = (line[i] + left) & 255
+            elif kind == 2:
+                line[i] = (line[i] + up) & 255
+            elif kind == 3:
+                line[i] = (line[i] + (left + up) // 2) & 255
+            elif kind == 4:
+                upper_left = previous[i - channels] if i >= channels else 0
+                line[i] = (line[i] + paeth(left, up, upper_left)) & 255
+        previous = line
+        if color == 3:
+            rows.append([palette[v] for v in line])
+        elif color in (0, 4):
+            rows.append([(line[i],) * 3 for i in range(0, stride, channels)])
+        else:
+            rows.append([tuple(line[i:i + 3]) for i in range(0, stride, channels)])
+    return rows
+
+
+# Averages 2x2 blocks, 256 -> 128
+def halve(rows):
+    out = []
+    for y in range(0, len(rows) - 1, 2):
+        top, bottom = rows[y], rows[y + 1]
+        out.append([
+            tuple((top[x][c] + top[x + 1][c] + bottom[x][c] + bottom[x + 1][c]) // 4 for c in range(3))
+            for x in range(0, len(top) - 1, 2)
+        ])
+    return out
+
+
+def project(lat, lon, size=SIZE):
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = (lon + 180) / 360 * size
+    y = (1 - math.log(math.tan(math.radians(lat)) + 1 / math.cos(math.radians(lat))) / math.pi) / 2 * size
+    return x, y
+
+
+def fetch_world_tile():
+    r = requests.get(base_url("osm-tiles") + "/0/0/0.png", headers={"User-Agent": USER_AGENT}, timeout=10)
+    r.raise_for_status()
+    return r.content
+
+
+def load(name):
+    with open(os.path.join(base_path, name), "r", encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+# Without network: ocean with a dot of land at every country centroid
+def fallback_basemap():
+    registry = build_registry(os.path.join(base_path, "coordinates-Sheet.csv"), {}, load("currency.json"), {})
+    rows = [[OCEAN] * SIZE for _ in range(SIZE)]
+    for record in registry:
+        x, y = project(record.lat, record.lon)
+        dot(rows, x, y, 2, LAND)
+    return rows
+
+
+# The OSM world tile and True, or a stand-in map and False. Only a tile from the real OSM
+# server is kept on disk; a stand-in tile or the country dots stay in memory until the next try
+def basemap():
+    if _basemap["real"] or (_basemap["pixels"] is not None and time.time() < _basemap["retry_at"]):
+        return _basemap["pixels"], _basemap["real"]
+    with _lock:
+        if _basemap["real"] or (_basemap["pixels"] is not None and time.time() < _basemap["retry_at"]):
+            return _basemap["pixels"], _basemap["real"]
+        path = os.path.join(THUMBNAIL_DIR, "_basemap.png")
+        try:
+            with open(path, "rb") as f:
+                pixels, real = read_png(f.read()), True
+        except (OSError, ValueError):
+            real = base_url("osm-tiles") == REAL_URLS["osm-tiles"]
+            try:
+                pixels = halve(read_png(call_upstream("osm-tiles", fetch_world_tile)))
+            except Exception as ex:
+                print(f"Thumbnails: world tile not available ({ex}), using the country dots for now")
+                if _basemap["fallback"] is None:
+                    _basemap["fallback"] = fallback_basemap()
+                pixels, real = _basemap["fallback"], False
+            if real:
+                os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+                write_png(path, SIZE, SIZE, pixels)
+        _basemap.update(pixels=pixels, real=real, retry_at=time.time() + BASEMAP_RETRY_SECONDS)
+        return pixels, real
+
+
+def dot(rows, x, y, radius, color):
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dx * dx + dy * dy <= radius * radius:
+                px, py = int(x) + dx, int(y) + dy
+                if 0 <= px < SIZE and 0 <= py < SIZE:
+                    rows[py][px] = color
+
+
+def line(rows, x0, y0, x1, y1, color):
+    steps = max(1, int(max(abs(x1 - x0), abs(y1 - y0))))
+    for i in range(steps + 1):
+        t = i / steps
+        dot(rows, x0 + (x1 - x0) * t, y0 + (y1 - y0) * t, 1, color)
+
+
+def render(base, lat1, lon1, lat2, lon2):
+    rows = [list(row) for row in base]
+    points = [project(lat, lon) for lat, lon in interpolate_great_circle(lat1, lon1, lat2, lon2, PATH_STEPS)]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        # A jump of more than half the map is the path crossing the antimeridian
+        if abs(x1 - x0) > SIZE / 2:
+            continue
+        line(rows, x0, y0, x1, y1, ROUTE)
+    dot(rows, *project(lat1, lon1), 3, ORIGIN)
+    dot(rows, *project(lat2, lon2), 3, DESTINY)
+    return rows
+
+
+# Thumbnails drawn without the real world tile get their own name and are redrawn once it is back
+def thumbnail_name(lat1, lon1, lat2, lon2, real=True):
+    key = f"{lat1:.3f},{lon1:.3f},{lat2:.3f},{lon2:.3f}"
+    return f"route-{hashlib.sha1(key.encode()).hexdigest()[:16]}{'' if real else '-offline'}.png"
+
+
+def touch(name):
+    try:
+        os.utime(os.path.join(THUMBNAIL_DIR, name))
+    except OSError:
+        return None
+    return f"{THUMBNAIL_URL}/{name}"
+
+
+# Oldest used first: a hit touches the file, so mtime is the last use
+def evict(max_files=MAX_THUMBNAILS):
+    try:
+        names = [n for n in os.listdir(THUMBNAIL_DIR) if n.startswith("route-") and n.endswith(".png")]
+    except OSError:
+        return
+    if len(names) <= max_files:
+        return
+    paths = sorted((os.path.join(THUMBNAIL_DIR, n) for n in names), key=os.path.getmtime)
+    for path in paths[:len(paths) - max_files]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# Src for ft.Image if the thumbnail exists, never renders. Cheap enough for a view build
+def cached_thumbnail(lat1, lon1, lat2, lon2):
+    return touch(thumbnail_name(lat1, lon1, lat2, lon2)) or touch(thumbnail_name(lat1, lon1, lat2, lon2, False))
+
+
+# Renders the thumbnail if there is none on the current basemap, for a background thread
+def route_thumbnail(lat1, lon1, lat2, lon2):
+    base, real = basemap()
+    name = thumbnail_name(lat1, lon1, lat2, lon2, real)
+    src = touch(name)
+    if src:
+        return src
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    write_png(os.path.join(THUMBNAIL_DIR, name), SIZE, SIZE, render(base, lat1, lon1, lat2, lon2))
+    if real:
+        try:
+            os.remove(os.path.join(THUMBNAIL_DIR, thumbnail_name(lat1, lon1, lat2, lon2, False)))
+        except OSError:
+            pass
+    evict()
+    return f"{THUMBNAIL_URL}/{name}"
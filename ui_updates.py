@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+import flet as ft
+
+import metrics
+
+# Messages and bytes are only measured with WORLDAIR_UI_STATS=1, it wraps the connection and encodes every message twice
+MEASURE_BYTES = os.environ.get("WORLDAIR_UI_STATS") == "1"
+
+
+# control.page raises once a control was taken off the page, e.g. a view rebuilt before the flush
+def on_page(control):
+    while control is not None:
+        if isinstance(control, ft.Page):
+            return True
+        control = control.parent
+    return False
+
+
+def message_size(message):
+    import msgpack
+    from flet.controls.base_control import BaseControl
+    from flet.messaging.protocol import configure_encode_object_for_msgpack
+
+    return len(msgpack.packb(
+        [message.action, message.body],
+        default=configure_encode_object_for_msgpack(BaseControl),
+    ))
+
+
+class UpdateBatcher:
+    # Per session: handlers mark what changed, one flush per event loop tick sends it
+    def __init__(self, page):
+        self.page = page
+        self._dirty = []
+        self._handlers = set()
+        self._scheduled = False
+        self._lock = threading.Lock()
+        # handler -> requested updates, flushes, messages and bytes sent
+        self.stats = {}
+        self.flushes = 0
+        self._observed_flushes = 0
+
+    def _stat(self, handler):
+        if handler not in self.stats:
+            self.stats[handler] = {"requests": 0, "flushes": 0, "messages": 0, "bytes": 0}
+        return self.stats[handler]
+
+    # Without controls the whole page is diffed
+    def update(self, handler, *controls):
+        # Flet skips its own auto update after the event, the flush covers it
+        ft.context.mark_update_called()
+
+        with self._lock:
+            self._stat(handler)["requests"] += 1
+            self._handlers.add(handler)
+            for control in controls or (self.page,):
+                if control not in self._dirty:
+                    self._dirty.append(control)
+
+            if self._scheduled:
+                return
+            self._scheduled = True
+
+        try:
+            self.page.session.connection.loop.call_soon_threadsafe(self.flush)
+        except (AttributeError, RuntimeError):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, []
+            handlers, self._handlers = self._handlers, set()
+            self._scheduled = False
+        if not dirty:
+            return
+
+        if self.page in dirty:
+            targets = [self.page]
+        else:
+            # Controls inside another dirty control are covered by its diff
+            dirty_ids = {id(c) for c in dirty}
+            targets = [c for c in dirty if on_page(c) and not self._has_dirty_parent(c, dirty_ids)]
+        if not targets:
+            return
+
+        connection = self.page.session.connection if MEASURE_BYTES else None
+        sent = []
+        if connection is not None:
+            own = vars(connection).get("send_message")
+            send_message = connection.send_message
+
+            def counting_send(message):
+                sent.append(message)
+                send_message(message)
+
+            connection.send_message = counting_send
+        start = time.perf_counter()
+        try:
+            self.page.update(*targets)
+        finally:
+            if connection is not None:
+                if own is None:
+                    del connection.send_message
+                else:
+                    connection.send_message = own
+        metrics.UPDATE_SECONDS.observe(time.perf_counter() - start)
+        self.flushes += 1
+        for handler in handlers:
+            metrics.PAGE_UPDATES.inc(handler)
+
+        size = sum(message_size(m) for m in sent)
+        label = "+".join(sorted(handlers))
+        stat = self._stat(label)
+        stat["flushes"] += 1
+        stat["messages"] += len(sent)
+        stat["bytes"] += size
+
+    @staticmethod
+    def _has_dirty_parent(control, dirty_ids):
+        parent = control.parent
+        while parent is not None:
+            if id(parent) in dirty_ids:
+                return True
+            parent = parent.parent
+        return False
+
+    # Flushes since the last call. A session that reconnects is observed once per connection,
+    # never with the flushes an earlier disconnect already counted
+    def take_flushes(self):
+        count, self._observed_flushes = self.flushes - self._observed_flushes, self.flushes
+        return count
+
+    def report(self):
+        return [
+            f"{handler}: {s['requests']} requested, {s['flushes']} flushes, "
+            f"{s['messages']} messages, {s['bytes']} bytes"
+            for handler, s in sorted(self.stats.items())
+        ]
@@ -0,0 +1,27 @@
+import os
+
+# Real base URL of every external service the app talks to
+REAL_URLS = {
+    "open-meteo": "https://api.open-meteo.com",
+    "timeapi": "https://www.timeapi.io",
+    "er-api": "https://open.er-api.com",
+    "geoapify": "https://api.geoapify.com",
+    "nominatim": "https://nominatim.openstreetmap.org",
+    "osm-tiles": "https://tile.openstreetmap.org",
+}
+
+# The one setting: the address of a stand_in.py server, e.g. http://127.0.0.1:8700.
+# When set, every service is reached through it as <stand-in>/<service>/...
+STANDIN_ENV = "WORLDAIR_STANDIN"
+
+
+# Read on every call, so a harness can start the stand-in before the app modules are imported
+def base_url(service):
+    standin = os.environ.get(STANDIN_ENV, "").rstrip("/")
+    if standin:
+        return f"{standin}/{service}"
+    return REAL_URLS[service]
+
+
+def tile_url_template():
+    return base_url("osm-tiles") + "/{z}/{x}/{y}.png"
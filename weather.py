@@ -0,0 +1,112 @@
+import threading
+import time
+
+import requests
+
+import metrics
+from disk_cache import shared_cache
+from resilience import call_upstream
+from upstreams import base_url
+
+# Open-Meteo accepts comma separated coordinates, one request per batch
+BATCH_SIZE = 50
+REFRESH_SECONDS = 15 * 60
+MAX_AGE_SECONDS = 60 * 60
+
+# (lat, lon) -> (temperature, weather_code, fetched_at), shared by every session.
+# cache.db holds the same values for the other workers and the next start
+WEATHER = {}
+_lock = threading.Lock()
+_warmer = {"thread": None}
+
+
+def weather_key(lat, lon):
+    return round(lat, 2), round(lon, 2)
+
+
+def disk_key(key):
+    return f"{key[0]:.2f},{key[1]:.2f}"
+
+
+def store_weather(lat, lon, temp, weather_code):
+    store_weather_many([((lat, lon), (temp, weather_code))])
+
+
+def store_weather_many(items):
+    now = time.time()
+    rows = []
+    with _lock:
+        for (lat, lon), (temp, weather_code) in items:
+            key = weather_key(lat, lon)
+            WEATHER[key] = (temp, weather_code, now)
+            rows.append((disk_key(key), [temp, weather_code]))
+    shared_cache().set_many("weather", rows)
+
+
+def cached_weather(lat, lon, max_age=MAX_AGE_SECONDS):
+    key = weather_key(lat, lon)
+    entry = WEATHER.get(key)
+    if entry is None or time.time() - entry[2] > max_age:
+        # Maybe another worker's warmer already fetched it
+        stored = shared_cache().get("weather", disk_key(key))
+        if stored is None or stored[1] > max_age:
+            metrics.CACHE_LOOKUPS.inc("weather", "miss")
+            return None
+        (temp, weather_code), age = stored
+        entry = (temp, weather_code, time.time() - age)
+        with _lock:
+            WEATHER[key] = entry
+    metrics.CACHE_LOOKUPS.inc("weather", "hit")
+    return entry[0], entry[1]
+
+
+def fetch_weather_batch(coordinates):
+    params = {
+        "latitude": ",".join(f"{lat:.4f}" for lat, _ in coordinates),
+        "longitude": ",".join(f"{lon:.4f}" for _, lon in coordinates),
+        "current_weather": "true",
+    }
+    r = requests.get(base_url("open-meteo") + "/v1/forecast", params=params, timeout=15)
+    data = r.json()
+
+    # A single location comes back as an object, several as a list
+    if isinstance(data, dict):
+        data = [data]
+
+    results = []
+    for item in data:
+        current = item.get("current_weather") or {}
+        results.append((current.get("temperature"), current.get("weathercode")))
+    return results
+
+
+def refresh_weather(coordinates):
+    coordinates = list(coordinates)
+    for start in range(0, len(coordinates), BATCH_SIZE):
+        batch = coordinates[start:start + BATCH_SIZE]
+        try:
+            results = call_upstream("open-meteo", fetch_weather_batch, batch)
+        except Exception as ex:
+            print(f"Weather refresh failed: {ex}")
+            continue
+        store_weather_many(
+            (point, result) for point, result in zip(batch, results) if result[0] is not None
+        )
+
+
+# Background thread refreshing every location, started once per process.
+# Only the worker holding the lease for this period calls Open-Meteo, the others read cache.db
+def start_weather_warmer(coordinates, interval=REFRESH_SECONDS):
+    with _lock:
+        if _warmer["thread"] is not None:
+            return
+        coordinates = list(coordinates)
+
+        def run():
+            while True:
+                if shared_cache().claim("weather-warmer", interval):
+                    refresh_weather(coordinates)
+                time.sleep(interval)
+
+        _warmer["thread"] = threading.Thread(target=run, name="weather-warmer", daemon=True)
+        _warmer["thread"].start()